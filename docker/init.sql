@@ -26,4 +26,17 @@ CREATE TABLE feedback (
     feedback INTEGER NOT NULL,
     timestamp TIMESTAMP WITH TIME ZONE NOT NULL
 );
-CREATE TABLE files (file_name text, file_data bytea);
\ No newline at end of file
+CREATE TABLE files (file_name text, file_data bytea);
+CREATE TABLE index_watermarks (
+    database_name TEXT PRIMARY KEY,
+    change_id BIGINT NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL
+);
+CREATE TABLE llm_responses (
+    model_id TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    answer_data TEXT NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (model_id, prompt_hash)
+);
+CREATE INDEX llm_responses_timestamp ON llm_responses (timestamp);
\ No newline at end of file
@@ -1,10 +1,34 @@
 # repo.py
-from dagster import job, op, repository
-import psycopg2, os
+from dagster import DagsterRunStatus, In, Nothing, Out, RunRequest, RunsFilter, SkipReason, job, op, repository, sensor
+import psycopg2, os, json
 from elasticsearch import Elasticsearch
-from db import DBConnectionFactory
+from db import DBConnection
 from search import SearchFactory, SearchTypes
 
+# Seconds between two checks of the DDL changelogs, see ddl_change_sensor.
+DDL_SENSOR_INTERVAL = int(os.getenv("DDL_SENSOR_INTERVAL", 60))
+# Runs of incremental_etl_job requested for the same DDL changes before ddl_change_sensor gives up.
+DDL_SENSOR_MAX_ATTEMPTS = int(os.getenv("DDL_SENSOR_MAX_ATTEMPTS", 5))
+# Runs of incremental_etl_job which have not finished yet, see ddl_change_sensor.
+PENDING_RUN_STATUSES = [DagsterRunStatus.NOT_STARTED, DagsterRunStatus.QUEUED,
+                        DagsterRunStatus.STARTING, DagsterRunStatus.STARTED, DagsterRunStatus.CANCELING]
+
+
+def get_db_connection(db_name, read_only=True):
+    return DBConnection(\
+            db_type='postgresql',
+            db_name = db_name,
+            db_host = os.getenv("DAGSTER_PG_HOST"),
+            db_port = os.getenv("DAGSTER_PG_PORT"), 
+            db_user = os.getenv("DAGSTER_PG_USERNAME"),
+            db_password = os.getenv("DAGSTER_PG_PASSWORD"),
+            read_only=read_only
+    )
+
+
+def get_app_db_connection():
+    return get_db_connection('sql_generator', read_only=False)
+
 
 @op
 def extract_data_from_postgresql(context):
@@ -14,15 +38,7 @@ def extract_data_from_postgresql(context):
     #print(os.getenv("DAGSTER_PG_PASSWORD"))
     #print(os.getenv("DAGSTER_PG_HOST"))
     #print(os.getenv("DAGSTER_PG_PORT"))
-    db_conn = DBConnectionFactory.\
-        get_db_connection(\
-            db_type='postgres',
-            db_name = 'dagster',
-            db_host = os.getenv("DAGSTER_PG_HOST"),
-            db_port = os.getenv("DAGSTER_PG_PORT"), 
-            db_user = os.getenv("DAGSTER_PG_USERNAME") ,
-            db_password = os.getenv("DAGSTER_PG_PASSWORD")
-    )    
+    db_conn = get_db_connection('dagster')    
     #print("Connected to PostgreSQL")
 
     db_list = db_conn.get_database_list()
@@ -45,28 +61,138 @@ def load_data_into_elasticsearch(context, data):
 
 @op
 def load_data_into_fuzzy_search(context, data):
-    db_conn = DBConnectionFactory.\
-        get_db_connection(\
-            db_type='postgres',
-            db_name = 'sql_generator',
-            db_host = os.getenv("DAGSTER_PG_HOST"),
-            db_port = os.getenv("DAGSTER_PG_PORT"), 
-            db_user = os.getenv("DAGSTER_PG_USERNAME"),
-            db_password = os.getenv("DAGSTER_PG_PASSWORD"),
-            read_only=False
-    )   
+    db_conn = get_app_db_connection()   
 
     my_search = SearchFactory.get_search_provider(SearchTypes.FUZZY_SEARCH, db_conn=db_conn)
 
     for key, value in data.items():
         my_search.create_index(key, value)
 
+@op
+def load_data_into_bm25_search(context, data):
+    db_conn = get_app_db_connection()   
+
+    my_search = SearchFactory.get_search_provider(SearchTypes.BM25, db_conn=db_conn)
+
+    for key, value in data.items():
+        my_search.create_index(key, value)
+
+@op
+def load_data_into_vector_search(context, data):
+    db_conn = get_app_db_connection()   
+
+    my_search = SearchFactory.get_search_provider(SearchTypes.VECTOR, db_conn=db_conn)
+
+    for key, value in data.items():
+        my_search.create_index(key, value)
+
+@op
+def install_ddl_changelog(context):
+    """
+    Installs the DDL changelog and its event triggers in every database. Databases without
+    watermark start from their current last change, their indexes come from the full etl_job.
+    """
+    db_conn = get_app_db_connection()
+    watermarks = db_conn.get_index_watermarks()
+    new_watermarks = {}
+    for db_name in db_conn.get_database_list():
+        try:
+            change_id = db_conn.install_ddl_changelog(db_name)
+        except Exception as error:
+            context.log.error(f"Error installing DDL changelog in {db_name}: {error}")
+            continue
+        context.log.info(f"DDL changelog installed in {db_name}, last change {change_id}")
+        if db_name not in watermarks:
+            new_watermarks[db_name] = change_id
+    db_conn.save_index_watermarks(new_watermarks)
+
+@op(config_schema={"databases": [{"database_name": str, "after_id": int, "until_id": int}]},
+    out={"data": Out(), "watermarks": Out()})
+def extract_changed_databases(context):
+    """
+    Extracts the metadata of the databases with DDL changes, as requested by ddl_change_sensor.
+    Search indexes are built per database, so a changed table reindexes its whole database.
+    """
+    db_conn = get_app_db_connection()
+    data = {}
+    watermarks = {}
+    for database in context.op_config["databases"]:
+        db_name = database["database_name"]
+        changes = db_conn.get_ddl_changes(db_name, database["after_id"], database["until_id"])
+        context.log.info(f"{db_name}: {len(changes)} DDL changes to "
+                         f"{', '.join(changes['object_identity'].dropna().unique()) or 'no relation'}")
+        db_conn.set_curr_database(db_name)
+        data[db_name] = db_conn.get_metadata()
+        watermarks[db_name] = database["until_id"]
+    return data, watermarks
+
+@op(ins={"watermarks": In(), "fuzzy": In(Nothing), "bm25": In(Nothing), "vector": In(Nothing)})
+def save_index_watermarks(context, watermarks):
+    """
+    Records the last DDL change covered by the rebuilt indexes, once all of them are written.
+    """
+    get_app_db_connection().save_index_watermarks(watermarks)
+    context.log.info(f"Index watermarks: {watermarks}")
+
 @job
 def etl_job():
     data = extract_data_from_postgresql()
     load_data_into_elasticsearch(data)
     load_data_into_fuzzy_search(data)    
+    load_data_into_bm25_search(data)
+    load_data_into_vector_search(data)
+
+@job
+def setup_ddl_changelog_job():
+    install_ddl_changelog()
+
+@job
+def incremental_etl_job():
+    data, watermarks = extract_changed_databases()
+    save_index_watermarks(watermarks,
+                          fuzzy=load_data_into_fuzzy_search(data),
+                          bm25=load_data_into_bm25_search(data),
+                          vector=load_data_into_vector_search(data))
+
+@sensor(job=incremental_etl_job, minimum_interval_seconds=DDL_SENSOR_INTERVAL)
+def ddl_change_sensor(context):
+    """
+    Requests an incremental_etl_job run for the databases whose DDL changelog moved past their
+    index watermark, unless a run is still pending. The run key is the range of changes and an attempt
+    number kept in the sensor cursor: a failed run leaves the watermarks unchanged, so the same
+    range is requested again with the next attempt number, up to DDL_SENSOR_MAX_ATTEMPTS runs. After that
+    the range is skipped until new DDL changes arrive.
+    """
+    if context.instance.get_runs(filters=RunsFilter(job_name=incremental_etl_job.name, statuses=PENDING_RUN_STATUSES),
+                                 limit=1):
+        return SkipReason("An incremental_etl_job run is still pending")
+    db_conn = get_app_db_connection()
+    watermarks = db_conn.get_index_watermarks()
+    databases = []
+    for db_name in db_conn.get_database_list():
+        try:
+            change_id = db_conn.get_last_ddl_change(db_name)
+        except Exception as error:
+            context.log.warning(f"Error reading DDL changelog of {db_name}: {error}")
+            continue
+        if change_id is not None and change_id > watermarks.get(db_name, 0):
+            databases.append({"database_name": db_name, "after_id": watermarks.get(db_name, 0), "until_id": change_id})
+    if not databases:
+        return SkipReason("No DDL changes since the last indexing run")
+    changes = json.dumps({database["database_name"]: [database["after_id"], database["until_id"]]
+                          for database in databases}, sort_keys=True)
+    cursor = json.loads(context.cursor) if context.cursor else {}
+    attempt = cursor["attempt"] + 1 if cursor.get("changes") == changes else 0
+    if attempt >= DDL_SENSOR_MAX_ATTEMPTS:
+        return SkipReason(f"Gave up on DDL changes {changes} after {DDL_SENSOR_MAX_ATTEMPTS} failed runs")
+    context.update_cursor(json.dumps({"changes": changes, "attempt": attempt}))
+    if attempt > 0:
+        context.log.info(f"Retrying DDL changes {changes}, attempt {attempt}")
+    return RunRequest(
+        run_key=f"{changes}:{attempt}",
+        run_config={"ops": {"extract_changed_databases": {"config": {"databases": databases}}}}
+    )
 
 @repository
 def my_repository():
-    return [etl_job]
\ No newline at end of file
+    return [etl_job, setup_ddl_changelog_job, incremental_etl_job, ddl_change_sensor]
\ No newline at end of file
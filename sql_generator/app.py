@@ -1,11 +1,19 @@
-import os, re, uuid
+import os, uuid
 import streamlit as st
 import pandas as pd
 from db import DBConnection
+from log_writer import LogWriter
+from sql_guard import SQLGuard, VERDICT_CONFIRM, VERDICT_REJECT
 from search import SearchFactory, SearchTypes
-from llm import LLM, PromptGenerator
+from llm import LLM, PromptGenerator, extract_sql
+from question_cache import QuestionCache
+from preprocessor import pre_processor
 from time import time
 
+PREFETCH_DATABASES = int(os.getenv("PREFETCH_DATABASES", 3))
+# Rows per page of the SQL results
+SQL_PAGE_SIZE = int(os.getenv("SQL_PAGE_SIZE", 100))
+
 #------------------------------------------------ Initialization ------------------------------------------------
 def init_session_var(names: list[str], value=None):
     for name in names:
@@ -14,6 +22,8 @@ def init_session_var(names: list[str], value=None):
 
 @st.cache_resource(show_spinner=False)
 def init_application():   
+    # Load the NLP stack in the background while the app starts
+    pre_processor.load_async()
     db_conn = DBConnection(\
             db_type='postgresql',
             db_name = os.environ['POSTGRES_DB'],
@@ -24,13 +34,30 @@ def init_application():
             read_only=False
     )
     
-    llm_model = LLM("config/llm.yaml")
+    # Conversations and feedback are written in the background
+    log_writer = LogWriter(db_conn)
+    # Generated SQL is explained and checked against the cost limits before it runs
+    sql_guard = SQLGuard(db_conn)
+    llm_model = LLM("config/llm.yaml", db_conn=db_conn, log_writer=log_writer)
     search_providers = {}
     search_providers['Fuzzywuzzy'] = SearchFactory.get_search_provider(SearchTypes.FUZZY_SEARCH, db_conn=db_conn)
+    search_providers['BM25'] = SearchFactory.get_search_provider(SearchTypes.BM25, db_conn=db_conn)
+    search_providers['Vector'] = SearchFactory.get_search_provider(SearchTypes.VECTOR, db_conn=db_conn)
     search_providers['Elasticsearch'] = SearchFactory.get_search_provider(SearchTypes.ELASTICSEARCH)
+    # Warm the index cache with the most used databases
+    db_list = db_conn.get_database_list()
+    top_databases = [db for db in db_conn.get_top_databases(PREFETCH_DATABASES) if db in db_list]
+    search_providers['Fuzzywuzzy'].prefetch(top_databases)
+    search_providers['BM25'].prefetch(top_databases)
+    search_providers['Vector'].prefetch(top_databases)
     prompt_generator = PromptGenerator("templates/")
+    # SQL of questions with positive feedback is reused for near-duplicate questions
+    question_cache = QuestionCache.from_config(pre_processor)
+    if question_cache is not None:
+        question_cache.load(db_conn)
+        log_writer.add_listener(question_cache)
     
-    return db_conn, llm_model, search_providers, prompt_generator
+    return db_conn, log_writer, sql_guard, llm_model, search_providers, prompt_generator, question_cache
 
 @st.cache_data(show_spinner=False)
 def get_db_metadata(_db_conn: DBConnection):
@@ -38,7 +65,7 @@ def get_db_metadata(_db_conn: DBConnection):
     return db_list
 
 
-db_conn, llm_model, search_providers, prompt_generator = init_application()
+db_conn, log_writer, sql_guard, llm_model, search_providers, prompt_generator, question_cache = init_application()
 #db_list = db_conn.get_database_list()
 db_list = get_db_metadata(db_conn)
 llm_list = llm_model.get_model_list()
@@ -51,17 +78,47 @@ init_session_var(['sql_statement',
                   'sql_results',
                   'db_tables',
                   'conversation_id',
-                  'feedback',])
+                  'feedback',
+                  'sql_plan',])
 
 #------------------------------------------------ Business Logic ------------------------------------------------
 
 # Function to generate SQL statement (Main function)
-def generate_sql(user_question, db_selection, sp_selection, llm_selection, similarity_threshold, num_synonyms):
+# Without use_cache, the question cache and the LLM response cache are bypassed and the answer is regenerated.
+def generate_sql(user_question, db_selection, sp_selection, llm_selection, similarity_threshold, num_synonyms,
+                 use_cache=True):
     start_time = time()
     db_conn.set_curr_database(db_selection)    
     st.session_state['conversation_id'] = None
     conversation_id = str(uuid.uuid4())     
     st.session_state['feedback'] = None
+    cached_question = question_cache.lookup(db_selection, user_question) \
+        if question_cache is not None and use_cache else None
+    if cached_question is not None:
+        response_time = time() - start_time
+        response_data = {
+            "answer": f"<SQL>{cached_question['sql']}</SQL>",
+            "database_name": db_selection,
+            "model": "N/A (question cache)",
+            "search_provider": sp_selection,
+            "rag_parameters": str({"cached_conversation_id": cached_question['conversation_id'],
+                                   "similarity": round(cached_question['similarity'], 4)}),
+            "relevance": "N/A",
+            "relevance_explanation": "N/A",
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_tokens": 0,
+            "eval_prompt_tokens": 0,
+            "eval_completion_tokens": 0,
+            "eval_total_tokens": 0,
+            "llm_cost": 0,
+            "response_time": response_time,
+            "cached_conversation_id": cached_question['conversation_id']
+        }
+        st.session_state['conversation_id'] = conversation_id
+        log_writer.save_conversation(conversation_id, user_question, response_data)
+        return cached_question['sql'], (f"Reused the SQL of a similar question "
+                                        f"(similarity {cached_question['similarity']:.2f}): {cached_question['question']}")
     discovered_tables = search_providers[sp_selection].search_by_query(db_name=db_selection,
                                                         query=user_question, 
                                                         similarity_threshold=similarity_threshold, 
@@ -86,19 +143,28 @@ def generate_sql(user_question, db_selection, sp_selection, llm_selection, simil
             "llm_cost": 0,
             "response_time": response_time
         }
-        db_conn.save_conversation(conversation_id, user_question, response_data)    
+        log_writer.save_conversation(conversation_id, user_question, response_data)    
         return "No tables found", None
     
     prompt = prompt_generator.get_prompt(template_name='basic_prompt', 
                                          schema=discovered_tables, 
                                          instruction=user_question)
-    response_data = llm_model.prompt(llm_selection, prompt)
+    # The SQL is shown as soon as its closing tag arrives, while the explanation is still streamed
+    sql_placeholder = st.empty()
+    answer_placeholder = st.empty()
+    stream = llm_model.prompt_stream(llm_selection, prompt, use_cache=use_cache,
+                                     on_sql=lambda sql: sql_placeholder.code(sql, language='sql'))
+    for _ in stream:
+        answer_placeholder.text(stream.answer)
+    sql_placeholder.empty()
+    answer_placeholder.empty()
+    if stream.time_to_sql is not None:
+        print(f"SQL generated in {stream.time_to_sql:.2f}s, generation cancelled: {stream.cancelled}")
+    response_data = stream.answer_data
     response = response_data['answer']
     
-    sql_pattern = r"<SQL>([\s\S]*?)(?=<\/SQL>)"
-    try:
-        sql_statement = str(re.search(sql_pattern, response).group(1)).strip()
-    except:
+    sql_statement = stream.sql if stream.sql is not None else extract_sql(response)
+    if sql_statement is None:
         end_time = time()    
         response_time = end_time - start_time 
         response_data = {
@@ -118,7 +184,7 @@ def generate_sql(user_question, db_selection, sp_selection, llm_selection, simil
             "llm_cost": 0,
             "response_time": response_time
         }
-        db_conn.save_conversation(conversation_id, user_question, response_data)    
+        log_writer.save_conversation(conversation_id, user_question, response_data)    
         return "Response: " + response, None
             
     end_time = time()    
@@ -126,11 +192,11 @@ def generate_sql(user_question, db_selection, sp_selection, llm_selection, simil
     st.session_state['conversation_id'] = conversation_id    
        
     response_data['response_time'] = response_time
-    response_data["database_name"] = db_selection,
-    response_data["search_provider"] = sp_selection,
-    response_data["rag_parameters"] = str({"similarity_threshold": similarity_threshold, "max_synonyms": num_synonyms}),
+    response_data["database_name"] = db_selection
+    response_data["search_provider"] = sp_selection
+    response_data["rag_parameters"] = str({"similarity_threshold": similarity_threshold, "max_synonyms": num_synonyms})
     
-    db_conn.save_conversation(conversation_id, user_question, response_data)
+    log_writer.save_conversation(conversation_id, user_question, response_data)
     
     return sql_statement, discovered_tables
     #return None, None
@@ -138,12 +204,14 @@ def generate_sql(user_question, db_selection, sp_selection, llm_selection, simil
 def register_feedback(conversation_id: str, feedback: int):
     if feedback not in [-1, 1]:
         return "Invalid feedback"
-    db_conn.save_feedback(conversation_id, feedback)
+    log_writer.save_feedback(conversation_id, feedback)
     return f"Feedback {feedback} registered"
 
-# Function to execute SQL statement
-def execute_sql(sql_statement):
-    return db_conn.execute_sql(sql_statement)
+# Function to execute SQL statement, results are fetched up to the row and byte caps and rendered page by page.
+# Results of the same statement on the same database are served from the result cache unless bypassed.
+# Statements above the cost limits are rejected or wait for a confirmation, see SQLGuard.
+def execute_sql(sql_statement, use_cache=True, confirmed=False):
+    return sql_guard.execute(sql_statement, confirmed=confirmed, use_cache=use_cache)
 
 
 #------------------------------------------------ Event Processors ------------------------------------------------
@@ -154,16 +222,21 @@ def process_button_click():
                                             sp_selection,
                                             llm_selection, 
                                             sim_threshold, 
-                                            num_synonyms)
+                                            num_synonyms,
+                                            use_cache=not st.session_state.get('regenerate_answer', False))
     st.session_state['sql_statement'] = sql_statement
     st.session_state['db_tables'] = db_tables
     st.session_state['sql_results'] = None
+    st.session_state['sql_plan'] = None
 
-def run_sql_button_click():
-    st.session_state['sql_results'] = execute_sql(generated_sql)
+def run_sql_button_click(confirmed=False):
+    st.session_state['sql_results'], st.session_state['sql_plan'] = execute_sql(
+        generated_sql, use_cache=not st.session_state.get('bypass_result_cache', False), confirmed=confirmed)
+    st.session_state['sql_results_page'] = 1
 
 def clear_results_button_click():
     st.session_state['sql_results'] = None
+    st.session_state['sql_plan'] = None
     
 def reload_all():
     st.cache_data.clear()
@@ -181,11 +254,12 @@ with left_col:
     with col1:
         reload_all_button = st.button("Reload All", on_click=reload_all)
     with col2:
-        process_button = st.button("Process", on_click=process_button_click)    
+        process_button = st.button("Process", on_click=process_button_click, disabled=not pre_processor.is_ready())    
     
 with mid_col:
     if st.session_state['sql_statement']:       
         run_sql_button = st.button("Run SQL on DB", on_click=run_sql_button_click)        
+        st.checkbox("Bypass result cache", key='bypass_result_cache')
 
 # Elements in the right column
 with right_col:
@@ -200,6 +274,7 @@ with left_col:
     user_question = st.text_area("Enter your question:", "Top 5 movies by number of rentals")
     db_selection = st.selectbox("Select Database:", db_list)
     llm_selection = st.selectbox("Select LLM:", llm_list)
+    st.checkbox("Regenerate answer (bypass answer caches)", key='regenerate_answer')
     st.markdown('----')
     sp_selection = st.selectbox("Select Search Provider:", search_providers.keys())
     sim_threshold = st.slider("Similarity Threshold:", 60, 100, 80)
@@ -225,10 +300,46 @@ with mid_col:
 
 # Elements in the right column
 with right_col:
+    sql_plan = st.session_state['sql_plan']
+    if sql_plan is not None and sql_plan.get('total_cost') is not None:
+        st.caption(f"Plan: {sql_plan['node_type']}, estimated cost {sql_plan['total_cost']:,.0f}, "
+                   f"rows {sql_plan['plan_rows']:,}")
+    if sql_plan is not None and st.session_state['sql_results'] is None:
+        if sql_plan['verdict'] == VERDICT_REJECT:
+            st.error("Statement rejected: " + "; ".join(sql_plan['reasons']))
+        elif sql_plan['verdict'] == VERDICT_CONFIRM:
+            st.warning("Statement needs confirmation: " + "; ".join(sql_plan['reasons']))
+            st.button("Run anyway", on_click=run_sql_button_click, kwargs={'confirmed': True})
     if st.session_state['sql_results'] is not None:        
-        st.dataframe(st.session_state['sql_results'])    
+        sql_results = st.session_state['sql_results']
+        if sql_results.cache_age is not None:
+            st.caption(f"cached ({sql_results.cache_age:.0f}s ago)")
+        if sql_results.truncated is not None:
+            st.warning(f"Results truncated at the {sql_results.truncated} limit, "
+                       f"showing the first {sql_results.num_rows} rows.")
+        num_pages = sql_results.num_pages(SQL_PAGE_SIZE)
+        page = st.number_input(f"Page (of {num_pages}):", 1, num_pages, key='sql_results_page') if num_pages > 1 else 1
+        st.dataframe(sql_results.page(page - 1, SQL_PAGE_SIZE))
             
 #Bottom section with related tables 
 if st.session_state['sql_statement']:                
     st.text("Related Tables")        
-    st.text(st.session_state['db_tables'])
\ No newline at end of file
+    st.text(st.session_state['db_tables'])
+
+#Loading progress of the NLP stack, the page is rerun once it is ready
+if not pre_processor.is_ready():
+    status = pre_processor.get_status()
+    if status["errors"]:
+        st.error(f"Error loading NLP models: {status['errors']}")
+    else:
+        components = [name for name in status if name != "errors"]
+        progress_bar = st.progress(0.0, text="Loading NLP models...")
+        try:
+            while not pre_processor.wait_ready(timeout=0.5):
+                status = pre_processor.get_status()
+                loaded = [name for name in components if status[name] == "ready"]
+                progress_bar.progress(len(loaded) / len(components), 
+                                      text=f"Loading NLP models... ({', '.join(loaded) or 'none'} ready)")
+        except RuntimeError:
+            pass
+        st.rerun()
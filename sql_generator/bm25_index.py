@@ -0,0 +1,302 @@
+from index_artifact import Artifact, StringArray, dump_artifact
+import numpy as np
+import pandas as pd
+import re
+
+ARTIFACT_KIND = 'bm25_catalog'
+ARTIFACT_VERSION = 1
+# Indexed fields of a table, the field id is the position in this list.
+FIELDS = ['table_name', 'column_name', 'data_type', 'table_schema']
+DEFAULT_BOOSTS = {'table_name': 3.0, 'column_name': 1.0, 'data_type': 0.2, 'table_schema': 0.5}
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def split_words(text: str) -> list:
+    """
+    Splits identifiers and questions into lower-case words: snake_case, camelCase and digits are split.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The words, in order.
+    """
+    return [word.lower() for word in _TOKEN_PATTERN.findall(str(text))]
+
+
+def tokenize(text: str) -> list:
+    """
+    Splits identifiers and questions into BM25 tokens.
+
+    Words are split with `split_words` and plurals are reduced with simple suffix rules
+    so that `rentals` in a question matches the `rental` table.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: The tokens, in order.
+    """
+    tokens = []
+    for token in split_words(text):
+        if len(token) > 4 and token.endswith('ies'):
+            token = token[:-3] + 'y'
+        elif len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Catalog:
+    """
+    BM25 inverted index over the tables of a database catalog, used by BM25Search.
+
+    Every table is a document with one field per entry of FIELDS. Terms are (field, token)
+    pairs, so field boosts can be chosen per query. Postings store the BM25 impact of the
+    term for every table, precomputed with k1 and b at build time, and the maximum impact
+    of every term bounds its contribution for MaxScore pruning.
+
+    The catalog is stored as a versioned artifact (see `index_artifact`), so a loaded
+    catalog is a set of read-only views over a memory-mapped file.
+
+    Attributes:
+        terms (StringArray): Token of every term.
+        term_fields (np.ndarray): Field id of every term.
+        offsets (np.ndarray): CSR offsets into `postings` and `impacts`, one row per term.
+        postings (np.ndarray): Table ids containing each term, ascending.
+        impacts (np.ndarray): BM25 score of the term for each posting.
+        max_impacts (np.ndarray): Largest impact of every term.
+        table_schema (StringArray): Schema name per table.
+        table_name (StringArray): Table name per table.
+        column_offsets (np.ndarray): CSR offsets into `column_names`, one row per table.
+        column_names (StringArray): Column names of the tables.
+    """
+
+    def __init__(self, terms, term_fields, offsets, postings, impacts, max_impacts,
+                 table_schema, table_name, column_offsets, column_names):
+        self.terms = terms
+        self.term_fields = term_fields
+        self.offsets = offsets
+        self.postings = postings
+        self.impacts = impacts
+        self.max_impacts = max_impacts
+        self.table_schema = table_schema
+        self.table_name = table_name
+        self.column_offsets = column_offsets
+        self.column_names = column_names
+        self._term_ids = None
+
+    @classmethod
+    def from_dataframe(cls, df_table_columns: pd.DataFrame, k1=DEFAULT_K1, b=DEFAULT_B) -> 'BM25Catalog':
+        """
+        Builds the index from `DBMetadata.df_table_columns`.
+
+        Args:
+            df_table_columns (pd.DataFrame): One row per table with the lists of its columns in `column_name`
+                and of their types in `data_type`.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 length normalisation.
+
+        Returns:
+            BM25Catalog: The index.
+        """
+        n_tables = len(df_table_columns)
+        field_tokens = {
+            'table_name': [tokenize(name) for name in df_table_columns['table_name']],
+            'column_name': [[token for column in columns for token in tokenize(column)]
+                            for columns in df_table_columns['column_name']],
+            'data_type': [[token for data_type in data_types for token in tokenize(data_type)]
+                          for data_types in df_table_columns.get('data_type', pd.Series([[]] * n_tables))],
+            'table_schema': [tokenize(schema) for schema in df_table_columns['table_schema']]
+        }
+
+        # Term frequencies by (field id, token) and table, length normalisation by field and table
+        term_frequencies = {}
+        norms = []
+        for field_id, field in enumerate(FIELDS):
+            tokens_per_table = field_tokens[field]
+            lengths = np.array([len(tokens) for tokens in tokens_per_table], dtype=np.float64)
+            avg_length = lengths.mean() if n_tables and lengths.mean() > 0 else 1.0
+            norms.append(k1 * (1 - b + b * lengths / avg_length))
+            for table_id, tokens in enumerate(tokens_per_table):
+                for token in tokens:
+                    frequencies = term_frequencies.setdefault((field_id, token), {})
+                    frequencies[table_id] = frequencies.get(table_id, 0) + 1
+
+        terms = sorted(term_frequencies)
+        offsets = [0]
+        postings = []
+        impacts = []
+        for key in terms:
+            frequencies = term_frequencies[key]
+            table_ids = np.fromiter(sorted(frequencies), dtype=np.int32, count=len(frequencies))
+            tf = np.array([frequencies[table_id] for table_id in table_ids], dtype=np.float64)
+            idf = np.log(1 + (n_tables - len(table_ids) + 0.5) / (len(table_ids) + 0.5))
+            postings.append(table_ids)
+            impacts.append(idf * tf * (k1 + 1) / (tf + norms[key[0]][table_ids]))
+            offsets.append(offsets[-1] + len(table_ids))
+        impacts = np.concatenate(impacts).astype(np.float32) if impacts else np.zeros(0, dtype=np.float32)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        column_offsets = [0]
+        column_names = []
+        for columns in df_table_columns['column_name']:
+            column_names.extend(columns)
+            column_offsets.append(len(column_names))
+        return cls(
+            terms=StringArray.from_list(token for _, token in terms),
+            term_fields=np.asarray([field_id for field_id, _ in terms], dtype=np.int8),
+            offsets=offsets,
+            postings=np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32),
+            impacts=impacts,
+            max_impacts=np.maximum.reduceat(impacts, offsets[:-1]) if len(terms) else np.zeros(0, dtype=np.float32),
+            table_schema=StringArray.from_list(df_table_columns['table_schema']),
+            table_name=StringArray.from_list(df_table_columns['table_name']),
+            column_offsets=np.asarray(column_offsets, dtype=np.int64),
+            column_names=StringArray.from_list(column_names)
+        )
+
+    @classmethod
+    def from_artifact(cls, artifact: Artifact) -> 'BM25Catalog':
+        """
+        Creates the index over the arrays of a loaded artifact without copying them.
+
+        Args:
+            artifact (Artifact): Artifact of kind ARTIFACT_KIND.
+
+        Returns:
+            BM25Catalog: The index.
+        """
+        return cls(
+            terms=artifact.strings('terms'),
+            term_fields=artifact.array('term_fields'),
+            offsets=artifact.array('offsets'),
+            postings=artifact.array('postings'),
+            impacts=artifact.array('impacts'),
+            max_impacts=artifact.array('max_impacts'),
+            table_schema=artifact.strings('table_schema'),
+            table_name=artifact.strings('table_name'),
+            column_offsets=artifact.array('column_offsets'),
+            column_names=artifact.strings('column_names')
+        )
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialises the index into an artifact.
+
+        Returns:
+            bytes: The artifact.
+        """
+        arrays = {name: getattr(self, name) for name in [
+            'terms', 'term_fields', 'offsets', 'postings', 'impacts', 'max_impacts',
+            'table_schema', 'table_name', 'column_offsets', 'column_names']}
+        return dump_artifact(ARTIFACT_KIND, ARTIFACT_VERSION, arrays, {'fields': FIELDS})
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the index arrays, mapped or in memory.
+        """
+        arrays = [self.term_fields, self.offsets, self.postings, self.impacts, self.max_impacts, self.column_offsets]
+        for strings in [self.terms, self.table_schema, self.table_name, self.column_names]:
+            arrays.extend([strings.data, strings.offsets])
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def n_tables(self) -> int:
+        return len(self.table_name)
+
+    def term_id(self, field: str, token: str):
+        """
+        Returns the id of a term, None if it is not indexed.
+        """
+        if self._term_ids is None:
+            self._term_ids = {(int(field_id), token): term_id
+                              for term_id, (field_id, token) in enumerate(zip(self.term_fields, self.terms))}
+        return self._term_ids.get((FIELDS.index(field), token))
+
+    def search(self, query: str, top_k=10, boosts: dict=None):
+        """
+        Returns the top tables for a query.
+
+        Terms are accumulated term-at-a-time by decreasing upper bound. Once the bounds of the
+        remaining terms cannot lift a table without score above the current k-th score, only
+        tables which can still reach it are updated (MaxScore), which skips most postings of
+        frequent terms. The result is exact.
+
+        Args:
+            query (str): The question or keywords.
+            top_k (int): Maximum number of tables to return.
+            boosts (dict): Weight of each field, DEFAULT_BOOSTS by default. Fields with weight 0 are skipped.
+
+        Returns:
+            tuple: Table ids and their scores, by decreasing score. Tables without matching term are omitted.
+        """
+        boosts = DEFAULT_BOOSTS if boosts is None else boosts
+        query_terms = {}
+        for token in tokenize(query):
+            for field in FIELDS:
+                weight = boosts.get(field, 0)
+                term_id = self.term_id(field, token) if weight > 0 else None
+                if term_id is not None:
+                    query_terms[term_id] = query_terms.get(term_id, 0) + weight
+        if not query_terms or top_k < 1:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        term_ids = np.fromiter(query_terms, dtype=np.int64, count=len(query_terms))
+        weights = np.fromiter(query_terms.values(), dtype=np.float32, count=len(query_terms))
+        upper_bounds = weights * self.max_impacts[term_ids]
+        order = np.argsort(-upper_bounds, kind='stable')
+        # Bound of the terms after each position of `order`
+        remaining = np.concatenate([np.cumsum(upper_bounds[order][::-1])[::-1][1:], [0]])
+
+        scores = np.zeros(self.n_tables, dtype=np.float32)
+        touched = np.zeros(self.n_tables, dtype=bool)
+        # Sorted ids of the tables which can still reach the top k, once pruning started
+        candidates = None
+        for position, i in enumerate(order):
+            start, stop = self.offsets[term_ids[i]], self.offsets[term_ids[i] + 1]
+            tables = self.postings[start:stop]
+            impacts = self.impacts[start:stop]
+            if candidates is not None:
+                # Skip through the sorted postings to the candidates
+                found = np.minimum(np.searchsorted(tables, candidates), len(tables) - 1)
+                found = found[tables[found] == candidates]
+                tables, impacts = tables[found], impacts[found]
+            else:
+                touched[tables] = True
+            scores[tables] += weights[i] * impacts
+            if position + 1 == len(order):
+                break
+            pool = np.flatnonzero(touched) if candidates is None else candidates
+            if len(pool) >= top_k:
+                threshold = np.partition(scores[pool], -top_k)[-top_k]
+                if threshold > remaining[position]:
+                    candidates = pool[scores[pool] + remaining[position] >= threshold]
+
+        pool = np.flatnonzero(touched) if candidates is None else candidates
+        pool = pool[scores[pool] > 0]
+        if len(pool) > top_k:
+            pool = pool[np.argpartition(-scores[pool], top_k - 1)[:top_k]]
+        top_tables = pool[np.lexsort((pool, -scores[pool]))]
+        return top_tables, scores[top_tables]
+
+    def get_tables(self, table_ids: np.ndarray) -> pd.DataFrame:
+        """
+        Returns the given tables in the `df_table_columns` layout, in order.
+
+        Args:
+            table_ids (np.ndarray): Table ids.
+
+        Returns:
+            pd.DataFrame: Columns `table_schema`, `table_name` and `column_name` (list of columns).
+        """
+        columns = [list(self.column_names[self.column_offsets[i]:self.column_offsets[i + 1]]) for i in table_ids]
+        return pd.DataFrame({
+            'table_schema': self.table_schema[table_ids],
+            'table_name': self.table_name[table_ids],
+            'column_name': columns
+        })
@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from threading import RLock
+from time import monotonic
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache bounded by entry count and/or total size, with optional expiry.
+
+    Attributes:
+        max_entries (int): Maximum number of entries, None for no limit.
+        max_bytes (int): Maximum total size of the entries, None for no limit.
+        sizeof (callable): Returns the size of a value in bytes, used with max_bytes.
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+        evictions (int): Number of entries evicted to respect the limits.
+        on_evict (callable): Optional, called with the key and value of every evicted entry.
+        ttl (float): Seconds after which an entry expires, None for no expiry. Expired entries are
+            removed on lookup, where they count as misses, and by `in`.
+        expirations (int): Number of entries removed because they expired.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None, on_evict=None, ttl=None, clock=monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof if sizeof is not None else (lambda value: 0)
+        self.on_evict = on_evict
+        self.ttl = ttl
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._times = {}
+        self._total_bytes = 0
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        # Expired entries are removed, as on lookup, but hits and misses are not counted
+        with self._lock:
+            return key in self._entries and not self._expire(key)
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value and marks it as most recently used.
+
+        Args:
+            key: The cache key.
+            default: Value returned on a miss.
+
+        Returns:
+            The cached value or `default`.
+        """
+        with self._lock:
+            if key not in self._entries or self._expire(key):
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value, age=0.0):
+        """
+        Adds or replaces a value and evicts least recently used entries above the limits.
+        A value larger than max_bytes is not cached.
+
+        Args:
+            key: The cache key.
+            value: The value to cache.
+            age (float): Seconds since the value was created, counted towards `ttl`, e.g. for a
+                value loaded from a slower cache tier.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            self.pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._times[key] = self._clock() - age
+            self._total_bytes += size
+            while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._entries))
+                evicted = self.pop(oldest)
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(oldest, evicted)
+
+    def pop(self, key, default=None):
+        """
+        Removes an entry.
+
+        Args:
+            key: The cache key.
+            default: Value returned if the key is not cached.
+
+        Returns:
+            The removed value or `default`.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._total_bytes -= self._sizes.pop(key)
+            del self._times[key]
+            return self._entries.pop(key)
+
+    def get_age(self, key):
+        """
+        Returns the number of seconds since an entry was cached, None if it is not cached or expired.
+        """
+        with self._lock:
+            if key not in self._entries or self._expire(key):
+                return None
+            return self._clock() - self._times[key]
+
+    def _expire(self, key) -> bool:
+        if self.ttl is None or self._clock() - self._times[key] < self.ttl:
+            return False
+        self.pop(key)
+        self.expirations += 1
+        return True
+
+    def invalidate(self, predicate) -> int:
+        """
+        Removes all entries whose key matches the predicate.
+
+        Args:
+            predicate (callable): Called with every key, True to remove the entry.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self.pop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._times.clear()
+            self._total_bytes = 0
+
+    def keys(self) -> list:
+        """
+        Returns the cached keys from least to most recently used.
+        """
+        with self._lock:
+            return list(self._entries.keys())
+
+    def items(self) -> list:
+        """
+        Returns the cached (key, value) pairs from least to most recently used.
+        """
+        with self._lock:
+            return list(self._entries.items())
+
+    def get_stats(self) -> dict:
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Entries, bytes, hits, misses, evictions, expirations and hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -1,11 +1,18 @@
-import sqlalchemy, os
-from typing import Optional, Dict, List
+import sqlalchemy, os, re, json
+from typing import Optional, Dict, List, TYPE_CHECKING
 from datetime import datetime
 from zoneinfo import ZoneInfo
+from threading import Lock
+from time import monotonic, perf_counter
 import pandas as pd
+from cache import LRUCache
+
+if TYPE_CHECKING:
+    # Imported where results are fetched, so that the pipeline can import db without pyarrow
+    from query_result import QueryResult
 
 from abc import ABC
-from sqlalchemy import Engine, MetaData, create_engine, text, inspect
+from sqlalchemy import Engine, create_engine, text, bindparam
 from sqlalchemy.sql import func as sql_func
 
 TZ_INFO = os.getenv("TZ", "Europe/Berlin")
@@ -15,6 +22,35 @@ SUPPORTED_DB_TYPES = ["postgresql"]
 EXCLUDED_DATABASES = ["postgres", "dagster", "sql_generator"]
 SYSTEM_SCHEMAS = ["information_schema", "pg_catalog"]
 
+# Connection pool settings of every engine, see EngineRegistry.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Engines of user databases kept open, least recently used ones are disposed first.
+DB_MAX_ENGINES = int(os.getenv("DB_MAX_ENGINES", 8))
+# Engines unused for this many seconds are disposed.
+DB_ENGINE_IDLE_TIMEOUT = float(os.getenv("DB_ENGINE_IDLE_TIMEOUT", 600))
+
+# Caps of the results of generated SQL, see DBConnection.execute_sql_stream.
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", 100000))
+SQL_MAX_BYTES = int(os.getenv("SQL_MAX_BYTES", 64 * 1024 * 1024))
+SQL_FETCH_SIZE = int(os.getenv("SQL_FETCH_SIZE", 5000))
+# Milliseconds before generated SQL is cancelled, 0 for no limit. See config/sql_guard.yaml for per-database limits.
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", 30000))
+# Cached results of generated SQL expire after SQL_CACHE_TTL seconds, see DBConnection.execute_sql_cached.
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", 300))
+SQL_CACHE_MAX_BYTES = int(os.getenv("SQL_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+CONVERSATION_COLUMNS = ["id", "question", "answer", "database_name", "model", "search_provider", "rag_parameters",
+                        "response_time", "relevance", "relevance_explanation", "prompt_tokens", "completion_tokens",
+                        "total_tokens", "eval_prompt_tokens", "eval_completion_tokens", "eval_total_tokens", "llm_cost",
+                        "timestamp"]
+FEEDBACK_COLUMNS = ["conversation_id", "feedback", "timestamp"]
+LLM_RESPONSE_COLUMNS = ["model_id", "prompt_hash", "answer_data", "timestamp"]
+# Fraction of max_entries the llm_responses table may exceed before it is trimmed back, so most writes skip the DELETE.
+LLM_RESPONSES_TRIM_MARGIN = 0.1
+
 # Database connection parameters
 
 DATABASES_QUERY_POSTGRES = """
@@ -23,71 +59,392 @@ FROM pg_database
 WHERE datistemplate = false;
 """
 
+# Catalog queries, each one round trip for the whole database. System and TOAST schemas and the
+# bookkeeping tables of EXCLUDED_RELATIONS are skipped.
 COLUMNS_QUERY_POSTGRES = """
 SELECT
-    c.table_schema,
-    c.table_name, 
-    CASE 
-        WHEN t.table_type = 'BASE TABLE' THEN 'table'
-        WHEN t.table_type = 'VIEW' THEN 'view'
-    END AS table_type,    
-    c.column_name, 
-    c.data_type, 
-    CASE 
-        WHEN c.column_name IN (
-            SELECT kcu.column_name
-            FROM information_schema.table_constraints tco
-            JOIN information_schema.key_column_usage kcu 
-                ON kcu.constraint_name = tco.constraint_name
-            WHERE tco.constraint_type = 'PRIMARY KEY' AND kcu.table_name = c.table_name
-        ) THEN TRUE ELSE FALSE 
-    END AS is_primary_key,
-    c.is_nullable
-FROM information_schema.columns c
-JOIN information_schema.tables t
-    ON c.table_catalog = t.table_catalog
-    AND c.table_schema = t.table_schema
-    AND c.table_name = t.table_name
-WHERE c.table_schema <> 'information_schema' 
-AND c.table_schema <> 'pg_catalog'
-ORDER BY c.table_name, c.column_name;
+    n.nspname AS table_schema,
+    c.relname AS table_name,
+    CASE WHEN c.relkind IN ('v', 'm') THEN 'view' ELSE 'table' END AS table_type,
+    a.attname AS column_name,
+    pg_catalog.format_type(a.atttypid, a.atttypmod) AS data_type,
+    COALESCE(a.attnum = ANY(pk.indkey), FALSE) AS is_primary_key,
+    NOT a.attnotnull AS is_nullable
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+LEFT JOIN pg_catalog.pg_index pk ON pk.indrelid = c.oid AND pk.indisprimary
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+AND n.nspname <> ALL(:system_schemas)
+AND n.nspname NOT LIKE 'pg\\_%'
+AND n.nspname || '.' || c.relname <> ALL(:excluded_relations)
+ORDER BY n.nspname, c.relname, a.attnum;
 """
 
 FK_QUERY_POSTGRES = """
 SELECT
-    tc.table_name AS source_table,
-    kcu.column_name AS source_column,
-    ccu.table_name AS target_table,
-    ccu.column_name AS target_column
-FROM
-    information_schema.table_constraints AS tc
-    JOIN information_schema.key_column_usage AS kcu
-        ON tc.constraint_name = kcu.constraint_name
-        AND tc.table_schema = kcu.table_schema
-    JOIN information_schema.constraint_column_usage AS ccu
-        ON ccu.constraint_name = tc.constraint_name
-        AND ccu.table_schema = tc.table_schema
-WHERE tc.constraint_type = 'FOREIGN KEY'
-AND tc.table_schema = 'public';
+    sn.nspname AS source_schema,
+    sc.relname AS source_table,
+    sa.attname AS source_column,
+    tn.nspname AS target_schema,
+    tc.relname AS target_table,
+    ta.attname AS target_column
+FROM pg_catalog.pg_constraint con
+CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(source_attnum, target_attnum, position)
+JOIN pg_catalog.pg_class sc ON sc.oid = con.conrelid
+JOIN pg_catalog.pg_namespace sn ON sn.oid = sc.relnamespace
+JOIN pg_catalog.pg_attribute sa ON sa.attrelid = con.conrelid AND sa.attnum = k.source_attnum
+JOIN pg_catalog.pg_class tc ON tc.oid = con.confrelid
+JOIN pg_catalog.pg_namespace tn ON tn.oid = tc.relnamespace
+JOIN pg_catalog.pg_attribute ta ON ta.attrelid = con.confrelid AND ta.attnum = k.target_attnum
+WHERE con.contype = 'f'
+AND sn.nspname <> ALL(:system_schemas)
+AND sn.nspname || '.' || sc.relname <> ALL(:excluded_relations)
+AND tn.nspname || '.' || tc.relname <> ALL(:excluded_relations)
+ORDER BY sn.nspname, sc.relname, con.conname, k.position;
 """
 
 TABLE_VIEW_QUERY_POSTGRES = """
-SELECT
-    c1.relname AS view_name,
-    c2.relname AS table_name
-FROM
-    pg_catalog.pg_depend d
-    JOIN pg_catalog.pg_rewrite r ON d.objid = r.oid
-    JOIN pg_catalog.pg_class c1 ON r.ev_class = c1.oid
-    JOIN pg_catalog.pg_class c2 ON d.refobjid = c2.oid
-WHERE
-    c1.relkind = 'v' AND c2.relkind = 'r'
+SELECT DISTINCT
+    vn.nspname AS view_schema,
+    v.relname AS view_name,
+    tn.nspname AS table_schema,
+    t.relname AS table_name
+FROM pg_catalog.pg_depend d
+JOIN pg_catalog.pg_rewrite r ON r.oid = d.objid
+JOIN pg_catalog.pg_class v ON v.oid = r.ev_class
+JOIN pg_catalog.pg_namespace vn ON vn.oid = v.relnamespace
+JOIN pg_catalog.pg_class t ON t.oid = d.refobjid
+JOIN pg_catalog.pg_namespace tn ON tn.oid = t.relnamespace
+WHERE d.classid = 'pg_catalog.pg_rewrite'::regclass
+AND d.refclassid = 'pg_catalog.pg_class'::regclass
+AND v.relkind IN ('v', 'm')
+AND t.relkind IN ('r', 'p', 'v', 'm', 'f')
+AND t.oid <> v.oid
+AND vn.nspname <> ALL(:system_schemas)
+AND vn.nspname || '.' || v.relname <> ALL(:excluded_relations)
+AND tn.nspname || '.' || t.relname <> ALL(:excluded_relations)
+ORDER BY vn.nspname, v.relname, tn.nspname, t.relname;
 """
 
+TABLE_COLUMNS = ['table_schema', 'table_name', 'table_type', 'column_name', 'data_type', 'is_primary_key', 'is_nullable']
+FK_COLUMNS = ['source_schema', 'source_table', 'source_column', 'target_schema', 'target_table', 'target_column']
+TABLE_VIEW_COLUMNS = ['view_schema', 'view_name', 'table_schema', 'table_name']
+
+# DDL changelog installed in every user database. Event triggers record every change to a relation
+# (created, altered or dropped tables, views and columns) so indexes can be rebuilt incrementally.
+DDL_CHANGELOG_SCHEMA = "public"
+DDL_CHANGELOG_TABLE = "sql_generator_ddl_changelog"
+# Tables of sql_generator in user databases, left out of their catalogs and search indexes.
+EXCLUDED_RELATIONS = [f"{DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}"]
+DDL_CHANGELOG_OBJECT_TYPES = "('schema', 'table', 'table column', 'table constraint', 'view', 'materialized view', 'foreign table')"
+
+DDL_CHANGELOG_SETUP_POSTGRES = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE} (
+        id BIGSERIAL PRIMARY KEY,
+        command_tag TEXT NOT NULL,
+        object_type TEXT NOT NULL,
+        schema_name TEXT,
+        object_identity TEXT,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}_command() RETURNS event_trigger
+    LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, {DDL_CHANGELOG_SCHEMA} AS $$
+    BEGIN
+        INSERT INTO {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE} (command_tag, object_type, schema_name, object_identity)
+        SELECT command_tag, object_type, schema_name, object_identity
+        FROM pg_event_trigger_ddl_commands()
+        WHERE object_type IN {DDL_CHANGELOG_OBJECT_TYPES}
+        AND (schema_name IS NULL OR left(schema_name, 3) <> 'pg_')
+        AND object_identity <> '{DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}';
+    END
+    $$
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}_drop() RETURNS event_trigger
+    LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, {DDL_CHANGELOG_SCHEMA} AS $$
+    BEGIN
+        INSERT INTO {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE} (command_tag, object_type, schema_name, object_identity)
+        SELECT tg_tag, object_type, schema_name, object_identity
+        FROM pg_event_trigger_dropped_objects()
+        WHERE object_type IN {DDL_CHANGELOG_OBJECT_TYPES}
+        AND NOT is_temporary
+        AND (schema_name IS NULL OR left(schema_name, 3) <> 'pg_');
+    END
+    $$
+    """,
+    # The triggers run as the installing role, so roles without rights on the changelog can still change the schema
+    f"ALTER FUNCTION {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}_command() OWNER TO CURRENT_USER",
+    f"ALTER FUNCTION {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}_drop() OWNER TO CURRENT_USER",
+    f"DROP EVENT TRIGGER IF EXISTS {DDL_CHANGELOG_TABLE}_command",
+    f"""
+    CREATE EVENT TRIGGER {DDL_CHANGELOG_TABLE}_command ON ddl_command_end
+    EXECUTE FUNCTION {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}_command()
+    """,
+    f"DROP EVENT TRIGGER IF EXISTS {DDL_CHANGELOG_TABLE}_drop",
+    f"""
+    CREATE EVENT TRIGGER {DDL_CHANGELOG_TABLE}_drop ON sql_drop
+    EXECUTE FUNCTION {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}_drop()
+    """
+]
+
+DDL_CHANGES_QUERY_POSTGRES = f"""
+SELECT id, command_tag, object_type, schema_name, object_identity, timestamp
+FROM {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}
+WHERE id > :after_id AND id <= :until_id
+ORDER BY id;
+"""
+
+# Literals, quoted identifiers, comments and semicolons of a script. Escape strings (E'...') and dollar-quoted
+# strings are matched as well, so that a semicolon inside them is not taken for the end of a statement.
+_STATEMENT_TOKEN_PATTERN = re.compile(
+    r"""(?<![\w$])[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|"(?:[^"]|"")*"|(\$(?:[A-Za-z_]\w*)?\$).*?\1"""
+    r"""|--[^\n]*|/\*.*?\*/|;""", re.DOTALL)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Normalises a statement for result caching: comments and extra whitespace are removed, the text
+    outside literals and quoted identifiers is lower-cased (unquoted identifiers are case-insensitive)
+    and trailing semicolons dropped. Literals are recognised as in `count_statements`, including
+    escape strings and dollar-quoted strings.
+
+    Args:
+        query (str): The SQL statement.
+
+    Returns:
+        str: The normalised statement.
+    """
+    parts = []
+    unquoted = []
+    position = 0
+    for match in _STATEMENT_TOKEN_PATTERN.finditer(query):
+        unquoted.append(query[position:match.start()])
+        token = match.group(0)
+        if token.startswith(('--', '/*')):
+            unquoted.append(' ')
+        elif token == ';':
+            unquoted.append(token)
+        else:
+            parts.append(_WHITESPACE_PATTERN.sub(' ', ''.join(unquoted)).lower())
+            parts.append(token)
+            unquoted = []
+        position = match.end()
+    unquoted.append(query[position:])
+    parts.append(_WHITESPACE_PATTERN.sub(' ', ''.join(unquoted)).lower())
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+
+def count_statements(query: str) -> int:
+    """
+    Returns the number of statements of a script, empty statements between semicolons are not counted.
+    Unterminated literals leave their semicolons unquoted, so they count as statement ends.
+
+    Args:
+        query (str): The SQL script.
+
+    Returns:
+        int: The number of statements.
+    """
+    count = 0
+    pending = False
+    position = 0
+    for match in _STATEMENT_TOKEN_PATTERN.finditer(query):
+        token = match.group(0)
+        if query[position:match.start()].strip():
+            pending = True
+        if token == ';':
+            count += pending
+            pending = False
+        elif not token.startswith(('--', '/*')):
+            pending = True
+        position = match.end()
+    if query[position:].strip():
+        pending = True
+    return count + pending
+
+
+def check_single_statement(query: str):
+    """
+    Raises a ValueError unless the query is a single statement, optionally followed by a semicolon.
+    The driver runs every statement of a script, so a `COMMIT` would end the read-only transaction.
+    """
+    n_statements = count_statements(query)
+    if n_statements != 1:
+        raise ValueError(f"Expected a single SQL statement, got {n_statements}")
+
+
 class DBMetadata:
-    src_metadata: MetaData
+    """
+    Catalog of a database.
+
+    Attributes:
+        df_table_columns (pd.DataFrame): One row per table or view with the lists of its columns, data types,
+            primary key and nullable flags in `column_name`, `data_type`, `is_primary_key` and `is_nullable`.
+        df_fk (pd.DataFrame): One row per foreign key column, see FK_COLUMNS.
+        df_table_view (pd.DataFrame): One row per table or view a view depends on, see TABLE_VIEW_COLUMNS.
+    """
     df_table_columns: pd.DataFrame
-        
+    df_fk: pd.DataFrame
+    df_table_view: pd.DataFrame
+
+
+class EngineRegistry:
+    """
+    Engines by database name, each with its own connection pool.
+
+    Engines are created on first use and kept for later requests. Engines of pinned databases
+    are never disposed, the others are disposed when more than `max_engines` are open (least
+    recently used first) or when they were not used for `idle_timeout` seconds. Engines with
+    checked-out connections are not disposed for idleness. An engine evicted while connections
+    are checked out, e.g. by a streaming cursor, is retired: it is disposed once all its connections
+    are returned, or reused if its database is requested again before.
+
+    Attributes:
+        url_factory (callable): Returns the connection URL of a database name.
+        max_engines (int): Maximum number of unpinned engines.
+        idle_timeout (float): Seconds after which an unused unpinned engine is disposed, None to keep it.
+        engine_options (dict): Options passed to `create_engine`, e.g. the pool settings.
+        execution_options (dict): Execution options of every engine.
+    """
+
+    def __init__(self, url_factory, max_engines: int=DB_MAX_ENGINES, idle_timeout: Optional[float]=DB_ENGINE_IDLE_TIMEOUT,
+                 engine_options: Optional[dict]=None, execution_options: Optional[dict]=None):
+        self.url_factory = url_factory
+        self.max_engines = max_engines
+        self.idle_timeout = idle_timeout
+        self.engine_options = {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': True
+        }
+        self.engine_options.update(engine_options or {})
+        self.execution_options = execution_options or {}
+        self._pinned = {}
+        self._engines = LRUCache(max_entries=max_engines, on_evict=lambda db_name, engine: self._dispose(db_name, engine))
+        self._last_used = {}
+        # Evicted engines waiting for their checked-out connections
+        self._retired = {}
+        self._stats = {}
+        self._lock = Lock()
+
+    def pin(self, db_name: str) -> Engine:
+        """
+        Creates the engine of a database which is never disposed by the registry.
+        """
+        with self._lock:
+            if db_name not in self._pinned:
+                engine = self._engines.pop(db_name) or self._retired.pop(db_name, None)
+                self._pinned[db_name] = engine if engine is not None else self._create(db_name)
+            return self._pinned[db_name]
+
+    def get(self, db_name: str) -> Engine:
+        """
+        Returns the engine of a database, creating it if needed.
+        """
+        with self._lock:
+            self._last_used[db_name] = monotonic()
+            if db_name in self._pinned:
+                return self._pinned[db_name]
+            self._dispose_idle()
+            engine = self._engines.get(db_name)
+            if engine is None:
+                engine = self._retired.pop(db_name, None) or self._create(db_name)
+                self._engines.put(db_name, engine)
+            return engine
+
+    def connect(self, db_name: str):
+        """
+        Checks out a connection to a database and records the time spent waiting for it.
+
+        Returns:
+            Connection: The connection, to be used as a context manager.
+        """
+        engine = self.get(db_name)
+        start = perf_counter()
+        con = engine.connect()
+        wait_time = perf_counter() - start
+        with self._lock:
+            stats = self._stats.setdefault(db_name, {'checkouts': 0, 'wait_time': 0.0, 'max_wait_time': 0.0})
+            stats['checkouts'] += 1
+            stats['wait_time'] += wait_time
+            stats['max_wait_time'] = max(stats['max_wait_time'], wait_time)
+        return con
+
+    def get_stats(self) -> dict:
+        """
+        Returns the pool metrics of every open engine.
+
+        Returns:
+            dict: By database: pinned and retired flags, pool size, checked-in, checked-out and overflow connections,
+                and the number of checkouts with their total and maximum wait time in seconds.
+        """
+        with self._lock:
+            engines = dict(self._retired)
+            engines.update(self._engines.items())
+            engines.update(self._pinned)
+            stats = {}
+            for db_name, engine in engines.items():
+                pool = engine.pool
+                stats[db_name] = {
+                    'pinned': db_name in self._pinned,
+                    'retired': db_name in self._retired,
+                    'pool_size': pool.size() if hasattr(pool, 'size') else None,
+                    'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else None,
+                    'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                    'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+                    **self._stats.get(db_name, {'checkouts': 0, 'wait_time': 0.0, 'max_wait_time': 0.0})
+                }
+            return stats
+
+    def dispose_all(self):
+        with self._lock:
+            for db_name, engine in self._engines.items() + list(self._pinned.items()) + list(self._retired.items()):
+                engine.dispose()
+            self._engines.clear()
+            self._pinned.clear()
+            self._retired.clear()
+            self._last_used.clear()
+
+    def _create(self, db_name: str) -> Engine:
+        engine = create_engine(self.url_factory(db_name), **self.engine_options)
+        if self.execution_options:
+            engine.update_execution_options(**self.execution_options)
+        return engine
+
+    def _dispose_idle(self):
+        for db_name, engine in list(self._retired.items()):
+            if not self._checked_out(engine):
+                del self._retired[db_name]
+                self._dispose(db_name, engine)
+        if self.idle_timeout is None:
+            return
+        now = monotonic()
+        for db_name, engine in self._engines.items():
+            if now - self._last_used.get(db_name, now) > self.idle_timeout and not self._checked_out(engine):
+                self._engines.pop(db_name)
+                self._dispose(db_name, engine)
+
+    def _dispose(self, db_name: str, engine: Engine):
+        if self._checked_out(engine):
+            self._retired[db_name] = engine
+            return
+        engine.dispose()
+        self._stats.pop(db_name, None)
+        self._last_used.pop(db_name, None)
+
+    @staticmethod
+    def _checked_out(engine: Engine) -> bool:
+        return hasattr(engine.pool, 'checkedout') and engine.pool.checkedout() > 0
+
+
 class DBConnection:
     db_type: str
     db_name: str
@@ -96,10 +453,11 @@ class DBConnection:
     db_user: str
     db_password: str
     read_only: bool
-    engine: Engine
+    engines: EngineRegistry
     metadata: Dict[str, DBMetadata]
 
-    def __init__(self, db_type: str, db_name: str, db_host: str, db_port: str, db_user: str, db_password: str, read_only: bool=True):
+    def __init__(self, db_type: str, db_name: str, db_host: str, db_port: str, db_user: str, db_password: str, read_only: bool=True,
+                 pool_config: Optional[dict]=None):
         self.db_type = db_type
         if db_type not in SUPPORTED_DB_TYPES:
             raise ValueError(f"Unsupported database type: {db_type}. Supported types are: {SUPPORTED_DB_TYPES}")
@@ -110,31 +468,61 @@ class DBConnection:
         self.db_user = db_user
         self.db_password = db_password
         self.read_only = read_only
-        self._init_engine()
+        # Serialised results of executed SQL by (database, normalised statement, caps)
+        self.result_cache = LRUCache(max_bytes=SQL_CACHE_MAX_BYTES, sizeof=lambda buffer: buffer.size, ttl=SQL_CACHE_TTL)
+        self._init_engine(pool_config)
         self._load_metadata()
     
-    def _init_engine(self, db_name: Optional[str] = None):
+    def _init_engine(self, pool_config: Optional[dict] = None):
         """
-        Initializes the database engine with the provided or default database name.
+        Initializes the engine registry. The database used to create the object holds the
+        application tables, its engine is pinned so logging always uses the same pool.
 
         Args:
-            db_name (Optional[str]): The name of the database to connect to. If not provided, 
-                                     the default database name (`self.db_name`) will be used.
+            pool_config (Optional[dict]): Overrides of the EngineRegistry settings: `max_engines`,
+                `idle_timeout` and `create_engine` pool options such as `pool_size` or `max_overflow`.
 
         Returns:
             None
         """
+        pool_config = dict(pool_config or {})
+        max_engines = pool_config.pop('max_engines', DB_MAX_ENGINES)
+        idle_timeout = pool_config.pop('idle_timeout', DB_ENGINE_IDLE_TIMEOUT)
+        self.engines = EngineRegistry(self._get_url, max_engines, idle_timeout,
+                                      engine_options=pool_config,
+                                      execution_options={'read_only': self.read_only})
+        self.engines.pin(self.main_db_name)
 
-        if db_name is None:
-            db_name = self.db_name
-        self.engine = create_engine(f"{self.db_type}://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{db_name}")
-        self.engine.update_execution_options(read_only=self.read_only)
+    def _get_url(self, db_name: str) -> str:
+        return f"{self.db_type}://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{db_name}"
+
+    @property
+    def engine(self) -> Engine:
+        """
+        Engine of the current database.
+        """
+        return self.engines.get(self.db_name)
+
+    def _connect_app_db(self):
+        """
+        Returns a connection to the application database from its dedicated pool.
+        """
+        return self.engines.connect(self.main_db_name)
+
+    def get_pool_stats(self) -> dict:
+        """
+        Returns the connection pool metrics by database, see EngineRegistry.get_stats.
+        """
+        return self.engines.get_stats()
 
     def get_curr_database(self):
         return self.db_name
 
     def get_metadata(self, refresh: bool=False, exclude_system_tables: bool=True)-> DBMetadata:
-        if self.metadata.get(self.db_name) is None or refresh:
+        if refresh:
+            self.metadata.pop(self.db_name, None)
+            self.invalidate_result_cache(self.db_name)
+        if self.metadata.get(self.db_name) is None:
             self._load_metadata()
         return self.metadata[self.db_name] 
 
@@ -144,47 +532,48 @@ class DBConnection:
         # Skip loading metadata if it was already loaded, no inline refresh implemented.
         if self.metadata.get(self.db_name) is not None:
             return
-        # Initialize the engine database name changed
-        if self.db_name != self.engine.url.database:
-            self._init_engine(self.db_name)
+        match self.engine.dialect.name:
+            case "postgresql":
+                self.metadata[self.db_name] = self._load_metadata_postgres()
+            case _:
+                raise ValueError(f"Unsupported database type: {self.engine.dialect.name}")
+
+    def _load_metadata_postgres(self) -> DBMetadata:
+        """
+        Loads the catalog of the current database with one query each for the columns, the foreign
+        keys and the view dependencies, whatever the number of tables.
+
+        Returns:
+            DBMetadata: The catalog.
+        """
+        params = {'system_schemas': SYSTEM_SCHEMAS, 'excluded_relations': EXCLUDED_RELATIONS}
+        with self.engines.connect(self.db_name) as con:
+            df_columns = pd.DataFrame(con.execute(text(COLUMNS_QUERY_POSTGRES), params).fetchall(), columns=TABLE_COLUMNS)
+            df_fk = pd.DataFrame(con.execute(text(FK_QUERY_POSTGRES), params).fetchall(), columns=FK_COLUMNS)
+            df_table_view = pd.DataFrame(con.execute(text(TABLE_VIEW_QUERY_POSTGRES), params).fetchall(),
+                                         columns=TABLE_VIEW_COLUMNS)
         db_md = DBMetadata()
-        db_md.src_metadata = MetaData()
-        inspector = inspect(self.engine)    
-        for schema in inspector.get_schema_names():
-            if schema in SYSTEM_SCHEMAS:
-                continue
-            db_md.src_metadata.reflect(bind=self.engine, schema=schema, views=True)
-            # Get Tables/Columns metadata
-            tables = db_md.src_metadata.tables
-            tab_output = []
-            for table in tables:
-                tab_output.append({
-                    'table_schema': tables[table].schema if tables[table].schema else '',
-                    'table_name': tables[table].name,
-                    'table_type': tables[table].info.get('type', 'table'),
-                    'column_name': list(tables[table].columns.keys()),
-                    'data_type': [str(tables[table].columns[col].type) for col in tables[table].columns.keys()],
-                    'is_primary_key': [col.primary_key for col in tables[table].columns.values()],
-                    'is_nullable': [col.nullable for col in tables[table].columns.values()]
-                })
-                #tab_col = tables[table].schema \
-                #    + '.' if tables[table].schema else '' \
-                #    + tables[table].name \
-                #    + ' (' \
-                #    + ', '.join(tables[table].columns.keys())\
-                #    + ')'
-                #db_md.table_columns.append(tab_col)
-            # Add currewnt DB metadata to the dictionary
-        db_md.df_table_columns = pd.DataFrame(tab_output, columns=['table_schema', 'table_name', 'table_type', 'column_name', 'data_type', 'is_primary_key', 'is_nullable'])
-        self.metadata[self.db_name] = db_md
+        db_md.df_table_columns = self._group_table_columns(df_columns)
+        db_md.df_fk = df_fk
+        db_md.df_table_view = df_table_view
+        return db_md
+
+    @staticmethod
+    def _group_table_columns(df_columns: pd.DataFrame) -> pd.DataFrame:
+        """
+        Groups one row per column into one row per table with lists of the column attributes, in column order.
+        """
+        table_keys = ['table_schema', 'table_name', 'table_type']
+        column_keys = [column for column in TABLE_COLUMNS if column not in table_keys]
+        if df_columns.empty:
+            return pd.DataFrame(columns=TABLE_COLUMNS)
+        df_columns = df_columns.astype({'is_primary_key': bool, 'is_nullable': bool})
+        return df_columns.groupby(table_keys, sort=False)[column_keys].agg(list).reset_index()[TABLE_COLUMNS]
 
     def set_curr_database(self, db_name: str):
         if self.db_name == db_name:
             return
         self.db_name = db_name
-        if self.engine is not None:
-            self.engine.dispose()
-        self._init_engine()
         self._load_metadata()
 
     def execute_sql(self, query: str) -> pd.DataFrame:
@@ -196,7 +585,7 @@ class DBConnection:
             list: A list of tuples containing the rows fetched by the query.
         """
         try:
-            with self.engine.connect() as con:
+            with self.engines.connect(self.db_name) as con:
                 cursor = con.execute(text(query))     
                 data = cursor.fetchall()
                 # Get column names from the cursor description
@@ -214,8 +603,142 @@ class DBConnection:
         # Create DataFrame with the fetched data and column names
         return pd.DataFrame(data, columns=column_names)
 
+    def _begin_guarded(self, con, statement_timeout_ms: int):
+        """
+        Starts a read-only transaction for generated SQL with a statement timeout. Both are local to the
+        transaction, so they never leak to the next user of the pooled connection.
+        """
+        if con.dialect.name != "postgresql":
+            return
+        con.execute(text("SET TRANSACTION READ ONLY"))
+        if statement_timeout_ms:
+            con.execute(text("SELECT set_config('statement_timeout', :timeout, true)"),
+                        {'timeout': f"{int(statement_timeout_ms)}ms"})
+
+    def explain_sql(self, query: str, statement_timeout_ms: int=SQL_STATEMENT_TIMEOUT_MS) -> dict:
+        """
+        Returns the planner estimates of a query with `EXPLAIN (FORMAT JSON)`, without running it.
+
+        Args:
+            query (str): The SQL query.
+            statement_timeout_ms (int): Timeout of the EXPLAIN itself, 0 for no limit.
+
+        Returns:
+            dict: `node_type` of the top plan node, its `startup_cost`, `total_cost` and estimated `plan_rows`.
+
+        Raises:
+            ValueError: If the query is not a single statement.
+            Exception: Database errors, e.g. for an invalid statement.
+        """
+        check_single_statement(query)
+        with self.engines.connect(self.db_name) as con:
+            self._begin_guarded(con, statement_timeout_ms)
+            plan = con.execute(text(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')}")).scalar()
+            con.rollback()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        top = plan[0]['Plan']
+        return {
+            'node_type': top.get('Node Type'),
+            'startup_cost': top.get('Startup Cost'),
+            'total_cost': top.get('Total Cost'),
+            'plan_rows': top.get('Plan Rows')
+        }
+
+    def execute_sql_stream(self, query: str, max_rows: int=SQL_MAX_ROWS, max_bytes: int=SQL_MAX_BYTES,
+                           fetch_size: int=SQL_FETCH_SIZE, statement_timeout_ms: int=SQL_STATEMENT_TIMEOUT_MS) -> 'QueryResult':
+        """
+        Executes a query with a server-side cursor and fetches the result in chunks of Arrow record batches,
+        so the full result is never held as Python rows. Fetching stops at the first cap reached.
+        The query runs in a read-only transaction with a statement timeout.
+
+        Args:
+            query (str): The SQL query to be executed.
+            max_rows (int): Maximum number of rows to fetch.
+            max_bytes (int): Maximum size of the fetched Arrow data.
+            fetch_size (int): Number of rows per chunk.
+            statement_timeout_ms (int): Milliseconds before the query is cancelled, 0 for no limit.
+
+        Returns:
+            QueryResult: The fetched rows, flagged as truncated if a cap was reached. Errors, also for
+                a query with several statements, are returned in the result as with `execute_sql`.
+        """
+        from query_result import QueryResult, TRUNCATED_BYTES, TRUNCATED_ROWS, rows_to_batch
+        batches = []
+        n_rows = 0
+        n_bytes = 0
+        truncated = None
+        try:
+            check_single_statement(query)
+            with self.engines.connect(self.db_name) as con:
+                self._begin_guarded(con, statement_timeout_ms)
+                cursor = con.execution_options(stream_results=True, max_row_buffer=fetch_size).execute(text(query))
+                column_names = list(cursor.keys())
+                while truncated is None:
+                    rows = cursor.fetchmany(min(fetch_size, max_rows - n_rows + 1))
+                    if not rows:
+                        break
+                    if n_rows + len(rows) > max_rows:
+                        rows = rows[:max_rows - n_rows]
+                        truncated = TRUNCATED_ROWS
+                    batch = rows_to_batch(rows, column_names)
+                    if n_bytes + batch.nbytes > max_bytes:
+                        # Keep the rows of the chunk which fit, assuming rows of similar size
+                        batch = rows_to_batch(rows[:int(len(rows) * (max_bytes - n_bytes) / batch.nbytes)], column_names)
+                        truncated = TRUNCATED_BYTES
+                    batches.append(batch)
+                    n_rows += batch.num_rows
+                    n_bytes += batch.nbytes
+                # Closing the cursor discards the rows which were not fetched
+                cursor.close()
+        except Exception as e:
+            return QueryResult.from_error(e)
+        return QueryResult.from_batches(batches, column_names, truncated)
+
+    def execute_sql_cached(self, query: str, use_cache: bool=True, max_rows: int=SQL_MAX_ROWS,
+                           max_bytes: int=SQL_MAX_BYTES, statement_timeout_ms: int=SQL_STATEMENT_TIMEOUT_MS) -> 'QueryResult':
+        """
+        Executes a query with `execute_sql_stream` and caches the result as a compressed Arrow buffer,
+        keyed by the current database, the normalised statement and the caps. Errors are not cached.
+
+        Args:
+            query (str): The SQL query to be executed.
+            use_cache (bool): False to bypass the cache. The fresh result still replaces the cached one.
+            max_rows (int): Maximum number of rows to fetch.
+            max_bytes (int): Maximum size of the fetched Arrow data.
+            statement_timeout_ms (int): Milliseconds before the query is cancelled, 0 for no limit.
+
+        Returns:
+            QueryResult: The result, with `cache_age` set if it came from the cache.
+        """
+        from query_result import QueryResult
+        key = (self.db_name, normalize_sql(query), max_rows, max_bytes)
+        if use_cache:
+            buffer = self.result_cache.get(key)
+            if buffer is not None:
+                return QueryResult.from_buffer(buffer, cache_age=self.result_cache.get_age(key) or 0.0)
+        result = self.execute_sql_stream(query, max_rows, max_bytes, statement_timeout_ms=statement_timeout_ms)
+        if result.error is None:
+            self.result_cache.put(key, result.to_buffer())
+        return result
+
+    def invalidate_result_cache(self, db_name: Optional[str]=None) -> int:
+        """
+        Removes the cached results of a database, or of all databases.
+
+        Args:
+            db_name (Optional[str]): The database, None for all.
+
+        Returns:
+            int: Number of removed results.
+        """
+        return self.result_cache.invalidate(lambda key: db_name is None or key[0] == db_name)
+
+    def get_result_cache_stats(self) -> dict:
+        return self.result_cache.get_stats()
+
     def _get_database_list_postgres(self) -> list:
-        with self.engine.connect() as con:
+        with self.engines.connect(self.db_name) as con:
             cursor = con.execute(text(DATABASES_QUERY_POSTGRES))
             df_databases = pd.DataFrame(cursor.fetchall())
             return df_databases.iloc[:,0].tolist()
@@ -238,119 +761,351 @@ class DBConnection:
             
             
 
+    def get_top_databases(self, limit: int=5) -> list:
+        """
+        Returns the databases with the most logged questions.
+
+        Args:
+            limit (int): Maximum number of databases to return.
+
+        Returns:
+            list: Database names, most used first.
+        """
+        db_list = []
+        try:
+            with self._connect_app_db() as con:
+                cursor = con.execute(text(
+                    """
+                    SELECT database_name FROM conversations
+                    GROUP BY database_name
+                    ORDER BY COUNT(*) DESC
+                    LIMIT :limit
+                    """), {'limit': limit})
+                db_list = [row[0] for row in cursor.fetchall()]
+        except (Exception) as error: 
+            print("Error reading top databases from conversations table", error) 
+        return db_list
+
+    def install_ddl_changelog(self, db_name: str) -> int:
+        """
+        Installs the DDL changelog table and its event triggers in a database, see DDL_CHANGELOG_SETUP_POSTGRES.
+        Installing again keeps the recorded changes. Event triggers require a superuser.
+
+        Args:
+            db_name (str): The database.
+
+        Returns:
+            int: Id of the last recorded change, 0 if none.
+        """
+        with self.engines.connect(db_name) as con:
+            for statement in DDL_CHANGELOG_SETUP_POSTGRES:
+                con.execute(text(statement))
+            con.commit()
+        return self.get_last_ddl_change(db_name) or 0
+
+    def get_last_ddl_change(self, db_name: str) -> Optional[int]:
+        """
+        Returns the id of the last recorded DDL change of a database.
+
+        Args:
+            db_name (str): The database.
+
+        Returns:
+            Optional[int]: The id, 0 if nothing changed yet, None if the changelog is not installed.
+        """
+        with self.engines.connect(db_name) as con:
+            installed = con.execute(text("SELECT to_regclass(:table) IS NOT NULL"),
+                                    {'table': f"{DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}"}).scalar()
+            if not installed:
+                return None
+            return con.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {DDL_CHANGELOG_SCHEMA}.{DDL_CHANGELOG_TABLE}")).scalar()
+
+    def get_ddl_changes(self, db_name: str, after_id: int, until_id: int) -> pd.DataFrame:
+        """
+        Returns the DDL changes of a database recorded after `after_id`, up to and including `until_id`.
+
+        Args:
+            db_name (str): The database.
+            after_id (int): Last change already processed.
+            until_id (int): Last change to return.
+
+        Returns:
+            pd.DataFrame: One row per changed object, see DDL_CHANGES_QUERY_POSTGRES.
+        """
+        with self.engines.connect(db_name) as con:
+            cursor = con.execute(text(DDL_CHANGES_QUERY_POSTGRES), {'after_id': after_id, 'until_id': until_id})
+            return pd.DataFrame(cursor.fetchall(), columns=list(cursor.keys()))
+
+    def get_index_watermarks(self) -> dict:
+        """
+        Returns the id of the last DDL change covered by the search indexes of every database.
+        """
+        with self._connect_app_db() as con:
+            cursor = con.execute(text("SELECT database_name, change_id FROM index_watermarks"))
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def save_index_watermarks(self, watermarks: dict, timestamp=None):
+        """
+        Records that the search indexes of databases cover their DDL changes up to the given ids.
+
+        Args:
+            watermarks (dict): Last covered change id by database name.
+            timestamp (datetime): Time of the reindexing, now by default.
+        """
+        if not watermarks:
+            return
+        if timestamp is None:
+            timestamp = datetime.now(tz)
+        rows = [{'database_name': db_name, 'change_id': change_id, 'timestamp': timestamp}
+                for db_name, change_id in watermarks.items()]
+        with self._connect_app_db() as con:
+            for row in rows:
+                con.execute(text(
+                    """
+                    INSERT INTO index_watermarks (database_name, change_id, timestamp)
+                    VALUES (:database_name, :change_id, :timestamp)
+                    ON CONFLICT (database_name) DO UPDATE
+                    SET change_id = GREATEST(index_watermarks.change_id, EXCLUDED.change_id),
+                        timestamp = EXCLUDED.timestamp
+                    """), row)
+            con.commit()
+
+    def get_positive_conversations(self, limit: int=10000) -> list:
+        """
+        Returns the most recent conversations with positive feedback. Conversations whose SQL was reused
+        by the question cache for an answer with negative feedback are left out, see `QuestionCache.on_feedback`.
+
+        Args:
+            limit (int): Maximum number of conversations.
+
+        Returns:
+            list: Dicts with the `id`, `question`, `database_name` and `answer` of the conversations.
+        """
+        try:
+            with self._connect_app_db() as con:
+                cursor = con.execute(text(
+                    """
+                    SELECT c.id, c.question, c.database_name, c.answer
+                    FROM conversations c
+                    JOIN feedback f ON f.conversation_id = c.id
+                    WHERE f.feedback > 0
+                    AND NOT EXISTS (
+                        SELECT 1 FROM conversations r
+                        JOIN feedback rf ON rf.conversation_id = r.id
+                        WHERE rf.feedback < 0
+                        AND r.rag_parameters LIKE '%''cached_conversation_id'': ''' || c.id || '''%'
+                    )
+                    ORDER BY c.timestamp DESC
+                    LIMIT :limit
+                    """), {'limit': limit})
+                return [dict(row._mapping) for row in cursor.fetchall()]
+        except (Exception) as error:
+            print("Error reading positive conversations", error)
+            return []
+
+    def load_llm_response(self, model_id: str, prompt_hash: str, max_age: Optional[float]=None) -> Optional[tuple]:
+        """
+        Returns a cached LLM answer from the llm_responses table and its age.
+
+        Args:
+            model_id (str): The model id, see `LLM.get_model_list`.
+            prompt_hash (str): SHA-256 of the rendered prompt.
+            max_age (Optional[float]): Answers older than this many seconds are ignored, None for no limit.
+
+        Returns:
+            Optional[tuple]: The answer data returned by the provider and the seconds since it was
+                stored, None if not cached.
+        """
+        try:
+            with self._connect_app_db() as con:
+                cursor = con.execute(text(
+                    """
+                    SELECT answer_data, EXTRACT(EPOCH FROM now() - timestamp) FROM llm_responses
+                    WHERE model_id = :model_id AND prompt_hash = :prompt_hash
+                    AND (CAST(:max_age AS FLOAT) IS NULL OR timestamp > now() - make_interval(secs => :max_age))
+                    """), {'model_id': model_id, 'prompt_hash': prompt_hash, 'max_age': max_age})
+                row = cursor.fetchone()
+        except (Exception) as error:
+            print("Error reading from llm_responses table", error)
+            return None
+        return (json.loads(row[0]), float(row[1])) if row is not None else None
+
+    @staticmethod
+    def llm_response_row(model_id: str, prompt_hash: str, answer_data: dict, max_entries: Optional[int]=None,
+                         timestamp=None) -> dict:
+        """
+        Returns the row of the llm_responses table for an LLM answer, see `save_llm_response`.
+        `max_entries` is not a column, it is passed on to `trim_llm_responses` by `save_logs`.
+        """
+        if timestamp is None:
+            timestamp = datetime.now(tz)
+        return {'model_id': model_id, 'prompt_hash': prompt_hash, 'answer_data': json.dumps(answer_data),
+                'timestamp': timestamp, 'max_entries': max_entries}
+
+    def save_llm_response(self, model_id: str, prompt_hash: str, answer_data: dict, max_entries: Optional[int]=None,
+                          timestamp=None):
+        """
+        Stores an LLM answer in the llm_responses table. Use `LogWriter.save_llm_response` to store it in the background.
+
+        Args:
+            model_id (str): The model id, see `LLM.get_model_list`.
+            prompt_hash (str): SHA-256 of the rendered prompt.
+            answer_data (dict): The answer data returned by the provider.
+            max_entries (Optional[int]): Maximum number of stored answers, None for no limit.
+                See `trim_llm_responses`.
+            timestamp (datetime): Time of the answer, now by default.
+        """
+        try:
+            self.save_logs([], [], [self.llm_response_row(model_id, prompt_hash, answer_data, max_entries, timestamp)])
+        except (Exception) as error:
+            print("Error writing to llm_responses table", error)
+
+    def trim_llm_responses(self, max_entries: int, margin: float=LLM_RESPONSES_TRIM_MARGIN) -> int:
+        """
+        Keeps the `max_entries` most recent answers of the llm_responses table, once it holds more than
+        `max_entries * (1 + margin)` answers.
+
+        Args:
+            max_entries (int): Number of answers kept.
+            margin (float): Fraction of `max_entries` the table may exceed before it is trimmed.
+
+        Returns:
+            int: Number of deleted answers.
+        """
+        with self._connect_app_db() as con:
+            over_limit = con.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM llm_responses ORDER BY timestamp DESC LIMIT 1 OFFSET :limit)"),
+                {'limit': int(max_entries * (1 + margin))}).scalar()
+            if not over_limit:
+                return 0
+            deleted = con.execute(text(
+                """
+                DELETE FROM llm_responses WHERE timestamp < (
+                    SELECT timestamp FROM llm_responses ORDER BY timestamp DESC LIMIT 1 OFFSET :max_entries
+                )
+                """), {'max_entries': max_entries - 1}).rowcount
+            con.commit()
+        return deleted
+
     def save_file(self, file_name: str, file_data):
-        temp_db_name = ''         
-        if self.db_name != self.main_db_name:
-            temp_db_name = self.db_name
-            self.db_name = self.main_db_name 
-            self._init_engine()
-        try:        
-            try:    
-                with self.engine.connect() as con:
-                    # Delete the file if it already exists        
-                    con.execute(text(f"DELETE FROM files WHERE file_name = '{file_name}'"))
-                    #data = sql_func.HEX(file_data)
-                    #print(data)
-                    # Execute the INSERT statement 
-                    con.execute(text(f"INSERT INTO files\
-                        (file_name, file_data)\
-                        VALUES(:file_name, :file_data)"), {'file_name': file_name, 'file_data': file_data})
-                    # Commit the changes to the database 
-                    con.commit() 
-            except (Exception) as error: 
-                print("Error while inserting data in files table", error) 
-            finally: 
-                pass
-        finally: 
-            if temp_db_name != '':
-                self.db_name = temp_db_name
-                self._init_engine()                
+        try:    
+            with self._connect_app_db() as con:
+                # Delete the file if it already exists        
+                con.execute(text(f"DELETE FROM files WHERE file_name = '{file_name}'"))
+                #data = sql_func.HEX(file_data)
+                #print(data)
+                # Execute the INSERT statement 
+                con.execute(text(f"INSERT INTO files\
+                    (file_name, file_data)\
+                    VALUES(:file_name, :file_data)"), {'file_name': file_name, 'file_data': file_data})
+                # Commit the changes to the database 
+                con.commit() 
+        except (Exception) as error: 
+            print("Error while inserting data in files table", error) 
         
     def load_file(self, file_name: str): 
-        temp_db_name = '' 
-        if self.db_name != self.main_db_name:
-            temp_db_name = self.db_name
-            self.db_name = self.main_db_name 
-            self._init_engine() 
         data = None        
         try:            
-            with self.engine.connect() as con:                
+            with self._connect_app_db() as con:                
                 cursor = con.execute(text(f"SELECT file_data FROM files WHERE file_name = '{file_name}'"))
                 data = cursor.fetchone()[0]
                 # print(data)
         except (Exception) as error: 
             print("Error reading data from files table", error) 
-        finally: 
-            if temp_db_name != '':
-                self.db_name = temp_db_name
-                self._init_engine()              
         return data
 
-    def save_conversation(self, conversation_id, question, answer_data, timestamp=None):
-        if timestamp is None:
-            timestamp = datetime.now(tz)
-        temp_db_name = '' 
-        if self.db_name != self.main_db_name:
-            temp_db_name = self.db_name
-            self.db_name = self.main_db_name 
-            self._init_engine()  
+    def get_file_digest(self, file_name: str):
+        """
+        Returns the MD5 digest of a file stored in the files table without transferring it.
+
+        Args:
+            file_name (str): The name of the file.
+
+        Returns:
+            str: Hex digest of the file data, None if the file does not exist.
+        """
+        digest = None
         try:
-            print(answer_data)
-            with self.engine.connect() as con:  
-                con.execute(text(
-                    """
-                    INSERT INTO conversations 
-                    (id, question, answer, database_name, model, search_provider, rag_parameters, response_time, relevance, 
-                    relevance_explanation, prompt_tokens, completion_tokens, total_tokens, 
-                    eval_prompt_tokens, eval_completion_tokens, eval_total_tokens, llm_cost, timestamp)
-                    VALUES (:v1, :v2, :v3, :v4, :v5, :v6, :v7, :v8, :v9, :v10, :v11, :v12, :v13, :v14, :v15, :v16, :v17, :v18)
-                    """), {
-                        'v1': conversation_id,
-                        'v2': question,
-                        'v3': answer_data["answer"],
-                        'v4': answer_data["database_name"],                        
-                        'v5': answer_data["model"],
-                        'v6': answer_data["search_provider"],
-                        'v7': answer_data["rag_parameters"],                        
-                        'v8': answer_data["response_time"],
-                        'v9': answer_data["relevance"],
-                        'v10': answer_data["relevance_explanation"],
-                        'v11': answer_data["prompt_tokens"],
-                        'v12': answer_data["completion_tokens"],
-                        'v13': answer_data["total_tokens"],
-                        'v14': answer_data["eval_prompt_tokens"],
-                        'v15': answer_data["eval_completion_tokens"],
-                        'v16': answer_data["eval_total_tokens"],
-                        'v17': answer_data["llm_cost"],
-                        'v18': timestamp
-                })
-                con.commit()
-        finally:
-            if temp_db_name != '':
-                self.db_name = temp_db_name
-                self._init_engine()
+            with self._connect_app_db() as con:
+                cursor = con.execute(text("SELECT md5(file_data) FROM files WHERE file_name = :file_name"),
+                                     {'file_name': file_name})
+                row = cursor.fetchone()
+                digest = row[0] if row is not None else None
+        except (Exception) as error: 
+            print("Error reading digest from files table", error) 
+        return digest
 
+    @staticmethod
+    def conversation_row(conversation_id, question, answer_data, timestamp=None) -> dict:
+        """
+        Returns the row of the conversations table for a question and its answer data.
+        """
+        if timestamp is None:
+            timestamp = datetime.now(tz)
+        row = {'id': conversation_id, 'question': question}
+        for column in CONVERSATION_COLUMNS[2:-1]:
+            row[column] = answer_data[column]
+        row['timestamp'] = timestamp
+        return row
 
-    def save_feedback(self, conversation_id, feedback, timestamp=None):
+    @staticmethod
+    def feedback_row(conversation_id, feedback, timestamp=None) -> dict:
+        """
+        Returns the row of the feedback table for a feedback on a conversation.
+        """
         if timestamp is None:
             timestamp = datetime.now(tz)
-        temp_db_name = '' 
-        if self.db_name != self.main_db_name:
-            temp_db_name = self.db_name
-            self.db_name = self.main_db_name 
-            self._init_engine() 
-        try:
-            with self.engine.connect() as con:  
-                con.execute(text(
-                    f"DELETE FROM feedback WHERE conversation_id='{conversation_id}'"))
-                con.execute(text(
-                    """INSERT INTO feedback (conversation_id, feedback, timestamp) VALUES (:v1, :v2, COALESCE(:v3, CURRENT_TIMESTAMP))"""),
-                    {'v1': conversation_id, 'v2': feedback, 'v3': timestamp}
-                )
-                con.commit()            
-        finally:
-            if temp_db_name != '':
-                self.db_name = temp_db_name
-                self._init_engine()  
+        return {'conversation_id': conversation_id, 'feedback': feedback, 'timestamp': timestamp}
+
+    def save_conversation(self, conversation_id, question, answer_data, timestamp=None):
+        print(answer_data)
+        self.save_logs([self.conversation_row(conversation_id, question, answer_data, timestamp)], [])
+
+    def save_feedback(self, conversation_id, feedback, timestamp=None):
+        self.save_logs([], [self.feedback_row(conversation_id, feedback, timestamp)])
+
+    def save_logs(self, conversations: list, feedback: list, llm_responses: list=()):
+        """
+        Writes conversation, feedback and LLM answer rows in one transaction with multi-row INSERTs.
+        A new feedback replaces the previous feedback of its conversation, a new answer the previous
+        answer to its prompt. The llm_responses table is then trimmed in a separate transaction to the
+        smallest `max_entries` of the answers, see `trim_llm_responses`.
+
+        Args:
+            conversations (list): Rows of the conversations table, see `conversation_row`.
+            feedback (list): Rows of the feedback table, see `feedback_row`.
+            llm_responses (list): Rows of the llm_responses table, see `llm_response_row`.
+        """
+        # Only the last feedback per conversation is kept
+        feedback = list({row['conversation_id']: row for row in feedback}.values())
+        with self._connect_app_db() as con:
+            self._insert_rows(con, 'conversations', CONVERSATION_COLUMNS, conversations)
+            if feedback:
+                con.execute(text("DELETE FROM feedback WHERE conversation_id IN :ids").bindparams(
+                    bindparam('ids', expanding=True)), {'ids': [row['conversation_id'] for row in feedback]})
+                self._insert_rows(con, 'feedback', FEEDBACK_COLUMNS, feedback)
+            if llm_responses:
+                # An upsert cannot change the same row twice, only the last answer per prompt is kept
+                rows = list({(row['model_id'], row['prompt_hash']): row for row in llm_responses}.values())
+                self._insert_rows(con, 'llm_responses', LLM_RESPONSE_COLUMNS, rows,
+                                  "ON CONFLICT (model_id, prompt_hash) DO UPDATE "
+                                  "SET answer_data = EXCLUDED.answer_data, timestamp = EXCLUDED.timestamp")
+            con.commit()
+        max_entries = [row['max_entries'] for row in llm_responses if row.get('max_entries') is not None]
+        if max_entries:
+            # Trimming is separate, its failure does not lose the written rows
+            try:
+                self.trim_llm_responses(min(max_entries))
+            except (Exception) as error:
+                print("Error trimming llm_responses table", error)
+
+    @staticmethod
+    def _insert_rows(con, table: str, columns: list, rows: list, on_conflict: str=''):
+        # Bound parameters per statement stay below the PostgreSQL limit of 65535
+        chunk_size = max(1, 30000 // len(columns))
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            values = ', '.join('(' + ', '.join(f":{column}_{i}" for column in columns) + ')' for i in range(len(chunk)))
+            params = {f"{column}_{i}": row[column] for i, row in enumerate(chunk) for column in columns}
+            con.execute(text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} {on_conflict}"), params)
 
-           
\ No newline at end of file
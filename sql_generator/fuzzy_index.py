@@ -0,0 +1,412 @@
+from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+from index_artifact import Artifact, StringArray, dump_artifact
+import numpy as np
+import pandas as pd
+
+NGRAM_SIZE = 3
+# Code points need 21 bits, so up to three characters pack into one uint64 key.
+MAX_NGRAM_SIZE = 3
+ARTIFACT_KIND = 'fuzzy_catalog'
+ARTIFACT_VERSION = 1
+# Above this share of keyword/term pairs the n-gram shortlists are dropped for a full scan.
+SHORTLIST_MAX_SHARE = 0.5
+
+
+def ngram_keys(text: str, n: int=NGRAM_SIZE) -> np.ndarray:
+    """
+    Returns the distinct character n-grams of a string packed into sorted uint64 keys.
+
+    Args:
+        text (str): The string to split.
+        n (int): The n-gram size, at most MAX_NGRAM_SIZE.
+
+    Returns:
+        np.ndarray: Sorted distinct n-gram keys, empty if the string is shorter than n.
+    """
+    if len(text) < n:
+        return np.empty(0, dtype=np.uint64)
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    keys = np.zeros(len(text) - n + 1, dtype=np.uint64)
+    for i in range(n):
+        keys = (keys << np.uint64(21)) | codes[i:len(codes) - n + 1 + i]
+    return np.unique(keys)
+
+
+def max_edits(length, similarity_threshold):
+    """
+    Upper bound of insertions/deletions between the shorter string of `length` characters
+    and its best window, for `partial_ratio` to exceed `similarity_threshold`.
+
+    The score is 2*M/(m+w) with M matched characters, m the shorter length and w <= m the
+    window length, so the number of unmatched characters m+w-2*M stays below 2*m*(1-t).
+    """
+    return np.floor(2 * np.asarray(length) * (100 - similarity_threshold) / 100 + 1e-9).astype(np.int64)
+
+
+class NGramIndex:
+    """
+    Character n-gram inverted index over the catalog terms.
+
+    Every unmatched character of an alignment destroys at most n n-grams of the shorter
+    string, so a pair can only exceed the similarity threshold if the two strings share
+    at least `distinct n-grams - n * max_edits` n-grams. This gives a shortlist without
+    false negatives. Terms and keywords too short for the bound to prune anything are
+    always kept.
+
+    Attributes:
+        n (int): The n-gram size.
+        keys (np.ndarray): Sorted distinct n-gram keys.
+        offsets (np.ndarray): CSR offsets into `postings`, one row per key.
+        postings (np.ndarray): Term ids containing each n-gram.
+        term_lengths (np.ndarray): Length of every term.
+        term_ngrams (np.ndarray): Number of distinct n-grams of every term.
+    """
+
+    def __init__(self, n, keys, offsets, postings, term_lengths, term_ngrams, length_order=None):
+        self.n = n
+        self.keys = keys
+        self.offsets = offsets
+        self.postings = postings
+        self.term_lengths = term_lengths
+        self.term_ngrams = term_ngrams
+        self.length_order = np.argsort(term_lengths, kind='stable') if length_order is None else length_order
+        self.sorted_lengths = term_lengths[self.length_order]
+        self._free_terms = {}
+
+    @classmethod
+    def build(cls, terms, n: int=NGRAM_SIZE) -> 'NGramIndex':
+        """
+        Builds the index for the given terms.
+
+        Args:
+            terms (Sequence[str]): The terms to index, addressed by position.
+            n (int): The n-gram size, at most MAX_NGRAM_SIZE.
+
+        Returns:
+            NGramIndex: The built index.
+        """
+        if not 1 <= n <= MAX_NGRAM_SIZE:
+            raise ValueError(f"N-gram size must be between 1 and {MAX_NGRAM_SIZE}, got {n}.")
+        term_grams = [ngram_keys(term, n) for term in terms]
+        term_ngrams = np.array([len(grams) for grams in term_grams], dtype=np.int32)
+        all_keys = np.concatenate(term_grams) if term_grams else np.empty(0, dtype=np.uint64)
+        all_terms = np.repeat(np.arange(len(terms), dtype=np.int32), term_ngrams)
+        order = np.lexsort((all_terms, all_keys))
+        keys, counts = np.unique(all_keys[order], return_counts=True)
+        return cls(
+            n=n,
+            keys=keys,
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            postings=all_terms[order],
+            term_lengths=np.array([len(term) for term in terms], dtype=np.int32),
+            term_ngrams=term_ngrams
+        )
+
+    def candidates(self, keyword: str, similarity_threshold=90, guaranteed_recall=True) -> np.ndarray:
+        """
+        Returns the shortlist of terms which may match the keyword.
+
+        Args:
+            keyword (str): The keyword to look up.
+            similarity_threshold (int): The `partial_ratio` threshold the shortlist is built for.
+            guaranteed_recall (bool): If True, never drops a term scoring above the threshold.
+                Otherwise only the terms sharing at least one n-gram with the keyword are returned.
+
+        Returns:
+            np.ndarray: Term ids.
+        """
+        grams = ngram_keys(keyword, self.n)
+        pos = np.searchsorted(self.keys, grams)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == grams[found]
+        pos = pos[found]
+        if len(pos):
+            hits = np.concatenate([self.postings[self.offsets[p]:self.offsets[p + 1]] for p in pos])
+            shared = np.bincount(hits, minlength=len(self.term_lengths))
+            term_ids = np.nonzero(shared)[0]
+            shared = shared[term_ids]
+        else:
+            term_ids, shared = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if not guaranteed_recall:
+            return term_ids
+
+        length = len(keyword)
+        keyword_required = len(grams) - self.n * max_edits(length, similarity_threshold)
+        term_lengths = self.term_lengths[term_ids]
+        term_required = self.term_ngrams[term_ids] - self.n * max_edits(term_lengths, similarity_threshold)
+        # The bound applies to the shorter string of the pair (both candidates on a tie).
+        required = np.where(term_lengths > length, keyword_required,
+                            np.where(term_lengths < length, term_required,
+                                     np.minimum(keyword_required, term_required)))
+        term_ids = term_ids[shared >= required]
+        # Terms without a shared n-gram can still match when their own bound does not prune.
+        if keyword_required > 0:
+            split = np.searchsorted(self.sorted_lengths, length, side='right')
+            free_pos = self._get_free_terms(similarity_threshold)
+            return np.union1d(term_ids, self.length_order[free_pos[:np.searchsorted(free_pos, split)]])
+        # Nor does the keyword bound, so every term at least as long as the keyword is kept.
+        split = np.searchsorted(self.sorted_lengths, length, side='left')
+        free_pos = self._get_free_terms(similarity_threshold)
+        short_ids = np.union1d(term_ids[self.term_lengths[term_ids] < length],
+                               self.length_order[free_pos[:np.searchsorted(free_pos, split)]])
+        return np.concatenate([short_ids, self.length_order[split:]])
+
+    def _get_free_terms(self, similarity_threshold) -> np.ndarray:
+        """
+        Positions in `length_order` of the terms whose own bound requires no shared n-gram.
+        """
+        free_pos = self._free_terms.get(similarity_threshold)
+        if free_pos is None:
+            required = self.term_ngrams - self.n * max_edits(self.term_lengths, similarity_threshold)
+            free_pos = np.nonzero(required[self.length_order] <= 0)[0]
+            self._free_terms[similarity_threshold] = free_pos
+        return free_pos
+
+
+class FuzzyCatalog:
+    """
+    Flattened view of a database catalog used by FuzzySearch.
+
+    Every table name and column name is interned once into `terms`. Tables reference
+    their name and columns by term id, so all keywords can be scored against all
+    distinct terms in a single batched call and the result reduced per table with NumPy.
+
+    The catalog is stored as a versioned artifact (see `index_artifact`), so a loaded
+    catalog is a set of read-only views over a memory-mapped file.
+
+    Attributes:
+        terms (StringArray): Distinct table and column names.
+        table_schema (StringArray): Schema name per table.
+        table_name (StringArray): Table name per table.
+        table_terms (np.ndarray): Term id of the table name per table.
+        column_offsets (np.ndarray): CSR offsets into `column_terms`, one row per table.
+        column_terms (np.ndarray): Term ids of the table columns.
+        ngram_index (NGramIndex): Optional n-gram index over `terms` used to shortlist candidates.
+    """
+
+    def __init__(self, terms, table_schema, table_name, table_terms, column_offsets, column_terms, ngram_index=None):
+        self.terms = terms
+        self.table_schema = table_schema
+        self.table_name = table_name
+        self.table_terms = table_terms
+        self.column_offsets = column_offsets
+        self.column_terms = column_terms
+        self.ngram_index = ngram_index
+        self._occ_term = None
+        self._occ_table = None
+
+    @classmethod
+    def from_dataframe(cls, df_table_columns: pd.DataFrame) -> 'FuzzyCatalog':
+        """
+        Builds the catalog from `DBMetadata.df_table_columns`.
+
+        Args:
+            df_table_columns (pd.DataFrame): One row per table with the list of its columns in `column_name`.
+
+        Returns:
+            FuzzyCatalog: The flattened catalog.
+        """
+        term_ids = {}
+
+        def intern(term):
+            return term_ids.setdefault(term, len(term_ids))
+
+        table_terms = [intern(name) for name in df_table_columns['table_name']]
+        column_offsets = [0]
+        column_terms = []
+        for columns in df_table_columns['column_name']:
+            column_terms.extend(intern(column) for column in columns)
+            column_offsets.append(len(column_terms))
+        return cls(
+            terms=StringArray.from_list(term_ids.keys()),
+            table_schema=StringArray.from_list(df_table_columns['table_schema']),
+            table_name=StringArray.from_list(df_table_columns['table_name']),
+            table_terms=np.asarray(table_terms, dtype=np.int32),
+            column_offsets=np.asarray(column_offsets, dtype=np.int64),
+            column_terms=np.asarray(column_terms, dtype=np.int32)
+        )
+
+    @classmethod
+    def from_artifact(cls, artifact: Artifact) -> 'FuzzyCatalog':
+        """
+        Creates the catalog over the arrays of a loaded artifact without copying them.
+
+        Args:
+            artifact (Artifact): Artifact of kind ARTIFACT_KIND.
+
+        Returns:
+            FuzzyCatalog: The catalog.
+        """
+        ngram_index = None
+        if 'ngram.keys' in artifact:
+            ngram_index = NGramIndex(
+                n=artifact.meta['ngram_size'],
+                keys=artifact.array('ngram.keys'),
+                offsets=artifact.array('ngram.offsets'),
+                postings=artifact.array('ngram.postings'),
+                term_lengths=artifact.array('ngram.term_lengths'),
+                term_ngrams=artifact.array('ngram.term_ngrams'),
+                length_order=artifact.array('ngram.length_order')
+            )
+        return cls(
+            terms=artifact.strings('terms'),
+            table_schema=artifact.strings('table_schema'),
+            table_name=artifact.strings('table_name'),
+            table_terms=artifact.array('table_terms'),
+            column_offsets=artifact.array('column_offsets'),
+            column_terms=artifact.array('column_terms'),
+            ngram_index=ngram_index
+        )
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialises the catalog and its n-gram index into an artifact.
+
+        Returns:
+            bytes: The artifact.
+        """
+        arrays = {
+            'terms': self.terms,
+            'table_schema': self.table_schema,
+            'table_name': self.table_name,
+            'table_terms': self.table_terms,
+            'column_offsets': self.column_offsets,
+            'column_terms': self.column_terms
+        }
+        meta = {}
+        if self.ngram_index is not None:
+            for name in ['keys', 'offsets', 'postings', 'term_lengths', 'term_ngrams', 'length_order']:
+                arrays[f"ngram.{name}"] = getattr(self.ngram_index, name)
+            meta['ngram_size'] = self.ngram_index.n
+        return dump_artifact(ARTIFACT_KIND, ARTIFACT_VERSION, arrays, meta)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the catalog arrays, mapped or in memory.
+        """
+        arrays = [self.table_terms, self.column_offsets, self.column_terms]
+        for strings in [self.terms, self.table_schema, self.table_name]:
+            arrays.extend([strings.data, strings.offsets])
+        if self.ngram_index is not None:
+            arrays.extend([self.ngram_index.keys, self.ngram_index.offsets, self.ngram_index.postings,
+                           self.ngram_index.term_lengths, self.ngram_index.term_ngrams, self.ngram_index.length_order])
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def occ_term(self) -> np.ndarray:
+        """
+        Term id of every table/term pair: one row for the table name and one for every column.
+        """
+        if self._occ_term is None:
+            self._occ_term = np.concatenate([self.table_terms, self.column_terms])
+        return self._occ_term
+
+    @property
+    def occ_table(self) -> np.ndarray:
+        """
+        Table id of every table/term pair, aligned with `occ_term`.
+        """
+        if self._occ_table is None:
+            table_ids = np.arange(len(self.table_terms), dtype=np.int32)
+            self._occ_table = np.concatenate([table_ids, np.repeat(table_ids, np.diff(self.column_offsets))])
+        return self._occ_table
+
+    def build_ngram_index(self, n: int=NGRAM_SIZE):
+        """
+        Builds the n-gram index used to shortlist candidate terms.
+
+        Args:
+            n (int): The n-gram size, at most MAX_NGRAM_SIZE.
+        """
+        self.ngram_index = NGramIndex.build(self.terms, n)
+
+    def match_terms(self, keywords: list, similarity_threshold=90, guaranteed_recall=True) -> np.ndarray:
+        """
+        Finds the terms matching at least one keyword.
+
+        Keywords are scored with `rapidfuzz.process.cdist`, against all terms at once or,
+        when the n-gram index prunes enough, against the shortlist of every keyword.
+        Rapidfuzz's `partial_ratio` never scores below the fuzzywuzzy implementation, so the
+        scores are used as a filter and the surviving pairs are confirmed with
+        `fuzzywuzzy.fuzz.partial_ratio` to keep the result identical to the row-wise scorer.
+
+        Args:
+            keywords (list): Keywords extracted from the user question.
+            similarity_threshold (int): Minimal score (exclusive) for a keyword to match a term.
+            guaranteed_recall (bool): Passed to `NGramIndex.candidates`.
+
+        Returns:
+            np.ndarray: Boolean mask over `terms`.
+        """
+        term_hits = np.zeros(len(self.terms), dtype=bool)
+        if len(keywords) == 0 or len(self.terms) == 0:
+            return term_hits
+        keywords = list(keywords)
+        shortlists = None
+        if self.ngram_index is not None:
+            shortlists = [self.ngram_index.candidates(keyword, similarity_threshold, guaranteed_recall)
+                          for keyword in keywords]
+            # Short keywords at low thresholds cannot be pruned, the batched full scan is cheaper then.
+            if sum(len(term_ids) for term_ids in shortlists) > SHORTLIST_MAX_SHARE * len(keywords) * len(self.terms):
+                shortlists = None
+        if shortlists is None:
+            scores = rf_process.cdist(keywords, self.terms.to_list(), scorer=rf_fuzz.partial_ratio,
+                                      score_cutoff=similarity_threshold, dtype=np.float32, workers=-1)
+            pairs = zip(*np.nonzero(scores > similarity_threshold))
+        else:
+            pairs = self._match_shortlists(keywords, shortlists, similarity_threshold)
+        for keyword_id, term_id in pairs:
+            if term_hits[term_id]:
+                continue
+            if fuzz.partial_ratio(keywords[keyword_id], self.terms[term_id]) > similarity_threshold:
+                term_hits[term_id] = True
+        return term_hits
+
+    def _match_shortlists(self, keywords: list, shortlists: list, similarity_threshold):
+        """
+        Yields (keyword id, term id) pairs scoring above the threshold within the n-gram shortlists.
+        """
+        for keyword_id, (keyword, term_ids) in enumerate(zip(keywords, shortlists)):
+            if len(term_ids) == 0:
+                continue
+            scores = rf_process.cdist([keyword], list(self.terms[term_ids]), scorer=rf_fuzz.partial_ratio,
+                                      score_cutoff=similarity_threshold, dtype=np.float32, workers=-1)
+            for term_id in term_ids[scores[0] > similarity_threshold]:
+                yield keyword_id, term_id
+
+    def match_tables(self, keywords: list, similarity_threshold=90, guaranteed_recall=True) -> np.ndarray:
+        """
+        Finds the tables whose name or any column matches at least one keyword.
+
+        Args:
+            keywords (list): Keywords extracted from the user question.
+            similarity_threshold (int): Minimal score (exclusive) for a keyword to match a name.
+            guaranteed_recall (bool): Passed to `NGramIndex.candidates`.
+
+        Returns:
+            np.ndarray: Boolean mask over the catalog tables.
+        """
+        term_hits = self.match_terms(keywords, similarity_threshold, guaranteed_recall)
+        table_hits = np.bincount(self.occ_table, weights=term_hits[self.occ_term], minlength=len(self.table_terms))
+        return table_hits > 0
+
+    def get_tables(self, table_mask: np.ndarray) -> pd.DataFrame:
+        """
+        Returns the selected tables in the `df_table_columns` layout.
+
+        Args:
+            table_mask (np.ndarray): Boolean mask over the catalog tables.
+
+        Returns:
+            pd.DataFrame: Columns `table_schema`, `table_name` and `column_name` (list of columns).
+        """
+        table_ids = np.nonzero(table_mask)[0]
+        columns = [list(self.terms[self.column_terms[self.column_offsets[i]:self.column_offsets[i + 1]]])
+                   for i in table_ids]
+        return pd.DataFrame({
+            'table_schema': self.table_schema[table_ids],
+            'table_name': self.table_name[table_ids],
+            'column_name': columns
+        })
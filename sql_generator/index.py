@@ -7,6 +7,8 @@ import yaml
 
 
 DATA_PATH = os.getenv("DATA_PATH", "../data/llama_text_to_sql_dataset")
+# Fitted minsearch index, defaults to a file next to the dataset.
+MINSEARCH_INDEX_PATH = os.getenv("MINSEARCH_INDEX_PATH")
 CONFIG_DIR = "config/"
 
 
@@ -57,31 +59,72 @@ class Index:
         else:
             raise ValueError(f"Unknown engine: {self.engine}")
 
+    def search_many(self, queries, top_k=5, *args, **kwargs):
+        """
+        Search for a batch of queries using the specified search engine.
+        Args:
+            queries (list): The search queries.
+            top_k (int, optional): The number of top results to return per query. Defaults to 5.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+        Keyword Args:
+            filter_dicts (dict or list, optional): Filters shared by all queries or one dictionary per query.
+            boost_dict (dict, optional): A dictionary of boost parameters.
+        Returns:
+            list: A list of search results per query.
+        Raises:
+            ValueError: If the search engine does not support batch search.
+        """
+        
+        if self.engine == "minsearch":
+            filter_dicts = kwargs.get("filter_dicts", {})
+            boost_dict = kwargs.get("boost_dict", {})
+            return self.index.search_many(queries, filter_dicts, boost_dict, top_k)
+        else:
+            raise ValueError(f"Batch search is not supported by engine: {self.engine}")
+
 
     def __load_minsearch_index(self, data_path=DATA_PATH, **kwargs):
         """
         Load and fit a MinSearch index from a dataset stored on disk.
-        This method loads a dataset from the specified data path, converts it to a pandas DataFrame,
-        and then to a list of dictionaries. It reads the configuration for the MinSearch index from
-        a YAML file and fits the index using the documents from the dataset.
+        A fitted index saved for the same dataset fingerprint and configuration is memory-mapped
+        instead of refitting. Otherwise this method reads the configuration for the MinSearch index
+        from a YAML file, fits the index on the Arrow dataset and saves it. Documents are served from
+        the memory-mapped dataset in both cases, they are not stored with the index.
         Args:
             data_path (str): The path to the dataset to be loaded. Defaults to DATA_PATH.
             **kwargs: Additional keyword arguments.
+        Keyword Args:
+            index_path (str, optional): The fitted index file. Defaults to MINSEARCH_INDEX_PATH.
         Returns:
             minsearch.Index: The fitted MinSearch index.
         """
         
         src_dataset = load_from_disk(data_path)
-        df_dataset = src_dataset.to_pandas()
-        documents = df_dataset.to_dict(orient="records")
         config_path = os.path.join(CONFIG_DIR, f"{self.engine}.yaml")
         with open(config_path, "r") as file:
             config = yaml.safe_load(file)
+        metadata = {"fingerprint": src_dataset._fingerprint, "config": config}
+        index_path = kwargs.get("index_path") or MINSEARCH_INDEX_PATH or f"{data_path.rstrip('/')}.minsearch.idx"
+        if os.path.exists(index_path):
+            try:
+                index = minsearch.Index.load(index_path, docs=src_dataset)
+                if index.metadata == metadata:
+                    return index
+            except Exception as e:
+                print(f"Error loading index {index_path}: {e}")
+
         index = minsearch.Index(
             text_fields=config["text_fields"],
             keyword_fields=config["keyword_fields"],
+            layout=config.get("layout", minsearch.LAYOUT_FIELDS),
         )
-        index.fit(documents)
+        index.fit(src_dataset)
+        index.metadata = metadata
+        try:
+            index.save(index_path, include_docs=False)
+        except Exception as e:
+            print(f"Error saving index {index_path}: {e}")
         return index
     
     
@@ -0,0 +1,209 @@
+import glob, json, mmap, os, struct, tempfile
+import numpy as np
+
+MAGIC = b'SQLGIDX\0'
+# Version of the container layout below, payload versions are tracked per artifact kind.
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sII')
+
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sql_generator_index_cache"))
+
+# Artifact layout:
+#   preamble: magic, container version, header length
+#   header:   JSON with kind, payload version, metadata and the offset/dtype/shape of every array
+#   data:     raw little-endian arrays, each aligned to ALIGNMENT bytes from the start of the file
+
+
+class StringArray:
+    """
+    Read-only array of strings stored as one UTF-8 buffer and an offsets array.
+
+    Strings are decoded on access, so a memory-mapped array costs nothing until it is used.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+        self._strings = None
+
+    @classmethod
+    def from_list(cls, strings) -> 'StringArray':
+        encoded = [str(s).encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            if self._strings is not None:
+                return self._strings[item]
+            return self.data[self.offsets[item]:self.offsets[item + 1]].tobytes().decode('utf-8')
+        if isinstance(item, slice):
+            item = range(*item.indices(len(self)))
+        strings = np.empty(len(item), dtype=object)
+        strings[:] = [self[int(i)] for i in item]
+        return strings
+
+    def to_list(self) -> list:
+        """
+        Returns all strings, decoding them once.
+        """
+        if self._strings is None:
+            self._strings = [self[i] for i in range(len(self))]
+        return self._strings
+
+
+def dump_artifact(kind: str, version: int, arrays: dict, meta: dict=None) -> bytes:
+    """
+    Serialises arrays into the artifact layout.
+
+    Args:
+        kind (str): Artifact kind, checked on load.
+        version (int): Payload version of the kind.
+        arrays (dict): Arrays by name. StringArray values are stored as `<name>.data` and `<name>.offsets`.
+        meta (dict): Optional JSON serialisable metadata.
+
+    Returns:
+        bytes: The artifact.
+    """
+    flat = {}
+    for name, array in arrays.items():
+        if isinstance(array, StringArray):
+            flat[f"{name}.data"] = array.data
+            flat[f"{name}.offsets"] = array.offsets
+        else:
+            flat[name] = array
+    specs = {}
+    offset = 0
+    for name, array in flat.items():
+        array = np.ascontiguousarray(array)
+        flat[name] = array
+        specs[name] = {'dtype': array.dtype.newbyteorder('<').str, 'shape': list(array.shape), 'offset': offset}
+        offset += _aligned(array.nbytes)
+    header = json.dumps({
+        'kind': kind,
+        'version': version,
+        'meta': meta or {},
+        'arrays': specs
+    }).encode('utf-8')
+    data_start = _aligned(_PREAMBLE.size + len(header))
+    buffer = bytearray(data_start + offset)
+    buffer[:_PREAMBLE.size] = _PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header))
+    buffer[_PREAMBLE.size:_PREAMBLE.size + len(header)] = header
+    for name, array in flat.items():
+        start = data_start + specs[name]['offset']
+        buffer[start:start + array.nbytes] = array.astype(specs[name]['dtype'], copy=False).tobytes()
+    return bytes(buffer)
+
+
+class Artifact:
+    """
+    A loaded artifact. Arrays are read-only views over the file mapping or the source bytes.
+
+    Attributes:
+        kind (str): Artifact kind.
+        version (int): Payload version.
+        meta (dict): Metadata stored with the artifact.
+        nbytes (int): Size of the artifact.
+    """
+
+    def __init__(self, buffer, kind: str, max_version: int):
+        magic, format_version, header_len = _PREAMBLE.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an index artifact.")
+        if format_version > FORMAT_VERSION:
+            raise ValueError(f"Unsupported artifact format version {format_version}, expected <= {FORMAT_VERSION}.")
+        header = json.loads(bytes(buffer[_PREAMBLE.size:_PREAMBLE.size + header_len]).decode('utf-8'))
+        if header['kind'] != kind:
+            raise ValueError(f"Artifact kind {header['kind']} does not match {kind}.")
+        if header['version'] > max_version:
+            raise ValueError(f"Unsupported {kind} artifact version {header['version']}, expected <= {max_version}.")
+        self.kind = kind
+        self.version = header['version']
+        self.meta = header['meta']
+        self.nbytes = len(buffer)
+        self._buffer = buffer
+        self._data_start = _aligned(_PREAMBLE.size + header_len)
+        self._specs = header['arrays']
+
+    def __contains__(self, name):
+        return name in self._specs or f"{name}.data" in self._specs
+
+    def array(self, name: str) -> np.ndarray:
+        spec = self._specs[name]
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        return np.frombuffer(self._buffer, dtype=dtype, count=count,
+                             offset=self._data_start + spec['offset']).reshape(spec['shape'])
+
+    def strings(self, name: str) -> StringArray:
+        return StringArray(self.array(f"{name}.data"), self.array(f"{name}.offsets"))
+
+
+def load_artifact(source, kind: str, max_version: int) -> Artifact:
+    """
+    Loads an artifact from bytes or memory-maps it from a file.
+
+    Args:
+        source (bytes | str): Artifact bytes or the path of an artifact file.
+        kind (str): Expected artifact kind.
+        max_version (int): Highest payload version the caller can read.
+
+    Returns:
+        Artifact: The loaded artifact.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Artifact(source, kind, max_version)
+    with open(source, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return Artifact(buffer, kind, max_version)
+
+
+def fetch_artifact(db_conn, file_name: str, cache_dir: str=INDEX_CACHE_DIR):
+    """
+    Returns the path of a local copy of an artifact stored in the `files` table.
+
+    The local file name contains the MD5 digest of the stored data, so a copy is only
+    downloaded when the artifact changes and all processes on the host share one file.
+
+    Args:
+        db_conn (DBConnection): Connection to the application database.
+        file_name (str): Name of the artifact in the `files` table.
+        cache_dir (str): Local cache directory.
+
+    Returns:
+        str: Path of the local copy, None if the artifact does not exist.
+    """
+    digest = db_conn.get_file_digest(file_name)
+    if digest is None:
+        return None
+    path = os.path.join(cache_dir, f"{file_name}.{digest}")
+    if os.path.exists(path):
+        return path
+    file_data = db_conn.load_file(file_name)
+    if file_data is None:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".{file_name}.")
+    with os.fdopen(fd, 'wb') as file:
+        file.write(file_data)
+    os.replace(temp_path, path)
+    # Stale copies stay valid for processes which still map them.
+    for old_path in glob.glob(os.path.join(glob.escape(cache_dir), glob.escape(file_name) + '.*')):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return path
+
+
+def _aligned(size: int) -> int:
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
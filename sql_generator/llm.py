@@ -1,10 +1,125 @@
 from openai import OpenAI
-import os
+import os, re
 from index import Index
 from util import Util as util
+from response_cache import ResponseCache
+from time import monotonic
+from typing import Callable, Iterator, Optional
 
 from abc import ABC, abstractmethod
 
+SQL_PATTERN = re.compile(r"<SQL>([\s\S]*?)(?=<\/SQL>)")
+SQL_END_TAG = "</SQL>"
+# Characters per token used to estimate the usage of a cancelled stream without usage report
+CHARS_PER_TOKEN = 4
+
+
+def extract_sql(response: str):
+    """
+    Returns the SQL statement between the <SQL> tags of an answer, None if there is none.
+    """
+    match = SQL_PATTERN.search(response or '')
+    return match.group(1).strip() if match is not None else None
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class LLMStream:
+    """
+    Answer of a model streamed chunk by chunk, see `ILlmProvider.prompt_stream`.
+
+    Iterating yields the text chunks as they arrive. The SQL is extracted as soon as the closing
+    `</SQL>` tag arrives and passed to `on_sql`. With `stop_at_sql` the generation is then cancelled,
+    so the explanation after the SQL is neither waited for nor generated. The answer data is built by
+    the provider once the stream ends, `answer_data` is None until then, and passed to `on_finish`.
+
+    Attributes:
+        answer (str): The text received so far.
+        sql (Optional[str]): The SQL statement, None until its closing tag arrived.
+        stop_at_sql (bool): Cancel the generation once the SQL is complete.
+        on_sql (Optional[Callable]): Called with the SQL statement as soon as it is complete.
+        on_finish (Optional[Callable]): Called with the stream once its answer data is built.
+        cancelled (bool): True if a live generation was closed before its end. Answers received
+            in full, e.g. from the response cache, are never cancelled.
+        time_to_sql (Optional[float]): Seconds from the request to the complete SQL.
+        answer_data (Optional[dict]): The answer data, see `OpenAIProvider.prompt`.
+    """
+    answer: str
+    sql: Optional[str]
+    stop_at_sql: bool
+    on_sql: Optional[Callable]
+    on_finish: Optional[Callable]
+    cancelled: bool
+    time_to_sql: Optional[float]
+    answer_data: Optional[dict]
+
+    def __init__(self, chunks: Iterator[str], finish: Callable, close: Optional[Callable]=None,
+                 stop_at_sql=False, on_sql=None, on_finish=None):
+        """
+        Args:
+            chunks (Iterator[str]): The text chunks of the answer.
+            finish (Callable): Called with the stream when it ends, returns the answer data.
+            close (Optional[Callable]): Cancels the generation, None if the answer is already complete.
+            stop_at_sql (bool): Cancel the generation once the SQL is complete.
+            on_sql (Optional[Callable]): Called with the SQL statement as soon as it is complete.
+            on_finish (Optional[Callable]): Called with the stream once its answer data is built.
+        """
+        self.answer = ''
+        self.sql = None
+        self.stop_at_sql = stop_at_sql
+        self.on_sql = on_sql
+        self.on_finish = on_finish
+        self.cancelled = False
+        self.time_to_sql = None
+        self.answer_data = None
+        self.n_chunks = 0
+        self._chunks = chunks
+        self._finish = finish
+        self._close = close
+        self._start = monotonic()
+
+    def __iter__(self) -> Iterator[str]:
+        if self.answer_data is not None:
+            return
+        completed = False
+        try:
+            for chunk in self._chunks:
+                # The tag may be split across chunks, only the tail of the previous text is searched again
+                search_from = max(0, len(self.answer) - len(SQL_END_TAG))
+                self.answer += chunk
+                self.n_chunks += 1
+                yield chunk
+                if self.sql is None and SQL_END_TAG in self.answer[search_from:]:
+                    self._set_sql()
+                    if self.stop_at_sql:
+                        break
+            else:
+                completed = True
+        finally:
+            # Also cancelled if the reader stops iterating early
+            if not completed and self._close is not None:
+                self._close()
+                self.cancelled = True
+            self.answer_data = self._finish(self)
+            if self.on_finish is not None:
+                self.on_finish(self)
+
+    def _set_sql(self):
+        self.sql = extract_sql(self.answer)
+        self.time_to_sql = monotonic() - self._start
+        if self.on_sql is not None:
+            self.on_sql(self.sql)
+
+    def consume(self) -> dict:
+        """
+        Reads the rest of the stream and returns the answer data.
+        """
+        for _ in self:
+            pass
+        return self.answer_data
+
 
 class ILlmProvider(ABC):
     config: dict
@@ -17,6 +132,13 @@ class ILlmProvider(ABC):
     @abstractmethod
     def prompt(self, model_name: str, prompt: str):
         pass
+
+    def prompt_stream(self, model_name: str, prompt: str) -> LLMStream:
+        """
+        Streams the answer of a model. Providers without streaming answer in a single chunk.
+        """
+        answer_data = self.prompt(model_name, prompt)
+        return LLMStream(iter([answer_data['answer']]), finish=lambda stream: answer_data)
     
     def get_provider_name(self):
         return self.provider_name
@@ -43,10 +165,27 @@ class LLM:
     #prompt_gen: PromptGenerator
     llm: ILlmProvider
     llm_settings: dict = {}
+    response_cache: ResponseCache
+    stop_at_sql: bool
     
-    def __init__(self, config_path):
+    def __init__(self, config_path, db_conn=None, log_writer=None):
+        """
+        Args:
+            config_path (str): The providers and models, and the `response_cache` and `streaming` settings.
+            db_conn (DBConnection): Optional, persists cached answers in the app database.
+            log_writer (LogWriter): Optional, writes the cached answers to the app database in the background.
+        """
+        self.response_cache = None
+        self.stop_at_sql = False
         try:
             llm_config = util.load_yaml_config(config_path)
+            self.stop_at_sql = (llm_config.get('streaming') or {}).get('stop_at_sql', False)
+            cache_config = llm_config.get('response_cache') or {}
+            if cache_config.get('enabled', True):
+                self.response_cache = ResponseCache(
+                    db_conn=db_conn,
+                    log_writer=log_writer,
+                    **{name: cache_config[name] for name in ['max_entries', 'max_db_entries', 'ttl'] if name in cache_config})
             for provider in llm_config['providers']:
                 for model in provider['models']:
                     self.llm_settings[f"{provider['name']}: {model['name']}"] = {
@@ -62,10 +201,64 @@ class LLM:
     def get_model_list(self):
         return list(self.llm_settings.keys())
 
-    def prompt(self, model_id, prompt):
+    def prompt(self, model_id, prompt, use_cache=True):
+        """
+        Returns the answer data of a model for a prompt. Identical prompts to the same model are
+        answered from the response cache, with zero tokens and cost and `cached` set to True.
+        Only answers with SQL are cached. Without `use_cache`, the new answer replaces the cached one.
+        """
+        requested_model = self.llm_settings.get(model_id)
+        if requested_model is None:
+            raise ValueError(f"Model config for {model_id} not found")
+        if use_cache and self.response_cache is not None:
+            answer_data = self.response_cache.get(model_id, prompt)
+            if answer_data is not None:
+                return answer_data
+        self._load_provider(requested_model)
+        answer_data = self.llm.prompt(requested_model['model'], prompt)
+        if self.response_cache is not None and extract_sql(answer_data.get('answer') or '') is not None:
+            self.response_cache.put(model_id, prompt, answer_data)
+        return answer_data
+
+    def prompt_stream(self, model_id, prompt, on_sql=None, stop_at_sql=None, use_cache=True) -> LLMStream:
+        """
+        Streams the answer of a model for a prompt, see `LLMStream`. The answer data is cached like
+        with `prompt` once the stream ends, unless the generation was cancelled or has no SQL.
+
+        Args:
+            model_id (str): The model id, see `get_model_list`.
+            prompt (str): The rendered prompt.
+            on_sql (Optional[Callable]): Called with the SQL statement as soon as it is complete.
+            stop_at_sql (bool): Cancel the generation once the SQL is complete, defaults to the
+                `streaming.stop_at_sql` setting.
+            use_cache (bool): Answer identical prompts from the response cache, in a single chunk.
+
+        Returns:
+            LLMStream: The streamed answer.
+        """
         requested_model = self.llm_settings.get(model_id)
         if requested_model is None:
             raise ValueError(f"Model config for {model_id} not found")
+        if stop_at_sql is None:
+            stop_at_sql = self.stop_at_sql
+        if use_cache and self.response_cache is not None:
+            answer_data = self.response_cache.get(model_id, prompt)
+            if answer_data is not None:
+                return LLMStream(iter([answer_data['answer']]), finish=lambda stream: answer_data,
+                                 stop_at_sql=stop_at_sql, on_sql=on_sql)
+        self._load_provider(requested_model)
+        stream = self.llm.prompt_stream(requested_model['model'], prompt)
+        stream.stop_at_sql = stop_at_sql
+        stream.on_sql = on_sql
+        if self.response_cache is not None:
+            stream.on_finish = lambda stream: self._cache_streamed(model_id, prompt, stream)
+        return stream
+
+    def _cache_streamed(self, model_id, prompt, stream: LLMStream):
+        if not stream.cancelled and stream.sql is not None:
+            self.response_cache.put(model_id, prompt, stream.answer_data)
+
+    def _load_provider(self, requested_model):
         try:
             if self.llm is None:
                 self.llm = eval(requested_model['provider_class'])(
@@ -79,8 +272,9 @@ class LLM:
                 )
         except Exception as e:
             print(f"Error loading LLM provider: {e}")
-        
-        return self.llm.prompt(requested_model['model'], prompt)
+
+    def get_response_cache_stats(self) -> dict:
+        return self.response_cache.get_stats() if self.response_cache is not None else {}
   
     
 class OpenAIProvider(ILlmProvider):
@@ -116,6 +310,50 @@ class OpenAIProvider(ILlmProvider):
             "completion_tokens": response.usage.completion_tokens,
             "total_tokens": response.usage.total_tokens,   
         }
+        return self._get_answer_data(model_id, answer, token_stats)
+
+    def prompt_stream(self, model_id, prompt) -> LLMStream:
+        """
+        Streams the answer chunk by chunk. The usage is reported in the last chunk; if the generation is
+        cancelled before it, the completion tokens are the larger of the received chunks, about one token
+        each, and the estimate from the received text, and the prompt tokens are estimated from its length. `usage_estimated` is then set in the answer data.
+        """
+        model = model_id['name']
+        print(model + prompt)
+
+        response = self.llm.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        token_stats = {}
+
+        def chunks():
+            for chunk in response:
+                if chunk.usage is not None:
+                    token_stats.update(prompt_tokens=chunk.usage.prompt_tokens,
+                                       completion_tokens=chunk.usage.completion_tokens,
+                                       total_tokens=chunk.usage.total_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        def finish(stream: LLMStream):
+            usage_estimated = not token_stats
+            if usage_estimated:
+                prompt_tokens = estimate_tokens(prompt)
+                completion_tokens = max(stream.n_chunks, estimate_tokens(stream.answer))
+                token_stats.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                   total_tokens=prompt_tokens + completion_tokens)
+            answer_data = self._get_answer_data(model_id, stream.answer, token_stats)
+            answer_data["usage_estimated"] = usage_estimated
+            return answer_data
+
+        return LLMStream(chunks(), finish, close=response.close)
+
+    def _get_answer_data(self, model_id, answer, token_stats):
         relevance = {}
         rel_token_stats = {}
         llm_cost = self._get_cost(token_stats, 
@@ -123,7 +361,7 @@ class OpenAIProvider(ILlmProvider):
                                   model_id['output_token_cost_per_1000'])
         answer_data = {
             "answer": answer,
-            "model": model,
+            "model": model_id['name'],
             "relevance": relevance.get("Relevance", "UNKNOWN"),
             "relevance_explanation": relevance.get(
                 "Explanation", "Failed to parse evaluation"
@@ -0,0 +1,308 @@
+from datetime import datetime
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from db import DBConnection, tz
+import atexit, fcntl, glob, json, os, tempfile
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 1000))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 100))
+# Seconds a logged row may wait in the queue before its batch is written.
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))
+# Seconds a request waits for room in a full queue before its row is spilled.
+LOG_PUT_TIMEOUT = float(os.getenv("LOG_PUT_TIMEOUT", 0.05))
+# Spill file shared by the app processes, appends and replays are serialised with a file lock.
+LOG_SPILL_PATH = os.getenv("LOG_SPILL_PATH", os.path.join(tempfile.gettempdir(), "sql_generator_log_spill.jsonl"))
+
+CONVERSATIONS = "conversations"
+FEEDBACK = "feedback"
+LLM_RESPONSES = "llm_responses"
+# Errors of an unavailable or overloaded database, the rows are kept for a later retry.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+_STOP = object()
+
+
+class LogWriter:
+    """
+    Write-behind logging of conversations, feedback and cached LLM answers to the app database.
+
+    Requests only put rows on a bounded queue. A worker thread drains the queue in batches of up to
+    `batch_size` rows, or whatever arrived within `flush_interval` seconds, and writes every batch with
+    `DBConnection.save_logs` in one transaction. Timestamps are taken when a row is logged.
+
+    Rows which cannot be queued in `put_timeout` seconds, and batches which fail because the database is
+    unavailable, are appended to a JSON lines spill file and written before the next batch. Batches which
+    fail for another reason are retried row by row, and rows which still fail are dropped. Pending rows
+    are flushed at interpreter exit.
+
+    The spill file may be shared by several processes: appends hold an exclusive `fcntl` lock, and a
+    replay claims the whole file by renaming it to a per-process path under that lock. Claimed files
+    left by a process which died during a replay are moved back to the spill file on startup.
+
+    Attributes:
+        db_conn (DBConnection): Connection to the app database.
+        batch_size (int): Maximum number of rows per write.
+        flush_interval (float): Maximum time in seconds a row waits for its batch.
+        put_timeout (float): Time in seconds a request waits for room in the queue.
+        spill_path (str): Spill file, None to drop rows instead.
+    """
+    db_conn: DBConnection
+    batch_size: int
+    flush_interval: float
+    put_timeout: float
+    spill_path: str
+
+    def __init__(self, db_conn: DBConnection, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, put_timeout=LOG_PUT_TIMEOUT, spill_path=LOG_SPILL_PATH):
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        self.db_conn = db_conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spill_path = spill_path or None
+        self._queue = Queue(maxsize=max_queue)
+        self._spill_lock = Lock()
+        self._stats_lock = Lock()
+        self._stats = {"queued": 0, "written": 0, "spilled": 0, "dropped": 0, "failed_batches": 0, "last_error": None}
+        self._listeners = []
+        self._claim_path = f"{self.spill_path}.{os.getpid()}.claimed" if self.spill_path is not None else None
+        self._adopt_claims()
+        self._closed = Event()
+        self._worker = Thread(target=self._run, name="log-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def add_listener(self, listener):
+        """
+        Registers an object notified of every logged row, before it is queued: `on_conversation` is called
+        with the arguments of `save_conversation` and `on_feedback` with those of `save_feedback`.
+        """
+        self._listeners.append(listener)
+
+    def save_conversation(self, conversation_id, question, answer_data, timestamp=None):
+        """
+        Logs a conversation, see `DBConnection.save_conversation`.
+        """
+        for listener in self._listeners:
+            listener.on_conversation(conversation_id, question, answer_data)
+        self._put(CONVERSATIONS, DBConnection.conversation_row(conversation_id, question, answer_data, timestamp))
+
+    def save_feedback(self, conversation_id, feedback, timestamp=None):
+        """
+        Logs a feedback, see `DBConnection.save_feedback`.
+        """
+        for listener in self._listeners:
+            listener.on_feedback(conversation_id, feedback)
+        self._put(FEEDBACK, DBConnection.feedback_row(conversation_id, feedback, timestamp))
+
+    def save_llm_response(self, model_id, prompt_hash, answer_data, max_entries=None, timestamp=None):
+        """
+        Stores an LLM answer, see `DBConnection.save_llm_response`.
+        """
+        self._put(LLM_RESPONSES, DBConnection.llm_response_row(model_id, prompt_hash, answer_data, max_entries, timestamp))
+
+    def flush(self):
+        """
+        Blocks until all queued rows are written, spilled or dropped.
+        """
+        self._queue.join()
+
+    def close(self, timeout=10.0):
+        """
+        Writes the queued rows and stops the worker. Rows logged afterwards are written synchronously.
+
+        Args:
+            timeout (float): Maximum time in seconds to wait for the worker.
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+
+    def get_stats(self) -> dict:
+        """
+        Returns the number of queued, written, spilled and dropped rows, failed batches and the last error.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def _count(self, name, n=1, error=None):
+        with self._stats_lock:
+            self._stats[name] += n
+            if error is not None:
+                self._stats["last_error"] = str(error)
+
+    def _put(self, kind, row):
+        if self._closed.is_set():
+            self._write([(kind, row)])
+            return
+        try:
+            self._queue.put((kind, row), timeout=self.put_timeout)
+            self._count("queued")
+        except Full:
+            print(f"Log queue full, spilling {kind} row")
+            self._spill([(kind, row)])
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch = []
+            deadline = monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - monotonic()))
+                except Empty:
+                    break
+            try:
+                if batch or stop:
+                    self._write(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        spilled = self._claim_spill()
+        rows = spilled + batch
+        if not rows:
+            return
+        try:
+            self._save(rows)
+        except TRANSIENT_ERRORS as error:
+            print(f"Error writing log batch, spilling {len(batch)} rows: {error}")
+            self._count("failed_batches", error=error)
+            # Replayed rows go back first, so the order of the spill file is kept
+            self._spill(spilled, count=False)
+            self._spill(batch)
+        except Exception as error:
+            print(f"Error writing log batch, retrying {len(rows)} rows one by one: {error}")
+            self._count("failed_batches", error=error)
+            for row in rows:
+                try:
+                    self._save([row])
+                except TRANSIENT_ERRORS as row_error:
+                    self._count("failed_batches", error=row_error)
+                    self._spill([row])
+                except Exception as row_error:
+                    print(f"Error writing {row[0]} row, dropping it: {row_error}")
+                    self._count("dropped", error=row_error)
+        finally:
+            if spilled:
+                self._release_claim()
+
+    def _save(self, rows):
+        self.db_conn.save_logs([row for kind, row in rows if kind == CONVERSATIONS],
+                               [row for kind, row in rows if kind == FEEDBACK],
+                               [row for kind, row in rows if kind == LLM_RESPONSES])
+        self._count("written", len(rows))
+
+    def _open_spill(self):
+        # Returns the spill file opened for appending and locked. A writer which opened the file before a
+        # replay renamed it gets the lock after the rename and reopens the new file.
+        while True:
+            file = open(self.spill_path, "a", encoding="utf-8")
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.fstat(file.fileno()).st_ino == os.stat(self.spill_path).st_ino:
+                    return file
+            except FileNotFoundError:
+                pass
+            file.close()
+
+    def _spill(self, rows, count=True):
+        if not rows:
+            return
+        if self.spill_path is None:
+            self._count("dropped", len(rows))
+            return
+        try:
+            with self._spill_lock, self._open_spill() as file:
+                for kind, row in rows:
+                    row = dict(row, timestamp=row["timestamp"].isoformat())
+                    file.write(json.dumps({"kind": kind, "row": row}) + "\n")
+            if count:
+                self._count("spilled", len(rows))
+        except Exception as error:
+            print(f"Error spilling log rows, dropping {len(rows)} rows: {error}")
+            self._count("dropped", len(rows), error=error)
+
+    def _claim_spill(self) -> list:
+        # Renames the spill file to the claim path of this process and returns its rows
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return []
+        try:
+            with self._spill_lock, self._open_spill() as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    return []
+                os.replace(self.spill_path, self._claim_path)
+        except Exception as error:
+            print(f"Error claiming log spill file: {error}")
+            return []
+        rows = []
+        try:
+            with open(self._claim_path, encoding="utf-8") as file:
+                for line in file:
+                    # A partly written last line only loses that row.
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    row = entry["row"]
+                    row["timestamp"] = datetime.fromisoformat(row["timestamp"]).astimezone(tz)
+                    rows.append((entry["kind"], row))
+        except Exception as error:
+            print(f"Error reading log spill file: {error}")
+        if not rows:
+            self._release_claim()
+        return rows
+
+    def _release_claim(self):
+        try:
+            os.remove(self._claim_path)
+        except FileNotFoundError:
+            pass
+        except Exception as error:
+            print(f"Error removing claimed log spill file: {error}")
+
+    def _adopt_claims(self):
+        # Moves the rows of claimed files whose process is gone back to the spill file. A claimed file with
+        # the pid of this process was left by an earlier process, e.g. in a restarted container.
+        if self.spill_path is None:
+            return
+        for claim_path in glob.glob(f"{glob.escape(self.spill_path)}.*.claimed"):
+            try:
+                pid = int(claim_path[len(self.spill_path) + 1:-len(".claimed")])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _process_exists(pid):
+                continue
+            try:
+                with open(claim_path, encoding="utf-8") as claimed:
+                    lines = [line if line.endswith("\n") else line + "\n" for line in claimed]
+                with self._spill_lock, self._open_spill() as file:
+                    file.writelines(lines)
+                os.remove(claim_path)
+                print(f"Recovered {len(lines)} log rows from {claim_path}")
+            except Exception as error:
+                print(f"Error recovering log spill file {claim_path}: {error}")
+
+
+def _process_exists(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -2,8 +2,27 @@ import pandas as pd
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from scipy import sparse
 
 import numpy as np
+import pyarrow as pa
+import json, os, tempfile
+
+from index_artifact import StringArray, dump_artifact, load_artifact
+
+ARTIFACT_KIND = 'minsearch_index'
+ARTIFACT_VERSION = 1
+
+# Rows read at once when streaming Arrow documents.
+DEFAULT_BATCH_SIZE = 10000
+
+# Upper bound for the dense score block of search_many, in bytes.
+MAX_SCORE_BLOCK_BYTES = 128 * 1024 * 1024
+
+# Index layouts: one TF-IDF matrix per text field, or one L2-normalised float32 matrix for all fields.
+LAYOUT_FIELDS = "fields"
+LAYOUT_FUSED = "fused"
 
 
 class Index:
@@ -16,10 +35,19 @@ class Index:
         vectorizers (dict): Dictionary of TfidfVectorizer instances for each text field.
         keyword_df (pd.DataFrame): DataFrame containing keyword field data.
         text_matrices (dict): Dictionary of TF-IDF matrices for each text field.
-        docs (list): List of documents indexed.
+        docs (list | ArrowDocuments | DocumentStore): Documents indexed.
+        id_field (str): Optional document field holding the document id. Row positions are used otherwise.
+        doc_ids (list): Document id of every row.
+        deleted (np.ndarray): Tombstones of the rows removed since the last fit or compaction.
+        keyword_postings (dict): Sorted row ids by value, for each keyword field.
+        layout (str): LAYOUT_FIELDS or LAYOUT_FUSED.
+        fused_matrix (sparse.csr_matrix): With LAYOUT_FUSED, the L2-normalised float32 TF-IDF matrices
+            of all text fields stacked horizontally. `text_matrices` is not kept in this layout.
+        field_columns (dict): Column range of each text field in `fused_matrix`.
+        metadata (dict): JSON serialisable user data stored by `save()`, e.g. the fingerprint of the source data.
     """
 
-    def __init__(self, text_fields, keyword_fields, vectorizer_params={}):
+    def __init__(self, text_fields, keyword_fields, vectorizer_params={}, id_field=None, layout=LAYOUT_FIELDS):
         """
         Initializes the Index with specified text and keyword fields.
 
@@ -27,37 +55,396 @@ class Index:
             text_fields (list): List of text field names to index.
             keyword_fields (list): List of keyword field names to index.
             vectorizer_params (dict): Optional parameters to pass to TfidfVectorizer.
+            id_field (str): Optional document field holding the document id used by update and remove.
+            layout (str): LAYOUT_FIELDS to score every field with cosine similarity, or LAYOUT_FUSED to score all
+                fields with one sparse product, boosts being applied as query weights. Defaults to LAYOUT_FIELDS.
         """
+        if layout not in (LAYOUT_FIELDS, LAYOUT_FUSED):
+            raise ValueError(f"Unknown layout: {layout}")
         self.text_fields = text_fields
         self.keyword_fields = keyword_fields
+        self.id_field = id_field
+        self.layout = layout
+        self.vectorizer_params = vectorizer_params
+        self.metadata = {}
+        self._next_id = 0
+        self._reset()
 
-        self.vectorizers = {field: TfidfVectorizer(**vectorizer_params) for field in text_fields}
+    def _reset(self):
+        # Unfitted state, without documents
+        self.vectorizers = {field: TfidfVectorizer(**self.vectorizer_params) for field in self.text_fields}
         self.keyword_df = None
+        self.keyword_postings = {field: {} for field in self.keyword_fields}
         self.text_matrices = {}
         self.docs = []
+        self.doc_ids = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self._id_to_row = {}
+        # Leading documents passed to fit, the rows after them were added later
+        self._n_fitted_docs = 0
+        self.fused_matrix = None
+        self.field_columns = {}
+        self._pending_rows = {field: [] for field in self.text_fields}
+        self._pending_fused = []
+        self._normalized_matrices = {}
 
-    def fit(self, docs):
+    def fit(self, docs, batch_size=DEFAULT_BATCH_SIZE):
         """
         Fits the index with the provided documents.
 
+        An Arrow table or a Hugging Face `datasets.Dataset` is indexed in place: text columns are
+        vectorised in streamed batches and only the rows returned by a search are materialised.
+
         Args:
-            docs (list of dict): List of documents to index. Each document is a dictionary.
+            docs (list of dict | pa.Table | datasets.Dataset): Documents to index. Each document is a dictionary.
+            batch_size (int): Rows per batch when streaming Arrow documents.
         """
-        self.docs = docs
-        keyword_data = {field: [] for field in self.keyword_fields}
+        table = _to_arrow_table(docs)
+        if table is not None:
+            docs = ArrowDocuments(table, batch_size)
+        return self._fit(docs, self._new_ids(docs))
+
+    def _fit(self, docs, doc_ids):
+        self.docs = docs if isinstance(docs, ArrowDocuments) else list(docs)
+        docs = self.docs
 
         for field in self.text_fields:
-            texts = [doc.get(field, '') for doc in docs]
+            texts = _column(docs, field)
             self.text_matrices[field] = self.vectorizers[field].fit_transform(texts)
+            self._pending_rows[field] = []
+        self._normalized_matrices = {}
+        self._pending_fused = []
+        if self.layout == LAYOUT_FUSED:
+            self.field_columns = {}
+            start = 0
+            for field in self.text_fields:
+                stop = start + len(self.vectorizers[field].vocabulary_)
+                self.field_columns[field] = (start, stop)
+                start = stop
+            self.fused_matrix = self._fuse(self.text_matrices)
+            self.text_matrices = {}
 
-        for doc in docs:
-            for field in self.keyword_fields:
-                keyword_data[field].append(doc.get(field, ''))
-
+        keyword_data = {field: list(_column(docs, field)) for field in self.keyword_fields}
         self.keyword_df = pd.DataFrame(keyword_data)
+        self.keyword_postings = {field: {} for field in self.keyword_fields}
+        self._add_postings(keyword_data, 0)
+        self.doc_ids = list(doc_ids)
+        self._id_to_row = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+        self.deleted = np.zeros(len(docs), dtype=bool)
+        self._n_fitted_docs = len(docs)
 
         return self
 
+    def add(self, docs):
+        """
+        Adds documents without refitting the index.
+
+        The documents are vectorised with the fitted vocabularies and IDF weights, so terms
+        unknown to the index are ignored until the next `compact()`.
+
+        Args:
+            docs (list of dict): List of documents to add.
+
+        Returns:
+            list: The ids of the added documents.
+        """
+        doc_ids = self._new_ids(docs)
+        if len(set(doc_ids)) < len(doc_ids):
+            raise ValueError("Documents to add have duplicate ids.")
+        if not self.docs and not self.text_matrices and self.fused_matrix is None:
+            self._fit(list(docs), doc_ids)
+            return doc_ids
+        for doc_id in doc_ids:
+            if doc_id in self._id_to_row:
+                raise ValueError(f"Document id {doc_id} already exists.")
+        self._append(docs, doc_ids)
+        return doc_ids
+
+    def update(self, doc_id, doc):
+        """
+        Replaces a document. The old row is tombstoned and the new version appended.
+
+        Args:
+            doc_id: The id of the document to replace.
+            doc (dict): The new version of the document.
+        """
+        if self.id_field is not None and doc.get(self.id_field) != doc_id:
+            raise ValueError(f"Document {self.id_field} does not match id {doc_id}.")
+        self.remove(doc_id)
+        self._append([doc], [doc_id])
+
+    def remove(self, doc_id):
+        """
+        Removes a document by marking its row as deleted. The row is reclaimed by `compact()`.
+
+        Args:
+            doc_id: The id of the document to remove.
+        """
+        row = self._id_to_row.pop(doc_id, None)
+        if row is None:
+            raise KeyError(f"Unknown document id: {doc_id}")
+        self.deleted[row] = True
+
+    def compact(self):
+        """
+        Drops deleted rows and refits the vectorizers on the remaining documents,
+        refreshing vocabularies and IDF weights. Document ids are preserved. Without remaining
+        documents, the index is reset to its unfitted state and the next `add()` fits it.
+        """
+        live_rows = np.nonzero(~self.deleted)[0]
+        if len(live_rows) == 0:
+            self._reset()
+            return self
+        doc_ids = [self.doc_ids[row] for row in live_rows]
+        if isinstance(self.docs, ArrowDocuments):
+            return self._fit(ArrowDocuments(self.docs.to_table(live_rows), self.docs.batch_size), doc_ids)
+        return self._fit([self.docs[row] for row in live_rows], doc_ids)
+
+    def save(self, path, include_docs=True):
+        """
+        Saves the fitted index to a file, which `Index.load()` memory-maps without refitting.
+
+        The file holds the vocabularies and IDF weights of the vectorizers, the TF-IDF matrices
+        as raw CSR buffers, the keyword postings and the documents as JSON with an offset table.
+        `vectorizer_params`, `metadata`, document ids and keyword values must be JSON serialisable.
+
+        Args:
+            path (str): The file to write. It is replaced atomically.
+            include_docs (bool): Store the documents. Without them, `load()` needs the documents,
+                e.g. the Arrow dataset the index was fitted on. Documents added after fitting are
+                stored in either case. Defaults to True.
+        """
+        arrays = {}
+        for field in self.text_fields:
+            vectorizer = self.vectorizers[field]
+            terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+            arrays[f"vocabulary.{field}"] = StringArray.from_list(terms)
+            arrays[f"idf.{field}"] = vectorizer.idf_
+        if self.layout == LAYOUT_FUSED:
+            matrices = {'fused': self._get_fused_matrix()}
+        else:
+            matrices = {field: self._get_matrix(field) for field in self.text_fields}
+        for name, matrix in matrices.items():
+            arrays[f"matrix.{name}.data"] = matrix.data
+            arrays[f"matrix.{name}.indices"] = matrix.indices
+            arrays[f"matrix.{name}.indptr"] = matrix.indptr
+        for field, postings in self.keyword_postings.items():
+            values = list(postings)
+            arrays[f"postings.{field}.values"] = StringArray.from_list(json.dumps(value) for value in values)
+            arrays[f"postings.{field}.offsets"] = np.cumsum([0] + [len(postings[value]) for value in values], dtype=np.int64)
+            arrays[f"postings.{field}.rows"] = np.concatenate([postings[value] for value in values] + [np.zeros(0, dtype=np.int64)])
+        if include_docs:
+            arrays['docs'] = self.docs.strings if isinstance(self.docs, DocumentStore) and not self.docs.appended \
+                else StringArray.from_list(json.dumps(doc, default=_to_json) for doc in self.docs)
+            n_fitted_docs = len(self.docs)
+        else:
+            n_fitted_docs = self._n_fitted_docs
+            arrays['appended_docs'] = StringArray.from_list(
+                json.dumps(doc, default=_to_json) for doc in self._take(range(n_fitted_docs, len(self.docs))))
+        int_ids = all(isinstance(doc_id, (int, np.integer)) for doc_id in self.doc_ids)
+        arrays['doc_ids'] = np.array(self.doc_ids, dtype=np.int64) if int_ids \
+            else StringArray.from_list(json.dumps(doc_id, default=_to_json) for doc_id in self.doc_ids)
+        arrays['deleted'] = self.deleted
+        meta = {
+            'text_fields': self.text_fields,
+            'keyword_fields': self.keyword_fields,
+            'id_field': self.id_field,
+            'layout': self.layout,
+            'vectorizer_params': self.vectorizer_params,
+            'field_columns': self.field_columns,
+            'shapes': {name: matrix.shape for name, matrix in matrices.items()},
+            'int_ids': int_ids,
+            'next_id': self._next_id,
+            'n_docs': len(self.docs),
+            'n_fitted_docs': n_fitted_docs,
+            'metadata': self.metadata
+        }
+        data = dump_artifact(ARTIFACT_KIND, ARTIFACT_VERSION, arrays, meta)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".minsearch.")
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True, docs=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Loads an index saved by `save()`.
+
+        Args:
+            path (str): The index file.
+            mmap (bool): Memory-map the file, so processes loading the same file share one copy.
+                Otherwise the file is read into memory. Defaults to True.
+            docs (list of dict | pa.Table | datasets.Dataset): The documents the index was fitted on, in index order.
+                Required if the index was saved without documents, replaces the stored documents otherwise.
+                The documents added after fitting are restored from the file.
+            batch_size (int): Rows per batch when streaming Arrow documents.
+
+        Returns:
+            Index: The loaded index.
+
+        Raises:
+            ValueError: If the documents are missing or do not match the index.
+        """
+        if not mmap:
+            with open(path, 'rb') as file:
+                path = file.read()
+        artifact = load_artifact(path, ARTIFACT_KIND, ARTIFACT_VERSION)
+        meta = artifact.meta
+        index = cls(meta['text_fields'], meta['keyword_fields'], meta['vectorizer_params'], meta['id_field'], meta['layout'])
+        index.metadata = meta['metadata']
+        index.field_columns = {field: tuple(columns) for field, columns in meta['field_columns'].items()}
+        for field in index.text_fields:
+            vectorizer = index.vectorizers[field]
+            vectorizer.vocabulary_ = {term: i for i, term in enumerate(artifact.strings(f"vocabulary.{field}"))}
+            vectorizer.idf_ = artifact.array(f"idf.{field}")
+        for name, shape in meta['shapes'].items():
+            matrix = sparse.csr_matrix((artifact.array(f"matrix.{name}.data"), artifact.array(f"matrix.{name}.indices"),
+                                        artifact.array(f"matrix.{name}.indptr")), shape=tuple(shape), copy=False)
+            if name == 'fused':
+                index.fused_matrix = matrix
+            else:
+                index.text_matrices[name] = matrix
+        n_docs = meta['n_docs']
+        index._n_fitted_docs = meta.get('n_fitted_docs', n_docs)
+        if docs is not None:
+            table = _to_arrow_table(docs)
+            index.docs = ArrowDocuments(table, batch_size) if table is not None else list(docs)
+            if 'appended_docs' in artifact:
+                if len(index.docs) != index._n_fitted_docs:
+                    raise ValueError(f"Index {path} was fitted on {index._n_fitted_docs} documents, got {len(index.docs)}.")
+                index.docs.extend(json.loads(doc) for doc in artifact.strings('appended_docs'))
+        elif 'docs' in artifact:
+            index.docs = DocumentStore(artifact.strings('docs'))
+        else:
+            raise ValueError(f"Index {path} was saved without documents, pass the indexed documents.")
+        if len(index.docs) != n_docs:
+            raise ValueError(f"Index {path} has {n_docs} documents, got {len(index.docs)}.")
+        keyword_data = {}
+        for field in index.keyword_fields:
+            values = [json.loads(value) for value in artifact.strings(f"postings.{field}.values")]
+            offsets = artifact.array(f"postings.{field}.offsets")
+            rows = artifact.array(f"postings.{field}.rows")
+            column = np.empty(n_docs, dtype=object)
+            for i, value in enumerate(values):
+                index.keyword_postings[field][value] = rows[offsets[i]:offsets[i + 1]]
+                column[rows[offsets[i]:offsets[i + 1]]] = value
+            keyword_data[field] = column
+        index.keyword_df = pd.DataFrame(keyword_data)
+        if meta['int_ids']:
+            index.doc_ids = artifact.array('doc_ids').tolist()
+        else:
+            index.doc_ids = [json.loads(doc_id) for doc_id in artifact.strings('doc_ids')]
+        index.deleted = artifact.array('deleted').copy()
+        index._id_to_row = {doc_id: row for row, doc_id in enumerate(index.doc_ids) if not index.deleted[row]}
+        index._next_id = meta['next_id']
+        return index
+
+    def _new_ids(self, docs):
+        if self.id_field is not None:
+            if isinstance(docs, ArrowDocuments):
+                return list(docs.column(self.id_field))
+            return [doc[self.id_field] for doc in docs]
+        doc_ids = list(range(self._next_id, self._next_id + len(docs)))
+        self._next_id += len(docs)
+        return doc_ids
+
+    def _append(self, docs, doc_ids):
+        matrices = {}
+        for field in self.text_fields:
+            texts = [doc.get(field, '') for doc in docs]
+            matrices[field] = self.vectorizers[field].transform(texts)
+        if self.layout == LAYOUT_FUSED:
+            self._pending_fused.append(self._fuse(matrices))
+        else:
+            for field, matrix in matrices.items():
+                self._pending_rows[field].append(matrix)
+        keyword_data = {field: [doc.get(field, '') for doc in docs] for field in self.keyword_fields}
+        self.keyword_df = pd.concat([self.keyword_df, pd.DataFrame(keyword_data)], ignore_index=True)
+        first_row = len(self.docs)
+        self._add_postings(keyword_data, first_row)
+        self.docs.extend(docs)
+        for row, doc_id in enumerate(doc_ids, start=first_row):
+            self._id_to_row[doc_id] = row
+        self.doc_ids.extend(doc_ids)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(docs), dtype=bool)])
+
+    def _add_postings(self, keyword_data, first_row):
+        """
+        Adds the rows starting at `first_row` to the keyword postings.
+        """
+        for field, values in keyword_data.items():
+            rows_by_value = {}
+            for row, value in enumerate(values, start=first_row):
+                rows_by_value.setdefault(value, []).append(row)
+            postings = self.keyword_postings[field]
+            for value, rows in rows_by_value.items():
+                rows = np.array(rows, dtype=np.int64)
+                postings[value] = np.concatenate([postings[value], rows]) if value in postings else rows
+
+    def _take(self, rows):
+        """
+        Returns the documents of the given rows, in order.
+        """
+        if isinstance(self.docs, ArrowDocuments):
+            return self.docs.take(rows)
+        return [self.docs[row] for row in rows]
+
+    def _filter_rows(self, filter_dict):
+        """
+        Returns the sorted live rows matching all keyword filters, None if no keyword field is filtered.
+        """
+        rows = None
+        for field, value in filter_dict.items():
+            if field in self.keyword_fields:
+                postings = self.keyword_postings[field].get(value, np.zeros(0, dtype=np.int64))
+                rows = postings if rows is None else np.intersect1d(rows, postings, assume_unique=True)
+        if rows is not None:
+            rows = rows[~self.deleted[rows]]
+        return rows
+
+    def _fuse(self, matrices):
+        """
+        Stacks the L2-normalised rows of the field matrices into one float32 matrix.
+        """
+        blocks = [normalize(matrices[field]).astype(np.float32) for field in self.text_fields]
+        return sparse.hstack(blocks, format='csr', dtype=np.float32)
+
+    def _fuse_queries(self, queries, boost_dict):
+        """
+        Vectorises queries into the fused column space, each field weighted by its boost.
+        """
+        blocks = [normalize(self.vectorizers[field].transform(queries)) * boost_dict.get(field, 1)
+                  for field in self.text_fields]
+        return sparse.hstack(blocks, format='csr', dtype=np.float32)
+
+    def _get_fused_matrix(self):
+        """
+        Returns the fused matrix, stacking the rows added since the last call.
+        """
+        if self._pending_fused:
+            self.fused_matrix = sparse.vstack([self.fused_matrix] + self._pending_fused, format='csr')
+            self._pending_fused = []
+        return self.fused_matrix
+
+    def _get_matrix(self, field):
+        """
+        Returns the TF-IDF matrix of a field, stacking the rows added since the last call.
+        """
+        if self._pending_rows[field]:
+            self.text_matrices[field] = sparse.vstack([self.text_matrices[field]] + self._pending_rows[field], format='csr')
+            self._pending_rows[field] = []
+            self._normalized_matrices.pop(field, None)
+        return self.text_matrices[field]
+
+    def _get_normalized_matrix(self, field):
+        """
+        Returns the L2-normalised TF-IDF matrix of a field, transposed for query-block products.
+        """
+        matrix = self._get_matrix(field)
+        if field not in self._normalized_matrices:
+            self._normalized_matrices[field] = normalize(matrix).T.tocsr()
+        return self._normalized_matrices[field]
+
     def search(self, query, filter_dict={}, boost_dict={}, num_results=10):
         """
         Searches the index with the given query, filters, and boost parameters.
@@ -71,26 +458,245 @@ class Index:
         Returns:
             list of dict: List of documents matching the search criteria, ranked by relevance.
         """
-        query_vecs = {field: self.vectorizers[field].transform([query]) for field in self.text_fields}
-        scores = np.zeros(len(self.docs))
+        if not self.docs:
+            return []
+        # Apply keyword filters first, only the matching rows are scored
+        rows = self._filter_rows(filter_dict)
+        if rows is not None and len(rows) == 0:
+            return []
 
-        # Compute cosine similarity for each text field and apply boost
-        for field, query_vec in query_vecs.items():
-            sim = cosine_similarity(query_vec, self.text_matrices[field]).flatten()
-            boost = boost_dict.get(field, 1)
-            scores += sim * boost
+        if self.layout == LAYOUT_FUSED:
+            # One sparse mat-vec product, boosts are weights of the query vector
+            query_vec = self._fuse_queries([query], boost_dict).toarray().ravel()
+            matrix = self._get_fused_matrix()
+            scores = (matrix if rows is None else matrix[rows]) @ query_vec
+        else:
+            scores = np.zeros(len(self.docs) if rows is None else len(rows))
 
-        # Apply keyword filters
-        for field, value in filter_dict.items():
-            if field in self.keyword_fields:
-                mask = self.keyword_df[field] == value
-                scores = scores * mask.to_numpy()
+            # Compute cosine similarity for each text field and apply boost
+            for field in self.text_fields:
+                query_vec = self.vectorizers[field].transform([query])
+                matrix = self._get_matrix(field)
+                sim = cosine_similarity(query_vec, matrix if rows is None else matrix[rows]).flatten()
+                boost = boost_dict.get(field, 1)
+                scores += sim * boost
+
+        if rows is None:
+            scores[self.deleted] = 0
 
         # Use argpartition to get top num_results indices
+        num_results = min(num_results, len(scores))
+        if num_results < 1:
+            return []
         top_indices = np.argpartition(scores, -num_results)[-num_results:]
         top_indices = top_indices[np.argsort(-scores[top_indices])]
 
         # Filter out zero-score results
-        top_docs = [self.docs[i] for i in top_indices if scores[i] > 0]
+        top_indices = top_indices[scores[top_indices] > 0]
+        if rows is not None:
+            top_indices = rows[top_indices]
+        top_docs = self._take(top_indices)
+
+        return top_docs
+
+    def search_many(self, queries, filter_dicts=None, boost_dict={}, num_results=10, chunk_size=None):
+        """
+        Searches the index with a batch of queries.
+
+        Queries are vectorised into one sparse matrix per text field and scored against the
+        documents with one sparse-sparse product per field and chunk of queries. The top
+        results of all rows of a chunk are selected at once with `argpartition`.
+
+        Args:
+            queries (list of str): The search query strings.
+            filter_dicts (dict or list of dict): Keyword filters, either shared by all queries or one per query.
+            boost_dict (dict): Dictionary of boost scores for text fields. Keys are field names and values are the boost scores.
+            num_results (int): The number of top results to return per query. Defaults to 10.
+            chunk_size (int): Number of queries scored together. By default the chunk is sized so that the
+                dense score block stays below MAX_SCORE_BLOCK_BYTES.
+
+        Returns:
+            list of list of dict: The documents matching every query, ranked by relevance, in input order.
+        """
+        queries = list(queries)
+        if filter_dicts is None or isinstance(filter_dicts, dict):
+            filter_dicts = [filter_dicts or {}] * len(queries)
+        if len(filter_dicts) != len(queries):
+            raise ValueError("filter_dicts must be a dict or have one entry per query.")
+        n_docs = len(self.docs)
+        if n_docs == 0:
+            return [[] for _ in queries]
+        if chunk_size is None:
+            chunk_size = max(1, MAX_SCORE_BLOCK_BYTES // (8 * max(n_docs, 1)))
+        num_results = min(num_results, n_docs)
+
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start:start + chunk_size]
+            if self.layout == LAYOUT_FUSED:
+                scores = (self._get_fused_matrix() @ self._fuse_queries(chunk, boost_dict).T).T.toarray()
+            else:
+                scores = sparse.csr_matrix((len(chunk), n_docs))
+                for field in self.text_fields:
+                    query_block = normalize(self.vectorizers[field].transform(chunk))
+                    scores = scores + (query_block @ self._get_normalized_matrix(field)) * boost_dict.get(field, 1)
+                scores = scores.toarray()
+
+            # Apply keyword filters, identical filters are evaluated once per chunk
+            scores[:, self.deleted] = 0
+            masks = {}
+            for row, filter_dict in enumerate(filter_dicts[start:start + chunk_size]):
+                key = tuple(sorted((field, value) for field, value in filter_dict.items() if field in self.keyword_fields))
+                if not key:
+                    continue
+                if key not in masks:
+                    masks[key] = np.zeros(n_docs, dtype=bool)
+                    masks[key][self._filter_rows(dict(key))] = True
+                scores[row] *= masks[key]
+
+            if num_results < 1:
+                results.extend([] for _ in chunk)
+                continue
+            top_indices = np.argpartition(-scores, num_results - 1, axis=1)[:, :num_results]
+            top_scores = np.take_along_axis(scores, top_indices, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top_indices = np.take_along_axis(top_indices, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            # Filter out zero-score results
+            for row_indices, row_scores in zip(top_indices, top_scores):
+                results.append(self._take(row_indices[row_scores > 0]))
+
+        return results
+
+
+class DocumentStore:
+    """
+    Documents of a loaded index, stored as JSON strings and decoded on access.
+
+    Attributes:
+        strings (StringArray): The JSON documents, usually memory-mapped.
+        appended (list): Documents added after loading.
+    """
+
+    def __init__(self, strings):
+        self.strings = strings
+        self.appended = []
+
+    def __len__(self):
+        return len(self.strings) + len(self.appended)
+
+    def __getitem__(self, row):
+        if row < len(self.strings):
+            return json.loads(self.strings[int(row)])
+        return self.appended[row - len(self.strings)]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def extend(self, docs):
+        self.appended.extend(docs)
+
+
+class ArrowDocuments:
+    """
+    Documents backed by an Arrow table, e.g. a memory-mapped `datasets.Dataset`.
+
+    Rows are converted to dictionaries only when they are returned, so the resident
+    memory of the documents stays close to the size of the Arrow buffers.
+
+    Attributes:
+        table (pa.Table): The indexed rows.
+        batch_size (int): Rows per batch when streaming the table.
+        appended (list): Documents added after fitting.
+    """
+
+    def __init__(self, table, batch_size=DEFAULT_BATCH_SIZE):
+        self.table = table
+        self.batch_size = batch_size
+        self.appended = []
+
+    def __len__(self):
+        return self.table.num_rows + len(self.appended)
+
+    def __getitem__(self, row):
+        return self.take([row])[0]
+
+    def __iter__(self):
+        for batch in self.table.to_batches(max_chunksize=self.batch_size):
+            yield from batch.to_pylist()
+        yield from self.appended
+
+    def extend(self, docs):
+        self.appended.extend(docs)
+
+    def take(self, rows) -> list:
+        """
+        Materialises the given rows, in order.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        stored = rows < self.table.num_rows
+        docs = [None] * len(rows)
+        if stored.any():
+            for i, doc in zip(np.nonzero(stored)[0], self.table.take(rows[stored]).to_pylist()):
+                docs[i] = doc
+        for i in np.nonzero(~stored)[0]:
+            docs[i] = self.appended[rows[i] - self.table.num_rows]
+        return docs
+
+    def column(self, field, default=''):
+        """
+        Streams the values of a field, `default` for documents without it.
+        """
+        if field in self.table.column_names:
+            for chunk in self.table.column(field).chunks:
+                for start in range(0, len(chunk), self.batch_size):
+                    yield from chunk.slice(start, self.batch_size).to_pylist()
+        else:
+            yield from [default] * self.table.num_rows
+        for doc in self.appended:
+            yield doc.get(field, default)
+
+    def to_table(self, rows) -> pa.Table:
+        """
+        Returns the given rows as one table, appended documents included.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        stored = rows[rows < self.table.num_rows]
+        table = self.table.take(stored)
+        appended = [self.appended[row - self.table.num_rows] for row in rows[rows >= self.table.num_rows]]
+        if appended:
+            table = pa.concat_tables([table, pa.Table.from_pylist(appended, schema=self.table.schema)])
+        return table
+
+
+def _to_arrow_table(docs):
+    """
+    Returns the Arrow table of a pa.Table or datasets.Dataset, None for other documents.
+    """
+    if isinstance(docs, pa.Table):
+        return docs
+    try:
+        from datasets import Dataset
+    except ImportError:
+        return None
+    if isinstance(docs, Dataset):
+        # Selections and shuffles are applied through an indices mapping
+        if docs._indices is not None:
+            docs = docs.flatten_indices()
+        return docs.data.table
+    return None
+
+
+def _column(docs, field, default=''):
+    if isinstance(docs, ArrowDocuments):
+        return docs.column(field, default)
+    return (doc.get(field, default) for doc in docs)
+
 
-        return top_docs
\ No newline at end of file
+def _to_json(value):
+    # NumPy scalars and arrays, e.g. from DataFrame.to_dict()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
@@ -1,73 +1,300 @@
 from spacy.language import Language
 from inflect import engine as inflect_engine
 from gensim.models import KeyedVectors
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
 import gensim.downloader as gensim_api
 from util import Util as util
-import os
+from cache import LRUCache
+import atexit, os, pickle, tempfile
 import spacy
 
 
 PREPROCESSOR_CONFIG_PATH  = os.path.join(
     os.path.dirname(__file__), 'config', 'preprocessor.yaml')
 
+SPACY_MODEL = "en_core_web_sm"
+# extract_keywords only reads part-of-speech tags (tok2vec, tagger, attribute_ruler).
+SPACY_EXCLUDE = ["parser", "ner", "lemmatizer", "senter"]
+TOKEN_CACHE_MAX_ENTRIES = 50000
+DEFAULT_BATCH_SIZE = 256
+_MISSING = object()
+
 #@singleton
 class PreProcessor:
     spacy: Language
     inflect: inflect_engine
-    word_vectors: KeyedVectors
     models: list
-    
+    token_cache: LRUCache
+
     def __init__(self, config_path=PREPROCESSOR_CONFIG_PATH):
         pp_config = util.load_yaml_config(config_path)
         self.models = []
         for model in pp_config['gensim_models']:
             self.models.append(model['name'])
         self.models = ['glove-wiki-gigaword-50', 'glove-wiki-gigaword-100', 'glove-wiki-gigaword-200', 'glove-wiki-gigaword-300']
-        self.spacy = spacy.load("en_core_web_sm")
-        self.inflect = inflect_engine()
-        self.word_vectors = gensim_api.load(self.models[0])
+        # Components are loaded by load_async(), see is_ready() and get_status().
+        self.spacy = None
+        self.inflect = None
+        # Name and word vectors of the gensim model, replaced together, see get_model()
+        self._model = (self.models[0], None)
+        # Token analyses keyed by (token, model name, max_synonyms); singular forms use (token, None, None).
+        cache_config = pp_config.get('token_cache') or {}
+        self.token_cache = LRUCache(max_entries=cache_config.get('max_entries', TOKEN_CACHE_MAX_ENTRIES))
+        self.token_cache_path = cache_config.get('path') or None
+        self._token_cache_save_every = cache_config.get('save_every', 100)
+        self._token_cache_new_entries = 0
+        if self.token_cache_path is not None:
+            atexit.register(self.save_token_cache)
+        self._status = {"spacy": "pending", "inflect": "pending", "gensim": "pending", "token_cache": "pending"}
+        self._errors = {}
+        self._ready = Event()
+        self._loader = None
+        self._lock = Lock()
+
+    def load_async(self) -> Thread:
+        """
+        Starts loading the NLP components in a background thread, once.
+        spaCy, inflect, the gensim model and the persisted token cache are loaded in parallel.
+
+        Returns:
+            Thread: The loader thread.
+        """
+        with self._lock:
+            if self._loader is None:
+                self._loader = Thread(target=self._load, name="preprocessor-loader", daemon=True)
+                self._loader.start()
+            return self._loader
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set() and not self._errors
+
+    def get_status(self) -> dict:
+        """
+        Returns the loading state of every component: pending, loading, ready or failed.
+        Errors of failed components are reported under the `errors` key.
+        """
+        with self._lock:
+            status = dict(self._status)
+            status["errors"] = dict(self._errors)
+        return status
+
+    def wait_ready(self, timeout=None) -> bool:
+        """
+        Starts loading if needed and waits for all components.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds, None to wait until loaded.
+
+        Returns:
+            bool: True if the components are loaded, False on timeout.
+
+        Raises:
+            RuntimeError: If a component failed to load.
+        """
+        self.load_async()
+        if not self._ready.wait(timeout):
+            return False
+        if self._errors:
+            raise RuntimeError(f"Error loading PreProcessor components: {self._errors}")
+        return True
+
+    def _load(self):
+        loaders = {
+            "spacy": lambda: setattr(self, 'spacy', spacy.load(SPACY_MODEL, exclude=SPACY_EXCLUDE)),
+            "inflect": lambda: setattr(self, 'inflect', inflect_engine()),
+            "gensim": lambda: self._set_model(self.model_name, gensim_api.load(self.model_name)),
+            "token_cache": self.load_token_cache,
+        }
+        with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="preprocessor-loader") as executor:
+            for name, loader in loaders.items():
+                executor.submit(self._load_component, name, loader)
+        self._ready.set()
+
+    def _load_component(self, name, loader):
+        self._set_status(name, "loading")
+        try:
+            loader()
+            self._set_status(name, "ready")
+        except Exception as e:
+            print(f"Error loading {name}: {e}")
+            with self._lock:
+                self._errors[name] = str(e)
+            self._set_status(name, "failed")
+
+    def _set_status(self, name, status):
+        with self._lock:
+            self._status[name] = status
 
     def get_gensim_models(self)->list:
         return self.models
 
+    @property
+    def model_name(self) -> str:
+        return self._model[0]
+
+    @property
+    def word_vectors(self) -> KeyedVectors:
+        return self._model[1]
+
+    def get_model(self) -> tuple:
+        """
+        Returns the name and the word vectors of the current gensim model. Use it rather than
+        `model_name` and `word_vectors` when both are needed, they may change in between.
+
+        Returns:
+            tuple: The model name and its KeyedVectors, None until loaded.
+        """
+        return self._model
+
+    def _set_model(self, model_name: str, word_vectors: KeyedVectors):
+        with self._lock:
+            self._model = (model_name, word_vectors)
+
     def set_gensim_model(self, model_name: str):
         if model_name not in self.models:
             raise ValueError(f"Model {model_name} not found in available models: {self.models}")
-        self.word_vectors = gensim_api.load(model_name)
+        self.wait_ready()
+        self._set_model(model_name, gensim_api.load(model_name))
+        # Entries of other models stay valid.
+        self.token_cache.invalidate(lambda key: key[1] == model_name)
+
+    def load_token_cache(self) -> int:
+        """
+        Loads the token cache persisted at `token_cache_path`, if any.
+
+        Returns:
+            int: Number of loaded entries.
+        """
+        if self.token_cache_path is None or not os.path.exists(self.token_cache_path):
+            return 0
+        # A broken cache file only means a cold start.
+        try:
+            with open(self.token_cache_path, 'rb') as file:
+                items = pickle.load(file)
+        except Exception as e:
+            print(f"Error loading token cache: {e}")
+            return 0
+        for key, value in items:
+            self.token_cache.put(key, value)
+        return len(items)
+
+    def save_token_cache(self):
+        """
+        Writes the token cache to `token_cache_path`, if configured.
+        """
+        if self.token_cache_path is None:
+            return
+        try:
+            with self._lock:
+                self._token_cache_new_entries = 0
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.token_cache_path)))
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(self.token_cache.items(), file)
+            os.replace(temp_path, self.token_cache_path)
+        except Exception as e:
+            print(f"Error saving token cache: {e}")
+
+    def get_token_cache_stats(self) -> dict:
+        return self.token_cache.get_stats()
+
+    def _cache_put(self, key, value):
+        self.token_cache.put(key, value)
+        if self.token_cache_path is not None:
+            with self._lock:
+                self._token_cache_new_entries += 1
+                save = self._token_cache_new_entries >= self._token_cache_save_every
+            if save:
+                self.save_token_cache()
+
+    def singular_noun(self, word: str):
+        """
+        Returns the singular form of a plural noun, False otherwise. Results are cached.
+        """
+        key = (word, None, None)
+        singular = self.token_cache.get(key, _MISSING)
+        if singular is _MISSING:
+            self.wait_ready()
+            singular = self.inflect.singular_noun(word)
+            self._cache_put(key, singular)
+        return singular
 
     def extract_keywords(self, query: str):
-        doc = self.spacy(query)
+        self.wait_ready()
+        return self._doc_to_keywords(self.spacy(query))
+
+    def _doc_to_keywords(self, doc):
         keywords = [token.text for token in doc if token.pos_ in ["NOUN", "PROPN", "NUM"]]
         keywords_final = keywords.copy()
         for keyword in keywords:
-            if self.inflect.singular_noun(keyword):  # Returns singular form if plural
-                word = self.inflect.singular_noun(keyword)
+            word = self.singular_noun(keyword)
+            if word:  # Returns singular form if plural
                 keywords_final.append(word)
-            else:
-                word = keyword
         #print(keywords_final)
         return keywords_final
-    
+
     def generate_synonyms(self, word: str, max_synonyms=5):
         if max_synonyms < 1:
             return []
+        model_name, word_vectors = self.get_model()
+        key = (word, model_name, max_synonyms)
+        synonyms = self.token_cache.get(key)
+        if synonyms is not None:
+            return list(synonyms)
+        self.wait_ready()
+        if word_vectors is None:
+            model_name, word_vectors = self.get_model()
+            key = (word, model_name, max_synonyms)
         #print(f"Generating synonyms for: {word}")
-        if self.word_vectors.has_index_for(word):
-            #token_vector = model.wv[token]            
-            synonym_tuples = self.word_vectors.most_similar(positive=[word], negative=[], topn=max_synonyms)
+        if word_vectors.has_index_for(word):
+            #token_vector = model.wv[token]
+            synonym_tuples = word_vectors.most_similar(positive=[word], negative=[], topn=max_synonyms)
             synonyms = [synonym[0] for synonym in synonym_tuples]
-            return synonyms
-        else: 
+        else:
             # Get embedding for the target word
-            return []
+            synonyms = []
+        self._cache_put(key, synonyms)
+        return list(synonyms)
 
     def query_to_keywords(self, query: str, max_synonyms=5):
-        keywords = pre_processor.extract_keywords(query)
+        keywords = self.extract_keywords(query)
         keywords_final = keywords.copy()
         for word in keywords:
-            synonyms = pre_processor.generate_synonyms(word, max_synonyms)
+            synonyms = self.generate_synonyms(word, max_synonyms)
             keywords_final.extend(synonyms)
         keywords_final = list(set(keywords_final))
         return keywords_final
 
+
+    def query_to_keywords_many(self, queries: list, max_synonyms=5, batch_size=DEFAULT_BATCH_SIZE, n_process=1) -> list:
+        """
+        Batch version of query_to_keywords for bulk keyword extraction.
+        Queries are tagged with `nlp.pipe` and synonyms are looked up once per distinct keyword of the batch.
+
+        Args:
+            queries (list): The queries to process.
+            max_synonyms (int): Maximum number of synonyms per keyword.
+            batch_size (int): Number of queries spaCy processes per batch.
+            n_process (int): Number of spaCy worker processes, -1 for all cores.
+
+        Returns:
+            list: The keywords of every query, in input order.
+        """
+        self.wait_ready()
+        keywords_list = [self._doc_to_keywords(doc)
+                         for doc in self.spacy.pipe(queries, batch_size=batch_size, n_process=n_process)]
+        synonyms = {}
+        for keywords in keywords_list:
+            for word in keywords:
+                if word not in synonyms:
+                    synonyms[word] = self.generate_synonyms(word, max_synonyms)
+        results = []
+        for keywords in keywords_list:
+            keywords_final = keywords.copy()
+            for word in keywords:
+                keywords_final.extend(synonyms[word])
+            results.append(list(set(keywords_final)))
+        return results
+
+# Components are loaded on first use or by pre_processor.load_async() at app startup.
 pre_processor = PreProcessor(PREPROCESSOR_CONFIG_PATH)
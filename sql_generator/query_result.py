@@ -0,0 +1,130 @@
+from typing import Optional
+import pandas as pd
+import pyarrow as pa
+import math
+
+TRUNCATED_ROWS = "rows"
+TRUNCATED_BYTES = "bytes"
+# Compression of serialised results, see QueryResult.to_buffer.
+IPC_COMPRESSION = "zstd" if pa.Codec.is_available("zstd") else None
+
+
+def rows_to_batch(rows: list, column_names: list) -> pa.RecordBatch:
+    """
+    Converts fetched rows into an Arrow record batch, column by column.
+    Columns whose values Arrow cannot convert, e.g. UUIDs or ranges, are stored as strings.
+
+    Args:
+        rows (list): Rows as returned by `fetchmany`.
+        column_names (list): Names of the columns.
+
+    Returns:
+        pa.RecordBatch: The batch.
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(column_names)
+    arrays = []
+    for values in columns:
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            arrays.append(pa.array([None if value is None else str(value) for value in values], type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, names=[str(name) for name in column_names])
+
+
+class QueryResult:
+    """
+    Result of a query fetched in chunks into Arrow record batches, see `DBConnection.execute_sql_stream`.
+    Pages are converted to DataFrames only when they are rendered.
+
+    Attributes:
+        table (pa.Table): The fetched rows.
+        truncated (Optional[str]): TRUNCATED_ROWS or TRUNCATED_BYTES if the result was cut at a cap, None otherwise.
+        error (Optional[str]): The database error, the table then has a single `error` column.
+        cache_age (Optional[float]): Seconds since the result was cached, None if it was just fetched.
+    """
+    table: pa.Table
+    truncated: Optional[str]
+    error: Optional[str]
+    cache_age: Optional[float]
+
+    def __init__(self, table: pa.Table, truncated: Optional[str]=None, error: Optional[str]=None,
+                 cache_age: Optional[float]=None):
+        self.table = table
+        self.truncated = truncated
+        self.error = error
+        self.cache_age = cache_age
+
+    @classmethod
+    def from_batches(cls, batches: list, column_names: list, truncated: Optional[str]=None) -> 'QueryResult':
+        """
+        Combines fetched batches. Types inferred differently per batch, e.g. all-null chunks, are unified.
+        """
+        if not batches:
+            return cls(pa.Table.from_batches([rows_to_batch([], column_names)]), truncated)
+        tables = [pa.Table.from_batches([batch]) for batch in batches]
+        try:
+            table = pa.concat_tables(tables, promote_options="permissive")
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Conflicting types across chunks, fall back to strings for every column
+            tables = [table.cast(pa.schema([(name, pa.string()) for name in table.column_names]), safe=False)
+                      for table in tables]
+            table = pa.concat_tables(tables)
+        return cls(table, truncated)
+
+    @classmethod
+    def from_error(cls, error) -> 'QueryResult':
+        """
+        Returns a result holding a database error, in the single `error` column used by `execute_sql`.
+        """
+        return cls(pa.table({'error': [str(error)]}), error=str(error))
+
+    def to_buffer(self) -> pa.Buffer:
+        """
+        Serialises the rows into a compressed Arrow IPC stream. The truncation flag is kept in the schema metadata.
+        """
+        table = self.table.replace_schema_metadata({'truncated': self.truncated or ''})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=IPC_COMPRESSION)) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+
+    @classmethod
+    def from_buffer(cls, buffer: pa.Buffer, cache_age: Optional[float]=None) -> 'QueryResult':
+        """
+        Reads a result written by `to_buffer`.
+        """
+        table = pa.ipc.open_stream(buffer).read_all()
+        truncated = (table.schema.metadata or {}).get(b'truncated', b'').decode() or None
+        return cls(table.replace_schema_metadata(None), truncated, cache_age=cache_age)
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    @property
+    def column_names(self) -> list:
+        return self.table.column_names
+
+    def num_pages(self, page_size: int) -> int:
+        return max(1, math.ceil(self.num_rows / page_size))
+
+    def page(self, page_number: int, page_size: int) -> pd.DataFrame:
+        """
+        Returns one page of rows as a DataFrame.
+
+        Args:
+            page_number (int): Page number, starting at 0.
+            page_size (int): Number of rows per page.
+
+        Returns:
+            pd.DataFrame: The rows of the page, empty past the last page.
+        """
+        return self.table.slice(page_number * page_size, page_size).to_pandas()
+
+    def to_pandas(self) -> pd.DataFrame:
+        return self.table.to_pandas()
+
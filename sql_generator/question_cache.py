@@ -0,0 +1,273 @@
+from cache import LRUCache
+from llm import extract_sql
+from util import Util as util
+from bm25_index import split_words
+from vector_index import embed_texts
+from threading import Lock
+from typing import Optional
+import numpy as np
+import os, re
+
+QUESTION_CACHE_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config', 'question_cache.yaml')
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+# Conversations waiting for their feedback
+MAX_PENDING_CONVERSATIONS = 10000
+# Conversations with positive feedback loaded at startup
+LOAD_LIMIT = 10000
+
+# Function words ignored in the question embeddings. Unlike sklearn's ENGLISH_STOP_WORDS, it keeps
+# negations, comparisons and quantities, see MEANING_WORDS.
+QUESTION_STOP_WORDS = frozenset([
+    'a', 'an', 'the', 'of', 'in', 'on', 'at', 'to', 'for', 'by', 'with', 'from', 'into', 'as', 'and',
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'am', 'do', 'does', 'did', 'has', 'have', 'had',
+    'i', 'me', 'my', 'we', 'us', 'our', 'you', 'your', 'it', 'its', 'they', 'them', 'their',
+    'this', 'that', 'these', 'those', 'there', 'here', 'please', 'can', 'could', 'would', 'will', 'should'
+])
+# Words which change the meaning of a question but hardly its embedding, e.g. "released before 2006" and
+# "released after 2006", or "rented" and "never rented". They are literals, see `question_literals`.
+MEANING_WORDS = frozenset([
+    'not', 'no', 'never', 'none', 'nobody', 'noone', 'nothing', 'nowhere', 'nor', 'neither', 'either', 'or',
+    'cannot', 'cant', 'couldnt', 'hasnt', 'without', 'except', 'besides', 'only', 'but',
+    'before', 'after', 'since', 'until', 'during', 'between', 'within', 'beyond', 'earlier', 'later',
+    'above', 'below', 'over', 'under', 'more', 'less', 'fewer', 'most', 'least', 'than', 'greater',
+    'higher', 'lower', 'larger', 'smaller', 'longer', 'shorter', 'older', 'newer', 'top', 'bottom',
+    'first', 'last', 'next', 'previous', 'third', 'once', 'again', 'ever', 'every', 'each', 'all', 'any',
+    'some', 'few', 'many', 'several', 'same', 'other', 'others', 'another', 'else', 'both', 'per',
+    'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve',
+    'fifteen', 'twenty', 'forty', 'fifty', 'sixty', 'hundred', 'thousand'
+])
+
+_QUOTED_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"")
+_NEGATION_PATTERN = re.compile(r"n['’]t\b", re.IGNORECASE)
+
+
+def normalize_question(question: str) -> str:
+    """
+    Expands negative contractions, e.g. "didn't" to "did not", so that the negation is a word.
+    """
+    return _NEGATION_PATTERN.sub(' not', question)
+
+
+def question_literals(question: str, word_vectors) -> frozenset:
+    """
+    Returns the values of a question which its embedding does not capture: numbers, quoted strings,
+    MEANING_WORDS and words without word vector, except stop words. Questions only share SQL if their
+    literals are equal, so that "top 5 movies" does not reuse the SQL of "top 10 movies" and "films released
+    after 2006" not the SQL of "films released before 2006".
+    """
+    question = normalize_question(question)
+    literals = set(_QUOTED_PATTERN.findall(question))
+    for word in split_words(_QUOTED_PATTERN.sub(' ', question)):
+        if word.isdigit() or word in MEANING_WORDS or \
+                (word not in word_vectors.key_to_index and word not in QUESTION_STOP_WORDS):
+            literals.add(word)
+    return frozenset(literals)
+
+
+class _QuestionSet:
+    """
+    Questions of one database with positive feedback, their SQL and their embeddings.
+    """
+
+    def __init__(self):
+        self.conversation_ids = []
+        self.questions = []
+        self.sql = []
+        self.vectors = None
+        self.literals = []
+
+
+class QuestionCache:
+    """
+    Semantic cache reusing the SQL of past questions with positive feedback for near-duplicate questions.
+
+    Questions are embedded as the normalised mean of their word vectors (see `vector_index.embed_texts`)
+    with the word vectors of the PreProcessor. A question is answered with the SQL of the most similar
+    question of the same database if their cosine similarity reaches `similarity_threshold` and both
+    questions have the same literals, see `question_literals`.
+
+    The cache is filled at startup from the conversations with positive feedback and then incrementally:
+    it listens to `LogWriter.save_conversation` for the SQL of new conversations and adds them on positive
+    feedback from `LogWriter.save_feedback`. A negative feedback removes a question, and for an answer
+    reused from the cache also the question whose SQL was reused.
+
+    Attributes:
+        pre_processor (PreProcessor): Provides the word vectors, lookups miss until they are loaded.
+        similarity_threshold (float): Minimum cosine similarity to reuse the SQL of a question.
+        load_limit (int): Maximum number of conversations loaded at startup.
+        hits (int): Number of questions answered from the cache.
+        misses (int): Number of lookups without similar question.
+    """
+    similarity_threshold: float
+    load_limit: int
+    hits: int
+    misses: int
+
+    def __init__(self, pre_processor, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+                 max_pending=MAX_PENDING_CONVERSATIONS, load_limit=LOAD_LIMIT):
+        self.pre_processor = pre_processor
+        self.load_limit = load_limit
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._pending = LRUCache(max_entries=max_pending)
+        # Question whose SQL was reused, by conversation answered from the cache
+        self._sources = LRUCache(max_entries=max_pending)
+        self._databases = {}
+        self._model_name = None
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls, pre_processor, config_path=QUESTION_CACHE_CONFIG_PATH) -> Optional['QuestionCache']:
+        """
+        Creates the cache from its YAML config, None if it is disabled.
+        """
+        config = util.load_yaml_config(config_path) or {}
+        if not config.get('enabled', True):
+            return None
+        return cls(pre_processor,
+                   similarity_threshold=config.get('similarity_threshold', DEFAULT_SIMILARITY_THRESHOLD),
+                   max_pending=config.get('max_pending', MAX_PENDING_CONVERSATIONS),
+                   load_limit=config.get('load_limit', LOAD_LIMIT))
+
+    def load(self, db_conn) -> int:
+        """
+        Adds the `load_limit` most recent conversations with positive feedback from the app database.
+
+        Args:
+            db_conn (DBConnection): Connection to the app database.
+
+        Returns:
+            int: Number of added questions.
+        """
+        added = 0
+        for conversation in db_conn.get_positive_conversations(self.load_limit):
+            sql = extract_sql(conversation['answer'])
+            if sql is not None:
+                self.add(conversation['id'], conversation['database_name'], conversation['question'], sql)
+                added += 1
+        return added
+
+    def add(self, conversation_id: str, db_name: str, question: str, sql: str):
+        """
+        Adds a question and its SQL. The embedding is computed on the next lookup of the database.
+        """
+        with self._lock:
+            question_set = self._databases.setdefault(db_name, _QuestionSet())
+            if conversation_id in question_set.conversation_ids:
+                return
+            question_set.conversation_ids.append(conversation_id)
+            question_set.questions.append(question)
+            question_set.sql.append(sql)
+
+    def remove(self, conversation_id: str) -> bool:
+        """
+        Removes the question of a conversation, True if it was cached.
+        """
+        with self._lock:
+            for question_set in self._databases.values():
+                if conversation_id in question_set.conversation_ids:
+                    i = question_set.conversation_ids.index(conversation_id)
+                    for values in [question_set.conversation_ids, question_set.questions, question_set.sql]:
+                        del values[i]
+                    if question_set.vectors is not None and i < len(question_set.vectors):
+                        question_set.vectors = np.delete(question_set.vectors, i, axis=0)
+                        del question_set.literals[i]
+                    return True
+        return False
+
+    def lookup(self, db_name: str, question: str) -> Optional[dict]:
+        """
+        Returns the SQL of the most similar cached question of a database.
+
+        Args:
+            db_name (str): The database.
+            question (str): The new question.
+
+        Returns:
+            Optional[dict]: `sql`, `question`, `conversation_id` and `similarity` of the match,
+                None if no question reaches the similarity threshold or the word vectors are not loaded.
+        """
+        model_name, word_vectors = self.pre_processor.get_model() if self.pre_processor.is_ready() else (None, None)
+        match = None
+        with self._lock:
+            question_set = self._databases.get(db_name)
+            if word_vectors is not None and question_set is not None and question_set.questions:
+                vectors = self._get_vectors(question_set, model_name, word_vectors)
+                similarities = vectors @ embed_texts(word_vectors, [normalize_question(question)],
+                                                     QUESTION_STOP_WORDS)[0]
+                literals = question_literals(question, word_vectors)
+                candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+                candidates = [i for i in candidates[np.argsort(-similarities[candidates])]
+                              if question_set.literals[i] == literals]
+                if candidates:
+                    best = candidates[0]
+                    match = {
+                        'sql': question_set.sql[best],
+                        'question': question_set.questions[best],
+                        'conversation_id': question_set.conversation_ids[best],
+                        'similarity': float(similarities[best])
+                    }
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return match
+
+    def _get_vectors(self, question_set: _QuestionSet, model_name: str, word_vectors) -> np.ndarray:
+        # Embeddings of another model are dropped, new questions are embedded and appended
+        if self._model_name != model_name:
+            for other in self._databases.values():
+                other.vectors = None
+                other.literals = []
+            self._model_name = model_name
+        n_embedded = 0 if question_set.vectors is None else len(question_set.vectors)
+        if n_embedded < len(question_set.questions):
+            new_questions = question_set.questions[n_embedded:]
+            new_vectors = embed_texts(word_vectors, [normalize_question(question) for question in new_questions],
+                                      QUESTION_STOP_WORDS)
+            question_set.literals.extend(question_literals(question, word_vectors) for question in new_questions)
+            question_set.vectors = new_vectors if question_set.vectors is None \
+                else np.vstack([question_set.vectors, new_vectors])
+        return question_set.vectors
+
+    def on_conversation(self, conversation_id, question, answer_data):
+        """
+        Keeps the SQL of a new conversation until its feedback, see `LogWriter.add_listener`. For an
+        answer reused from the cache, `cached_conversation_id` of the answer data is the reused question.
+        """
+        source_id = answer_data.get('cached_conversation_id')
+        if source_id is not None:
+            self._sources.put(conversation_id, source_id)
+        sql = extract_sql(answer_data.get('answer', ''))
+        if sql is not None:
+            self._pending.put(conversation_id, (answer_data['database_name'], question, sql))
+
+    def on_feedback(self, conversation_id, feedback):
+        """
+        Adds the question of a conversation on positive feedback and removes it on negative feedback,
+        with the question whose SQL it reused.
+        """
+        if feedback > 0:
+            pending = self._pending.get(conversation_id)
+            if pending is not None:
+                self.add(conversation_id, *pending)
+        else:
+            self.remove(conversation_id)
+            source_id = self._sources.get(conversation_id)
+            if source_id is not None:
+                self.remove(source_id)
+
+    def get_stats(self) -> dict:
+        """
+        Returns the hits, misses, hit rate and the number of cached questions by database.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "questions": {db_name: len(question_set.questions) for db_name, question_set in self._databases.items()},
+                "pending": len(self._pending)
+            }
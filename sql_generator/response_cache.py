@@ -0,0 +1,92 @@
+from cache import LRUCache
+from typing import Optional
+import hashlib
+
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_MAX_DB_ENTRIES = 100000
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+# Answer fields which are zero on a cache hit, no tokens were used.
+USAGE_FIELDS = ["prompt_tokens", "completion_tokens", "total_tokens",
+                "eval_prompt_tokens", "eval_completion_tokens", "eval_total_tokens", "llm_cost"]
+
+
+def hash_prompt(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of LLM answers keyed by (model id, SHA-256 of the rendered prompt).
+
+    Answers are kept in an in-memory LRU and, if a database connection is given, in the
+    llm_responses table of the app database, so they survive restarts and are shared between
+    app instances. Both expire `ttl` seconds after the answer was generated, an answer loaded from
+    the table keeps its age in memory. Only answers with SQL are cached, see `LLM.prompt`. With a LogWriter, answers are stored in the
+    background and the table is trimmed there, outside the answer latency.
+
+    Attributes:
+        memory (LRUCache): The in-memory entries.
+        db_conn (DBConnection): Connection to the app database, None for memory only.
+        log_writer (LogWriter): Optional, stores the answers in the background.
+        ttl (float): Seconds after which an answer expires, None for no expiry.
+        max_db_entries (int): Maximum number of answers kept in the app database.
+        db_hits (int): Number of hits served from the app database.
+    """
+    memory: LRUCache
+    ttl: Optional[float]
+    max_db_entries: Optional[int]
+    db_hits: int
+
+    def __init__(self, db_conn=None, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_db_entries=RESPONSE_CACHE_MAX_DB_ENTRIES,
+                 ttl=RESPONSE_CACHE_TTL, log_writer=None):
+        self.db_conn = db_conn
+        self.log_writer = log_writer
+        self.ttl = ttl
+        self.max_db_entries = max_db_entries
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.db_hits = 0
+
+    def get(self, model_id: str, prompt: str) -> Optional[dict]:
+        """
+        Returns the cached answer of a prompt, with zero tokens and cost and `cached` set to True.
+
+        Args:
+            model_id (str): The model id, see `LLM.get_model_list`.
+            prompt (str): The rendered prompt.
+
+        Returns:
+            Optional[dict]: The answer data, None on a miss.
+        """
+        key = (model_id, hash_prompt(prompt))
+        answer_data = self.memory.get(key)
+        if answer_data is None and self.db_conn is not None:
+            row = self.db_conn.load_llm_response(*key, max_age=self.ttl)
+            if row is not None:
+                answer_data, age = row
+                self.db_hits += 1
+                self.memory.put(key, answer_data, age=age)
+        if answer_data is None:
+            return None
+        answer_data = dict(answer_data, cached=True)
+        for field in USAGE_FIELDS:
+            answer_data[field] = 0
+        return answer_data
+
+    def put(self, model_id: str, prompt: str, answer_data: dict):
+        """
+        Caches the answer of a prompt in memory and in the app database.
+        """
+        key = (model_id, hash_prompt(prompt))
+        self.memory.put(key, answer_data)
+        if self.log_writer is not None:
+            self.log_writer.save_llm_response(*key, answer_data, max_entries=self.max_db_entries)
+        elif self.db_conn is not None:
+            self.db_conn.save_llm_response(*key, answer_data, max_entries=self.max_db_entries)
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters of the in-memory cache and the number of hits served from the app database.
+        """
+        stats = self.memory.get_stats()
+        stats["db_hits"] = self.db_hits
+        return stats
@@ -1,14 +1,27 @@
-from fuzzywuzzy import fuzz
 from util import Util as util
 from abc import ABC, abstractmethod
 import pandas as pd
 from db import DBMetadata, DBConnection
+from fuzzy_index import FuzzyCatalog, ARTIFACT_KIND as FUZZY_ARTIFACT_KIND, ARTIFACT_VERSION as FUZZY_ARTIFACT_VERSION
+from bm25_index import BM25Catalog, ARTIFACT_KIND as BM25_ARTIFACT_KIND, ARTIFACT_VERSION as BM25_ARTIFACT_VERSION, \
+    DEFAULT_BOOSTS, DEFAULT_K1, DEFAULT_B
+from vector_index import VectorCatalog, ARTIFACT_KIND as VECTOR_ARTIFACT_KIND, ARTIFACT_VERSION as VECTOR_ARTIFACT_VERSION, \
+    DEFAULT_COLUMN_WEIGHT, embed_query
+from index_artifact import fetch_artifact, load_artifact
+from cache import LRUCache
 import pickle
 from enum import Enum
 
+MAX_CACHED_INDEXES = 8
+DEFAULT_VECTOR_MODEL = 'glove-wiki-gigaword-50'
+# Reciprocal rank fusion constant, see VectorSearch.
+RRF_K = 60
+
 class SearchTypes(Enum):
     ELASTICSEARCH = 1
     FUZZY_SEARCH = 2
+    BM25 = 3
+    VECTOR = 4
 
 
 class ISearch(ABC):
@@ -41,60 +54,252 @@ class Elasticsearch(ISearch):
 
 
 
-class FuzzySearch(ISearch):
+class IndexedSearch(ISearch):
+    """
+    Base of the search providers backed by one index artifact per database, which are
+    loaded on demand and kept in an LRU cache.
+    """
+    catalogs: LRUCache
+
+    def __init__(self, config_path: str='', **kwargs):
+        super().__init__(config_path, **kwargs)
+        # Loaded catalogs by database, bounded by count and by mapped size.
+        self.catalogs = LRUCache(
+            max_entries=kwargs.get('max_cached_indexes', MAX_CACHED_INDEXES),
+            max_bytes=kwargs.get('max_cached_index_bytes', None),
+            sizeof=lambda catalog: catalog.nbytes
+        )
+
+    def get_catalog(self, db_name: str):
+        """
+        Returns the catalog of a database from the cache, loading it on a miss.
+
+        Args:
+            db_name (str): The database name.
+
+        Returns:
+            The catalog.
+        """
+        catalog = self.catalogs.get(db_name)
+        if catalog is None:
+            if self.db_conn is None:
+                raise ValueError("db_conn not provided.")
+            print(f"Loading metadata for {db_name}")
+            catalog = self._load_catalog(db_name)
+            self.catalogs.put(db_name, catalog)
+        return catalog
+
+    def prefetch(self, db_names: list) -> list:
+        """
+        Loads the catalogs of the given databases into the cache, e.g. to warm it at startup.
+
+        Args:
+            db_names (list): The databases to load, most important first.
+
+        Returns:
+            list: The databases which were loaded.
+        """
+        loaded = []
+        for db_name in db_names:
+            try:
+                self.get_catalog(db_name)
+                loaded.append(db_name)
+            except Exception as e:
+                print(f"Error prefetching metadata for {db_name}: {e}")
+        return loaded
+
+    def get_cache_stats(self) -> dict:
+        return self.catalogs.get_stats()
+
+    def _get_config(self) -> dict:
+        return getattr(self, 'config', None) or {}
+
+    @abstractmethod
+    def _load_catalog(self, db_name: str):
+        pass
+
+
+class FuzzySearch(IndexedSearch):
+    # Database of the last search, used by search_by_keywords without db_name
     db_name: str = ''
-    df_table_columns: pd.DataFrame = None
     pre_processor = None
 
     def create_index(self, db_name: str, data: DBMetadata):
-        self.df_table_columns = data.df_table_columns
+        catalog = FuzzyCatalog.from_dataframe(data.df_table_columns)
+        catalog.build_ngram_index()
         if self.db_conn is None:
             raise ValueError("db_conn not provided.")
-        self.db_conn.save_file(f"{db_name}_table_columns.pkl", pickle.dumps(self.df_table_columns))
+        self.db_conn.save_file(f"{db_name}_fuzzy_index.idx", catalog.to_bytes())
+        self.catalogs.pop(db_name)
 
     def search_by_query(self, db_name, query: str, **kwards):
         if self.pre_processor is None:
             #import preprocessor
             from preprocessor import pre_processor
             self.pre_processor = pre_processor
-        if self.df_table_columns is None or db_name != self.db_name:
-            if self.db_conn is None:
-                raise ValueError("db_conn not provided.")
-            print(f"Loading metadata for {db_name}")
-            self.df_table_columns = pickle.loads(self.db_conn.load_file(f"{db_name}_table_columns.pkl"))
-            self.db_name = db_name
+        self.db_name = db_name
             
         similarity_threshold = kwards.get('similarity_threshold', 90)
         max_synonyms = kwards.get('max_synonyms', 5)
+        guaranteed_recall = kwards.get('guaranteed_recall', True)
         
         keywords = self.pre_processor.query_to_keywords(query, max_synonyms)
-        tables = self.search_by_keywords(keywords, similarity_threshold)
-        tables = tables[['table_schema', 'table_name', 'column_name']]
+        tables = self.search_by_keywords(keywords, similarity_threshold, guaranteed_recall, db_name)
         tables['table_name'] = tables['table_name'].where(tables['table_schema']  == '', other = tables['table_schema']  + '.' + tables['table_name'])
         tables = tables.drop(columns=['table_schema'])
         return tables
         
-    def search_by_keywords(self, keywords: list, similarity_threshold=90):
-        df_search = self.df_table_columns[
-            self.df_table_columns.apply(
-                self._match_table,
-                axis=1,
-                keywords=keywords,
-                similarity_threshold=similarity_threshold
-                )
-            ]
-        return df_search
-        
-    def _match_table(self, table_data: pd.Series, keywords: list, similarity_threshold: int):
-        for keyword in keywords:
-            if any(fuzz.partial_ratio(keyword, column) > similarity_threshold for column in table_data['column_name']):
-                return True    
-            elif fuzz.partial_ratio(keyword, table_data['table_name']) > similarity_threshold:
-                return True
-        return False
-    
+    def search_by_keywords(self, keywords: list, similarity_threshold=90, guaranteed_recall=True, db_name=None):
+        # The catalog is only referenced by the LRU, so an evicted catalog is freed
+        catalog = self.get_catalog(db_name if db_name is not None else self.db_name)
+        return catalog.get_tables(catalog.match_tables(keywords, similarity_threshold, guaranteed_recall))
+
+    def _load_catalog(self, db_name: str) -> FuzzyCatalog:
+        artifact_path = fetch_artifact(self.db_conn, f"{db_name}_fuzzy_index.idx")
+        if artifact_path is not None:
+            return FuzzyCatalog.from_artifact(load_artifact(artifact_path, FUZZY_ARTIFACT_KIND, FUZZY_ARTIFACT_VERSION))
+        # Indexes created by older pipelines only have the pickled table/columns DataFrame.
+        file_data = self.db_conn.load_file(f"{db_name}_table_columns.pkl")
+        if file_data is None:
+            raise ValueError(f"No search index found for {db_name}.")
+        return FuzzyCatalog.from_dataframe(pickle.loads(file_data))
+
+
+class BM25Search(IndexedSearch):
+    """
+    Lexical table retrieval with an in-process BM25 index over table, column, data type
+    and schema names. See `bm25_index.BM25Catalog`.
+    """
+
+    def create_index(self, db_name: str, data: DBMetadata):
+        config = self._get_config()
+        catalog = BM25Catalog.from_dataframe(data.df_table_columns,
+                                             k1=config.get('k1', DEFAULT_K1),
+                                             b=config.get('b', DEFAULT_B))
+        if self.db_conn is None:
+            raise ValueError("db_conn not provided.")
+        self.db_conn.save_file(f"{db_name}_bm25_index.idx", catalog.to_bytes())
+        self.catalogs.pop(db_name)
+
+    def search_by_query(self, db_name, query: str, **kwards):
+        top_k = kwards.get('top_k', self._get_config().get('top_k', 10))
+        boosts = kwards.get('boosts', self._get_boosts())
+
+        catalog = self.get_catalog(db_name)
+        table_ids, scores = catalog.search(query, top_k, boosts)
+        tables = catalog.get_tables(table_ids)
+        tables['table_name'] = tables['table_name'].where(tables['table_schema']  == '', other = tables['table_schema']  + '.' + tables['table_name'])
+        tables = tables.drop(columns=['table_schema'])
+        return tables
+
+    def _get_boosts(self) -> dict:
+        return self._get_config().get('boosts', DEFAULT_BOOSTS)
+
+    def _load_catalog(self, db_name: str) -> BM25Catalog:
+        artifact_path = fetch_artifact(self.db_conn, f"{db_name}_bm25_index.idx")
+        if artifact_path is None:
+            raise ValueError(f"No search index found for {db_name}.")
+        return BM25Catalog.from_artifact(load_artifact(artifact_path, BM25_ARTIFACT_KIND, BM25_ARTIFACT_VERSION))
     
     
+
+class VectorSearch(IndexedSearch):
+    """
+    Dense table retrieval: table and column names are embedded with averaged GloVe vectors
+    at index time, a question is embedded once and ranked against the catalog with one
+    matrix-vector product. See `vector_index.VectorCatalog`.
+
+    With `fusion: bm25` the ranking is fused with the BM25 ranking by reciprocal rank fusion.
+    """
+    pre_processor = None
+    word_vectors: dict
+    lexical_search: BM25Search = None
+
+    def __init__(self, config_path: str='', **kwargs):
+        super().__init__(config_path, **kwargs)
+        self.word_vectors = {}
+
+    def create_index(self, db_name: str, data: DBMetadata):
+        model_name = self._get_config().get('model', DEFAULT_VECTOR_MODEL)
+        catalog = VectorCatalog.from_dataframe(data.df_table_columns, self.get_word_vectors(model_name), model_name)
+        if self.db_conn is None:
+            raise ValueError("db_conn not provided.")
+        self.db_conn.save_file(f"{db_name}_vector_index.idx", catalog.to_bytes())
+        self.catalogs.pop(db_name)
+
+    def search_by_query(self, db_name, query: str, **kwards):
+        config = self._get_config()
+        top_k = kwards.get('top_k', config.get('top_k', 10))
+        min_similarity = kwards.get('min_similarity', config.get('min_similarity', 0.0))
+        column_weight = kwards.get('column_weight', config.get('column_weight', DEFAULT_COLUMN_WEIGHT))
+        fusion = kwards.get('fusion', config.get('fusion', 'none'))
+        fusion_candidates = max(top_k, config.get('fusion_candidates', 50))
+
+        catalog = self.get_catalog(db_name)
+        query_vector = embed_query(self.get_word_vectors(catalog.model_name, use_pre_processor=True), query)
+        if fusion == 'bm25':
+            table_ids, scores = catalog.search(query_vector, fusion_candidates, min_similarity, column_weight)
+            tables = self._fuse(catalog.get_tables(table_ids), db_name, query, top_k, fusion_candidates)
+        elif fusion == 'none':
+            table_ids, scores = catalog.search(query_vector, top_k, min_similarity, column_weight)
+            tables = catalog.get_tables(table_ids)
+        else:
+            raise ValueError(f"Unknown fusion: {fusion}")
+        tables['table_name'] = tables['table_name'].where(tables['table_schema']  == '', other = tables['table_schema']  + '.' + tables['table_name'])
+        tables = tables.drop(columns=['table_schema'])
+        return tables
+
+    def get_word_vectors(self, model_name: str, use_pre_processor=False):
+        """
+        Returns the word vectors of a model. The PreProcessor vectors are shared when it
+        has the same model loaded, other models are downloaded once.
+
+        Args:
+            model_name (str): The gensim model name.
+            use_pre_processor (bool): Share the vectors of the PreProcessor, which loads spaCy too.
+
+        Returns:
+            KeyedVectors: The word vectors.
+        """
+        if use_pre_processor:
+            if self.pre_processor is None:
+                from preprocessor import pre_processor
+                self.pre_processor = pre_processor
+            if self.pre_processor.model_name == model_name:
+                self.pre_processor.wait_ready()
+                pre_processor_model, word_vectors = self.pre_processor.get_model()
+                if pre_processor_model == model_name:
+                    return word_vectors
+        if model_name not in self.word_vectors:
+            import gensim.downloader as gensim_api
+            self.word_vectors[model_name] = gensim_api.load(model_name)
+        return self.word_vectors[model_name]
+
+    def _fuse(self, vector_tables: pd.DataFrame, db_name: str, query: str, top_k: int, candidates: int) -> pd.DataFrame:
+        """
+        Merges the vector and BM25 rankings by reciprocal rank fusion: a table scores
+        the sum of 1 / (RRF_K + rank) over the rankings it appears in.
+        """
+        if self.lexical_search is None:
+            self.lexical_search = BM25Search(self._get_config().get('bm25_config_path', 'config/bm25.yaml'), db_conn=self.db_conn)
+        bm25_catalog = self.lexical_search.get_catalog(db_name)
+        table_ids, _ = bm25_catalog.search(query, candidates, self.lexical_search._get_boosts())
+        tables = pd.concat([vector_tables, bm25_catalog.get_tables(table_ids)], keys=['vector', 'bm25'])
+        tables['rank'] = tables.groupby(level=0).cumcount() + 1
+        tables['score'] = 1 / (RRF_K + tables['rank'])
+        scores = tables.groupby(['table_schema', 'table_name'], sort=False)['score'].sum()
+        tables = tables.drop_duplicates(['table_schema', 'table_name']).set_index(['table_schema', 'table_name'])
+        tables['score'] = scores
+        tables = tables.sort_values('score', ascending=False, kind='stable').head(top_k)
+        return tables.reset_index()[['table_schema', 'table_name', 'column_name']]
+
+    def _load_catalog(self, db_name: str) -> VectorCatalog:
+        artifact_path = fetch_artifact(self.db_conn, f"{db_name}_vector_index.idx")
+        if artifact_path is None:
+            raise ValueError(f"No search index found for {db_name}.")
+        return VectorCatalog.from_artifact(load_artifact(artifact_path, VECTOR_ARTIFACT_KIND, VECTOR_ARTIFACT_VERSION))
+
+
 class SearchFactory:
     @staticmethod
     def get_search_provider(search_type: SearchTypes, **kwargs)-> ISearch:
@@ -105,6 +310,18 @@ class SearchFactory:
             db_conn = kwargs.get('db_conn', None)
             if db_conn is None:
                 raise ValueError("db_conn not provided.")
-            return FuzzySearch(config_path='', db_conn=db_conn)
+            return FuzzySearch(config_path='', **kwargs)
+        elif search_type == SearchTypes.BM25:
+            db_conn = kwargs.get('db_conn', None)
+            if db_conn is None:
+                raise ValueError("db_conn not provided.")
+            config_path = kwargs.pop('config_path', 'config/bm25.yaml')
+            return BM25Search(config_path, **kwargs)
+        elif search_type == SearchTypes.VECTOR:
+            db_conn = kwargs.get('db_conn', None)
+            if db_conn is None:
+                raise ValueError("db_conn not provided.")
+            config_path = kwargs.pop('config_path', 'config/vector.yaml')
+            return VectorSearch(config_path, **kwargs)
         else:
             raise ValueError(f"Unknown Search type: {search_type}.")
\ No newline at end of file
@@ -0,0 +1,100 @@
+from db import DBConnection, SQL_STATEMENT_TIMEOUT_MS
+from query_result import QueryResult
+from util import Util as util
+from typing import Optional
+import os
+
+SQL_GUARD_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config', 'sql_guard.yaml')
+
+VERDICT_OK = "ok"
+VERDICT_CONFIRM = "confirm"
+VERDICT_REJECT = "reject"
+VERDICT_ERROR = "error"
+ACTIONS = [VERDICT_CONFIRM, VERDICT_REJECT]
+DEFAULT_LIMITS = {'max_cost': None, 'max_rows': None, 'action': VERDICT_CONFIRM,
+                  'statement_timeout_ms': SQL_STATEMENT_TIMEOUT_MS}
+
+
+class SQLGuard:
+    """
+    Checks the planner estimates of generated SQL before it runs on a user database.
+
+    Every statement is explained with `DBConnection.explain_sql`. Statements whose estimated cost or
+    row count exceed the limits of their database are rejected or held until the user confirms,
+    depending on the configured action. Statements which run get the statement timeout of their
+    database and a read-only transaction, see `DBConnection.execute_sql_stream`.
+
+    Attributes:
+        db_conn (DBConnection): The connection, statements run on its current database.
+        config (dict): `default` limits and their overrides by database under `databases`.
+    """
+    db_conn: DBConnection
+    config: dict
+
+    def __init__(self, db_conn: DBConnection, config_path=SQL_GUARD_CONFIG_PATH):
+        self.db_conn = db_conn
+        self.config = util.load_yaml_config(config_path) or {}
+        for limits in [self.config.get('default') or {}] + list((self.config.get('databases') or {}).values()):
+            action = (limits or {}).get('action')
+            if action is not None and action not in ACTIONS:
+                raise ValueError(f"Invalid action: {action}. Supported actions are: {ACTIONS}")
+
+    def get_limits(self, db_name: str) -> dict:
+        """
+        Returns the limits of a database: `max_cost`, `max_rows`, `action` and `statement_timeout_ms`.
+        """
+        limits = dict(DEFAULT_LIMITS)
+        limits.update(self.config.get('default') or {})
+        limits.update((self.config.get('databases') or {}).get(db_name) or {})
+        return limits
+
+    def check(self, query: str) -> dict:
+        """
+        Explains a statement on the current database and compares the estimates with its limits.
+
+        Args:
+            query (str): The SQL statement.
+
+        Returns:
+            dict: The plan summary of `DBConnection.explain_sql` with the database name, the limits,
+                the `verdict` (ok, confirm, reject or error) and the `reasons` for it.
+        """
+        db_name = self.db_conn.get_curr_database()
+        limits = self.get_limits(db_name)
+        plan = {'database_name': db_name, 'max_cost': limits['max_cost'], 'max_rows': limits['max_rows'],
+                'statement_timeout_ms': limits['statement_timeout_ms'], 'reasons': []}
+        try:
+            plan.update(self.db_conn.explain_sql(query, limits['statement_timeout_ms']))
+        except Exception as e:
+            plan.update(verdict=VERDICT_ERROR, reasons=[str(e)])
+            print("SQL plan:", plan)
+            return plan
+        if limits['max_cost'] is not None and plan['total_cost'] > limits['max_cost']:
+            plan['reasons'].append(f"Estimated cost {plan['total_cost']:,.0f} exceeds {limits['max_cost']:,}")
+        if limits['max_rows'] is not None and plan['plan_rows'] > limits['max_rows']:
+            plan['reasons'].append(f"Estimated rows {plan['plan_rows']:,} exceed {limits['max_rows']:,}")
+        plan['verdict'] = limits['action'] if plan['reasons'] else VERDICT_OK
+        print("SQL plan:", plan)
+        return plan
+
+    def execute(self, query: str, confirmed: bool=False, use_cache: bool=True) -> tuple[Optional[QueryResult], dict]:
+        """
+        Checks a statement and runs it if its estimates are within the limits, or if it needs a
+        confirmation which was given.
+
+        Args:
+            query (str): The SQL statement.
+            confirmed (bool): True if the user confirmed the statement after a `confirm` verdict.
+            use_cache (bool): False to bypass the result cache.
+
+        Returns:
+            tuple: The result, None if the statement did not run, and the plan summary of `check`.
+        """
+        plan = self.check(query)
+        if plan['verdict'] == VERDICT_REJECT or (plan['verdict'] == VERDICT_CONFIRM and not confirmed):
+            return None, plan
+        if plan['verdict'] == VERDICT_ERROR:
+            return QueryResult.from_error(plan['reasons'][0]), plan
+        result = self.db_conn.execute_sql_cached(query, use_cache=use_cache,
+                                                 statement_timeout_ms=plan['statement_timeout_ms'])
+        return result, plan
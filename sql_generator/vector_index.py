@@ -0,0 +1,201 @@
+from bm25_index import split_words
+from index_artifact import Artifact, StringArray, dump_artifact
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+import numpy as np
+import pandas as pd
+
+ARTIFACT_KIND = 'vector_catalog'
+ARTIFACT_VERSION = 1
+# Column matches count slightly less than a match of the table name.
+DEFAULT_COLUMN_WEIGHT = 0.9
+
+
+def embed_texts(word_vectors, texts, stop_words=frozenset()) -> np.ndarray:
+    """
+    Embeds texts as the L2-normalised mean of the normalised vectors of their words.
+
+    Args:
+        word_vectors (KeyedVectors): The word vectors, e.g. a GloVe model.
+        texts (list): Identifiers or questions, split with `split_words`.
+        stop_words (set): Words to ignore.
+
+    Returns:
+        np.ndarray: One float32 row per text, zero for texts without any known word.
+    """
+    offsets = [0]
+    word_ids = []
+    for text in texts:
+        for word in split_words(text):
+            word_id = word_vectors.key_to_index.get(word) if word not in stop_words else None
+            if word_id is not None:
+                word_ids.append(word_id)
+        offsets.append(len(word_ids))
+    offsets = np.asarray(offsets, dtype=np.int64)
+    normed = word_vectors.get_normed_vectors()
+    vectors = np.zeros((len(texts), normed.shape[1]), dtype=np.float32)
+    counts = np.diff(offsets)
+    if word_ids:
+        sums = np.add.reduceat(normed[np.asarray(word_ids)], offsets[:-1][counts > 0], axis=0)
+        vectors[counts > 0] = sums
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+
+def embed_query(word_vectors, query: str) -> np.ndarray:
+    """
+    Embeds a question, ignoring English stop words.
+    """
+    return embed_texts(word_vectors, [query], ENGLISH_STOP_WORDS)[0]
+
+
+class VectorCatalog:
+    """
+    Dense embeddings of the table and column names of a database catalog, used by VectorSearch.
+
+    Every table has one row for its name followed by one row per column in `vectors`, so
+    a question is scored against the whole catalog with one matrix-vector product and
+    reduced to one score per table with `np.maximum.reduceat`.
+
+    The catalog is stored as a versioned artifact (see `index_artifact`), so a loaded
+    catalog is a set of read-only views over a memory-mapped file.
+
+    Attributes:
+        model_name (str): The word vectors used for the embeddings, queries must use the same.
+        vectors (np.ndarray): L2-normalised float32 embeddings, one row per table and column name.
+        row_offsets (np.ndarray): Offsets into `vectors`, one row per table. The first row of a table is its name.
+        table_schema (StringArray): Schema name per table.
+        table_name (StringArray): Table name per table.
+        column_names (StringArray): Column names, aligned with the column rows of `vectors`.
+    """
+
+    def __init__(self, model_name, vectors, row_offsets, table_schema, table_name, column_names):
+        self.model_name = model_name
+        self.vectors = vectors
+        self.row_offsets = row_offsets
+        self.table_schema = table_schema
+        self.table_name = table_name
+        self.column_names = column_names
+        self._column_rows = None
+
+    @classmethod
+    def from_dataframe(cls, df_table_columns: pd.DataFrame, word_vectors, model_name: str) -> 'VectorCatalog':
+        """
+        Embeds the catalog from `DBMetadata.df_table_columns`.
+
+        Args:
+            df_table_columns (pd.DataFrame): One row per table with the list of its columns in `column_name`.
+            word_vectors (KeyedVectors): The word vectors.
+            model_name (str): Name of the word vectors, stored with the catalog.
+
+        Returns:
+            VectorCatalog: The catalog.
+        """
+        names = []
+        row_offsets = [0]
+        column_names = []
+        for table_name, columns in zip(df_table_columns['table_name'], df_table_columns['column_name']):
+            names.append(table_name)
+            names.extend(columns)
+            column_names.extend(columns)
+            row_offsets.append(len(names))
+        return cls(
+            model_name=model_name,
+            vectors=embed_texts(word_vectors, names),
+            row_offsets=np.asarray(row_offsets, dtype=np.int64),
+            table_schema=StringArray.from_list(df_table_columns['table_schema']),
+            table_name=StringArray.from_list(df_table_columns['table_name']),
+            column_names=StringArray.from_list(column_names)
+        )
+
+    @classmethod
+    def from_artifact(cls, artifact: Artifact) -> 'VectorCatalog':
+        """
+        Creates the catalog over the arrays of a loaded artifact without copying them.
+
+        Args:
+            artifact (Artifact): Artifact of kind ARTIFACT_KIND.
+
+        Returns:
+            VectorCatalog: The catalog.
+        """
+        return cls(
+            model_name=artifact.meta['model_name'],
+            vectors=artifact.array('vectors'),
+            row_offsets=artifact.array('row_offsets'),
+            table_schema=artifact.strings('table_schema'),
+            table_name=artifact.strings('table_name'),
+            column_names=artifact.strings('column_names')
+        )
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialises the catalog into an artifact.
+
+        Returns:
+            bytes: The artifact.
+        """
+        arrays = {name: getattr(self, name) for name in [
+            'vectors', 'row_offsets', 'table_schema', 'table_name', 'column_names']}
+        return dump_artifact(ARTIFACT_KIND, ARTIFACT_VERSION, arrays, {'model_name': self.model_name})
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the catalog arrays, mapped or in memory.
+        """
+        arrays = [self.vectors, self.row_offsets]
+        for strings in [self.table_schema, self.table_name, self.column_names]:
+            arrays.extend([strings.data, strings.offsets])
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def column_rows(self) -> np.ndarray:
+        """
+        True for the rows of `vectors` which embed a column name.
+        """
+        if self._column_rows is None:
+            self._column_rows = np.ones(len(self.vectors), dtype=bool)
+            self._column_rows[self.row_offsets[:-1]] = False
+        return self._column_rows
+
+    def search(self, query_vector: np.ndarray, top_k=10, min_similarity=0.0, column_weight=DEFAULT_COLUMN_WEIGHT):
+        """
+        Returns the tables closest to a query embedding.
+
+        Args:
+            query_vector (np.ndarray): Normalised query embedding, see `embed_query`.
+            top_k (int): Maximum number of tables to return.
+            min_similarity (float): Tables below this cosine similarity are omitted.
+            column_weight (float): Weight of the column similarities relative to the table name.
+
+        Returns:
+            tuple: Table ids and their scores, by decreasing score.
+        """
+        n_tables = len(self.row_offsets) - 1
+        if n_tables == 0 or top_k < 1 or not query_vector.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        similarities = self.vectors @ query_vector.astype(np.float32, copy=False)
+        similarities[self.column_rows] *= column_weight
+        scores = np.maximum.reduceat(similarities, self.row_offsets[:-1])
+        table_ids = np.flatnonzero(scores > min_similarity)
+        if len(table_ids) > top_k:
+            table_ids = table_ids[np.argpartition(-scores[table_ids], top_k - 1)[:top_k]]
+        table_ids = table_ids[np.lexsort((table_ids, -scores[table_ids]))]
+        return table_ids, scores[table_ids]
+
+    def get_tables(self, table_ids: np.ndarray) -> pd.DataFrame:
+        """
+        Returns the given tables in the `df_table_columns` layout, in order.
+
+        Args:
+            table_ids (np.ndarray): Table ids.
+
+        Returns:
+            pd.DataFrame: Columns `table_schema`, `table_name` and `column_name` (list of columns).
+        """
+        columns = [list(self.column_names[self.row_offsets[i] - i:self.row_offsets[i + 1] - i - 1]) for i in table_ids]
+        return pd.DataFrame({
+            'table_schema': self.table_schema[table_ids],
+            'table_name': self.table_name[table_ids],
+            'column_name': columns
+        })
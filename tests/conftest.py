@@ -0,0 +1,4 @@
+import os, sys
+
+# Modules of sql_generator import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sql_generator'))
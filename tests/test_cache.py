@@ -0,0 +1,14 @@
+from cache import LRUCache
+
+
+def test_contains_respects_ttl():
+    now = [0.0]
+    cache = LRUCache(ttl=5, clock=lambda: now[0])
+    cache.put('a', 1)
+    cache.put('b', 2, age=4)
+    assert 'a' in cache and 'b' in cache
+    now[0] = 2
+    assert 'a' in cache and 'b' not in cache
+    now[0] = 5
+    assert 'a' not in cache
+    assert len(cache) == 0 and cache.expirations == 2
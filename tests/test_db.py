@@ -0,0 +1,19 @@
+import pytest
+
+from db import normalize_sql
+
+
+@pytest.mark.parametrize('query, expected', [
+    ("SELECT  *\n FROM  Film -- all films\n WHERE title = 'AbC' /* note */ ;", "select * from film where title = 'AbC'"),
+    ('SELECT "Title" FROM Film', 'select "Title" from film'),
+    ("SELECT $$ABC$$", "select $$ABC$$"),
+    ("SELECT $tag$A;B$tag$ FROM Film", "select $tag$A;B$tag$ from film"),
+    ("SELECT E'A\\'B' FROM Film", "select E'A\\'B' from film"),
+])
+def test_normalize_sql(query, expected):
+    assert normalize_sql(query) == expected
+
+
+def test_normalize_sql_keeps_case_of_dollar_quoted_and_escape_strings():
+    assert normalize_sql("SELECT $$ABC$$") != normalize_sql("SELECT $$abc$$")
+    assert normalize_sql("SELECT E'ABC\\n'") != normalize_sql("SELECT E'abc\\n'")
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import minsearch
+
+DOCS = [
+    {'id': 1, 'title': 'rental payments', 'description': 'payments of every rental by customer', 'schema': 'public'},
+    {'id': 2, 'title': 'film actors', 'description': 'actors playing in a film', 'schema': 'public'},
+    {'id': 3, 'title': 'customer addresses', 'description': 'address and city of a customer', 'schema': 'sales'},
+]
+
+
+def make_index(layout=minsearch.LAYOUT_FIELDS):
+    index = minsearch.Index(['title', 'description'], ['schema'], id_field='id', layout=layout)
+    return index.fit(DOCS)
+
+
+def test_add_rejects_duplicate_ids_in_batch():
+    index = make_index()
+    with pytest.raises(ValueError):
+        index.add([{'id': 100, 'title': 'store staff'}, {'id': 100, 'title': 'store inventory'}])
+    assert 100 not in index._id_to_row
+    index.add([{'id': 100, 'title': 'store staff'}])
+    index.remove(100)
+    assert [doc['id'] for doc in index.search('store staff')] == []
+
+
+def test_compact_after_removing_every_document():
+    index = make_index()
+    for doc in DOCS:
+        index.remove(doc['id'])
+    index.compact()
+    assert index.search('customer') == []
+    assert index.search_many(['customer', 'film']) == [[], []]
+    index.add([{'id': 4, 'title': 'customer payments', 'description': 'payments by customer', 'schema': 'public'}])
+    assert [doc['id'] for doc in index.search('customer')] == [4]
+
+
+def synthetic_docs(n_docs=300, seed=0):
+    rng = np.random.default_rng(seed)
+    words = [f"word{i}" for i in range(60)]
+    return [{
+        'id': i,
+        'title': ' '.join(rng.choice(words, size=3)),
+        'description': ' '.join(rng.choice(words, size=12)),
+        'schema': ['public', 'sales', 'hr'][i % 3]
+    } for i in range(n_docs)]
+
+
+QUERIES = ['word1 word2', 'word3 word17 word42', 'word5', 'word10 word11 word12 word13', 'word59 word0']
+
+
+@pytest.mark.parametrize('filter_dict, boost_dict', [
+    ({}, {}),
+    ({}, {'title': 3.0, 'description': 0.5}),
+    ({'schema': 'sales'}, {}),
+    ({'schema': 'hr'}, {'title': 0.2, 'description': 2.0}),
+])
+def test_fused_layout_ranks_like_fields_layout(filter_dict, boost_dict):
+    docs = synthetic_docs()
+    fields = minsearch.Index(['title', 'description'], ['schema'], id_field='id').fit(docs)
+    fused = minsearch.Index(['title', 'description'], ['schema'], id_field='id', layout=minsearch.LAYOUT_FUSED).fit(docs)
+    for query in QUERIES:
+        expected = [doc['id'] for doc in fields.search(query, filter_dict, boost_dict, num_results=10)]
+        assert [doc['id'] for doc in fused.search(query, filter_dict, boost_dict, num_results=10)] == expected
+    assert [[doc['id'] for doc in result] for result in fused.search_many(QUERIES, filter_dict, boost_dict, num_results=10)] == \
+        [[doc['id'] for doc in result] for result in fields.search_many(QUERIES, filter_dict, boost_dict, num_results=10)]
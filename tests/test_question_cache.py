@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from question_cache import QuestionCache
+
+VOCABULARY = ['list', 'films', 'film', 'released', 'customers', 'who', 'rented', 'before', 'after', 'not', 'never']
+
+
+class StubWordVectors:
+    """
+    Random word vectors with the KeyedVectors attributes used by the cache.
+    """
+
+    def __init__(self, words, dim=16, seed=0):
+        self.key_to_index = {word: i for i, word in enumerate(words)}
+        vectors = np.random.default_rng(seed).normal(size=(len(words), dim)).astype(np.float32)
+        self._normed = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def get_normed_vectors(self):
+        return self._normed
+
+
+class StubPreProcessor:
+
+    def __init__(self, word_vectors):
+        self.word_vectors = word_vectors
+
+    def is_ready(self):
+        return True
+
+    def get_model(self):
+        return 'stub', self.word_vectors
+
+
+@pytest.fixture
+def cache():
+    cache = QuestionCache(StubPreProcessor(StubWordVectors(VOCABULARY)))
+    cache.add('c1', 'db', 'list films released before 2006', 'SELECT title FROM film WHERE release_year < 2006')
+    cache.add('c2', 'db', 'list customers who rented a film', 'SELECT * FROM customer WHERE customer_id IN (...)')
+    return cache
+
+
+def test_same_question_hits(cache):
+    match = cache.lookup('db', 'List the films released before 2006')
+    assert match is not None and match['conversation_id'] == 'c1'
+    assert cache.lookup('db', 'list customers who rented a film')['conversation_id'] == 'c2'
+
+
+@pytest.mark.parametrize('question', [
+    'list films released after 2006',
+    'list films not released before 2006',
+    "list films that weren't released before 2006",
+])
+def test_before_after_questions_miss(cache, question):
+    assert cache.lookup('db', question) is None
+
+
+@pytest.mark.parametrize('question', [
+    'list customers who never rented a film',
+    'list customers who not rented a film',
+    "list customers who haven't rented a film",
+])
+def test_negated_questions_miss(cache, question):
+    assert cache.lookup('db', question) is None
+
+
+def test_other_database_misses(cache):
+    assert cache.lookup('other', 'list films released before 2006') is None